@@ -0,0 +1,3 @@
+"""
+Performance benchmarks for vocab_tools using synthetic SKOS vocabularies.
+"""
@@ -0,0 +1,176 @@
+"""
+Time the main VocabularyStore operations on synthetic vocabularies.
+
+e.g.: python -m benchmarks.run -n 1000 -n 10000 -o bench.json
+"""
+import datetime
+import io
+import json
+import logging
+import os
+import platform
+import sys
+import tempfile
+import time
+import typing
+
+import click
+import rdflib
+
+import vocab_tools
+import vocab_tools.tomarkdown
+import vocab_tools.uijson
+import vocab_tools.validation
+from benchmarks import synthetic
+
+L = logging.getLogger("benchmarks")
+
+DEFAULT_SIZES = (1000, 10000, 100000)
+
+# Operations timed by run_benchmark, in the order they are run
+STEPS = (
+    "load",
+    "concepts",
+    "concepts_bulk",
+    "concept",
+    "walk_narrower",
+    "describe_vocabulary",
+    "render_cached",
+    "uijson",
+    "check_structure",
+    "validate",
+)
+
+# Number of concept() lookups timed
+CONCEPT_SAMPLE = 1000
+
+
+class _Timer:
+    def __init__(self):
+        self.timings = {}
+
+    def __call__(self, name: str, func: typing.Callable, *args, **kwargs):
+        t0 = time.perf_counter()
+        result = func(*args, **kwargs)
+        self.timings[name] = time.perf_counter() - t0
+        L.info("%s: %.3fs", name, self.timings[name])
+        return result
+
+
+def _cached_markdown(paths: typing.List[str], cache_path: str) -> str:
+    """Return the markdown of paths as markdown --cache does when they are unchanged."""
+    cache = vocab_tools.tomarkdown.RenderCache(cache_path)
+    return cache.get(vocab_tools.tomarkdown.render_key(paths))["-"]
+
+
+def run_benchmark(
+    spec: synthetic.SyntheticVocabulary,
+    folder: str,
+    steps: typing.Iterable[str] = STEPS,
+) -> dict:
+    """Generate the vocabulary described by spec in folder and time steps on it.
+
+    Returns a dict of the spec, the store size and the seconds for each step.
+    """
+    steps = set(steps)
+    paths = synthetic.generate(spec, folder)
+    timer = _Timer()
+    store = vocab_tools.VocabularyStore()
+
+    def _load():
+        for path in paths:
+            store.load(path)
+
+    timer("load", _load)
+    base = store.base_vocabulary()
+    top = store.top_concept()[0]
+    if "concepts" in steps:
+        uris = timer("concepts", store.concepts)
+    else:
+        uris = store.concepts()
+    if "concepts_bulk" in steps:
+        timer("concepts_bulk", store.concepts_bulk)
+    if "concept" in steps:
+        stride = max(1, len(uris) // CONCEPT_SAMPLE)
+        sample = uris[::stride][:CONCEPT_SAMPLE]
+        timer("concept", lambda: [store.concept(uri) for uri in sample])
+    if "walk_narrower" in steps:
+        timer("walk_narrower", lambda: list(store.walk_narrower(top.uri)))
+    if "describe_vocabulary" in steps:
+        timer(
+            "describe_vocabulary",
+            vocab_tools.tomarkdown.write_vocabulary,
+            store,
+            base.uri,
+            io.StringIO(),
+        )
+    if "render_cached" in steps:
+        # Compare with load and describe_vocabulary, which it replaces
+        dest = io.StringIO()
+        vocab_tools.tomarkdown.write_vocabulary(store, base.uri, dest)
+        cache_path = os.path.join(folder, "render_cache.json")
+        cache = vocab_tools.tomarkdown.RenderCache(cache_path)
+        cache.put(vocab_tools.tomarkdown.render_key(paths), {"-": dest.getvalue()})
+        cache.save()
+        timer("render_cached", _cached_markdown, paths, cache_path)
+    if "uijson" in steps:
+        timer(
+            "uijson",
+            vocab_tools.uijson.write_uijson,
+            store,
+            io.StringIO(),
+            extensions=True,
+        )
+    if "check_structure" in steps:
+        timer("check_structure", vocab_tools.validation.check_structure, store)
+    if "validate" in steps:
+        # RDFS inference as before, rather than "auto", to keep timings comparable
+        timer("validate", vocab_tools.validation.validate_store, store, inference="rdfs")
+    return {
+        "spec": vars(spec).copy(),
+        "triples": len(store),
+        "concepts": len(uris),
+        "timings": timer.timings,
+    }
+
+
+@click.command()
+@click.option("-n", "--concepts", "sizes", type=int, multiple=True, help="Number of concepts (repeatable)")
+@click.option("--depth", default=6, help="Maximum depth of the base vocabulary hierarchy")
+@click.option("--fanout", default=8, help="Narrower concepts per concept")
+@click.option("--extensions", default=2, help="Number of extension vocabulary layers")
+@click.option("--step", "steps", multiple=True, type=click.Choice(STEPS), help="Only time these steps (repeatable)")
+@click.option("--skip", multiple=True, type=click.Choice(STEPS), help="Do not time these steps (repeatable)")
+@click.option("-o", "--output", default=None, help="Write results as JSON to this file")
+def main(sizes, depth, fanout, extensions, steps, skip, output):
+    """Benchmark vocab_tools on synthetic vocabularies of increasing size."""
+    logging.basicConfig(level="INFO", format="%(message)s")
+    if len(sizes) == 0:
+        sizes = DEFAULT_SIZES
+    if len(steps) == 0:
+        steps = STEPS
+    steps = [s for s in steps if s not in skip]
+    results = {
+        "created": datetime.datetime.now(tz=datetime.timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "rdflib": rdflib.__version__,
+        "runs": [],
+    }
+    for n in sizes:
+        spec = synthetic.SyntheticVocabulary(
+            n_concepts=n, depth=depth, fanout=fanout, extension_layers=extensions
+        )
+        L.info("Benchmark %s", spec)
+        with tempfile.TemporaryDirectory() as folder:
+            results["runs"].append(run_benchmark(spec, folder, steps=steps))
+    doc = json.dumps(results, indent=2)
+    if output is None:
+        print(doc)
+    else:
+        with open(output, "w") as dest:
+            dest.write(doc)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,148 @@
+"""
+Generate synthetic SKOS vocabularies for benchmarking.
+
+The generated files follow the structure of example/data/example.ttl and
+example/data/extension_example.ttl: a base vocabulary with a single top
+concept, and a chain of extension vocabularies, each skos:inScheme the
+previous one, with concepts that are skos:broader than concepts of the
+vocabulary they extend.
+"""
+import dataclasses
+import os
+import random
+import typing
+
+PREFIXES = """@prefix owl: <http://www.w3.org/2002/07/owl#> .
+@prefix rdf: <http://www.w3.org/1999/02/22-rdf-syntax-ns#> .
+@prefix skos: <http://www.w3.org/2004/02/skos/core#> .
+"""
+
+BASE_NS = "https://example.net/synthetic/"
+
+
+@dataclasses.dataclass
+class SyntheticVocabulary:
+    n_concepts: int
+    depth: int = 6
+    fanout: int = 8
+    extension_layers: int = 0
+    seed: int = 0
+
+    def layer_sizes(self) -> typing.List[int]:
+        """Number of concepts in the base vocabulary and each extension."""
+        layers = self.extension_layers + 1
+        sizes = [self.n_concepts // layers] * layers
+        sizes[0] += self.n_concepts - sum(sizes)
+        return sizes
+
+
+def _parents(n: int, depth: int, fanout: int) -> typing.List[typing.Tuple[int, int]]:
+    """Return (parent index, level) for n nodes of a tree rooted at node 0.
+
+    Nodes are placed breadth first with up to fanout children each, and no
+    deeper than depth. Once the tree is full, additional nodes are spread
+    over the nodes of the deepest non leaf level.
+    """
+    depth = max(1, depth)
+    res = [(-1, 0)]
+    open_nodes = [0]
+    children = [0]
+    cursor = 0
+    # Nodes of the deepest level that may have children
+    last_level = [0] if depth == 1 else []
+    for i in range(1, n):
+        while cursor < len(open_nodes) and children[open_nodes[cursor]] >= fanout:
+            cursor += 1
+        if cursor < len(open_nodes):
+            p = open_nodes[cursor]
+        else:
+            p = last_level[i % len(last_level)]
+        level = res[p][1] + 1
+        res.append((p, level))
+        children[p] += 1
+        children.append(0)
+        if level < depth:
+            open_nodes.append(i)
+            if level == depth - 1:
+                last_level.append(i)
+    return res
+
+
+def _literal(text: str) -> str:
+    return '"' + text.replace("\\", "\\\\").replace('"', '\\"') + '"@en'
+
+
+def _scheme(prefix: str, label: str, extends: typing.Optional[str]) -> typing.List[str]:
+    res = [
+        f"{prefix}:vocab",
+        "    rdf:type skos:ConceptScheme ;",
+        f"    skos:prefLabel {_literal(label)} ;",
+        f"    skos:definition {_literal('Synthetic vocabulary ' + label + ' for benchmarking.')} ;",
+        f"    skos:historyNote {_literal('Generated by benchmarks.synthetic')} ;",
+    ]
+    if extends is not None:
+        res.append(f"    skos:inScheme {extends} ;")
+    res += [".", ""]
+    return res
+
+
+def _concept(
+    prefix: str, i: int, broader: typing.Optional[str], top: bool
+) -> typing.List[str]:
+    res = [
+        f"{prefix}:c{i}",
+        "    rdf:type skos:Concept ;",
+    ]
+    if top:
+        res.append(f"    skos:topConceptOf {prefix}:vocab ;")
+    else:
+        res.append(f"    skos:inScheme {prefix}:vocab ;")
+        res.append(f"    skos:broader {broader} ;")
+    res += [
+        f"    skos:prefLabel {_literal(f'{prefix} concept {i}')} ;",
+        f"    skos:altLabel {_literal(f'{prefix}-{i}')} ;",
+        f"    skos:definition {_literal(f'Definition of {prefix} concept {i}.')} ;",
+        ".",
+        "",
+    ]
+    return res
+
+
+def generate(spec: SyntheticVocabulary, folder: str) -> typing.List[str]:
+    """Write the vocabulary described by spec to turtle files in folder.
+
+    Returns the paths of the files written, base vocabulary first.
+    """
+    rnd = random.Random(spec.seed)
+    os.makedirs(folder, exist_ok=True)
+    paths = []
+    previous = None
+    for layer, size in enumerate(spec.layer_sizes()):
+        prefix = "syn" if layer == 0 else f"ext{layer}"
+        lines = [PREFIXES.rstrip()]
+        lines.append(f"@prefix {prefix}: <{BASE_NS}{prefix}/> .")
+        if previous is not None:
+            lines.append(f"@prefix {previous[0]}: <{BASE_NS}{previous[0]}/> .")
+        lines.append("")
+        extends = None if previous is None else f"{previous[0]}:vocab"
+        lines += _scheme(prefix, f"Synthetic {prefix}", extends)
+        if previous is None:
+            for i, (parent, _) in enumerate(_parents(size, spec.depth, spec.fanout)):
+                broader = None if parent < 0 else f"{prefix}:c{parent}"
+                lines += _concept(prefix, i, broader, top=parent < 0)
+        else:
+            # Extension concepts form subtrees under concepts of the previous layer
+            prev_prefix, prev_size = previous
+            fanout = max(1, spec.fanout // 2)
+            for i in range(size):
+                if i < fanout or i % (fanout + 1) == 0:
+                    broader = f"{prev_prefix}:c{rnd.randrange(prev_size)}"
+                else:
+                    broader = f"{prefix}:c{rnd.randrange(max(1, i))}"
+                lines += _concept(prefix, i, broader, top=False)
+        path = os.path.join(folder, f"{prefix}.ttl")
+        with open(path, "w", encoding="utf-8") as dest:
+            dest.write("\n".join(lines))
+        paths.append(path)
+        previous = (prefix, size)
+    return paths
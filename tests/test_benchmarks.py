@@ -0,0 +1,33 @@
+import benchmarks.run
+import benchmarks.synthetic
+import vocab_tools
+
+
+def test_synthetic_vocabulary(tmp_path):
+    spec = benchmarks.synthetic.SyntheticVocabulary(
+        n_concepts=60, depth=3, fanout=3, extension_layers=2
+    )
+    paths = benchmarks.synthetic.generate(spec, str(tmp_path))
+    assert len(paths) == 3
+    s = vocab_tools.VocabularyStore()
+    for path in paths:
+        s.load(path)
+    assert len(s.concepts()) == 60
+    assert len(s.vocabularies()) == 3
+    top = s.top_concept()
+    assert len(top) == 1
+    # Every concept is connected to the top concept
+    assert len(list(s.walk_narrower(top[0].uri))) == 59
+    h = s.hierarchy()
+    base = s.concepts_bulk("https://example.net/synthetic/syn/vocab")
+    assert max(h.depth(c.uri) for c in base) == 3
+    v = s.vocabulary("https://example.net/synthetic/ext2/vocab")
+    assert v.extends == "https://example.net/synthetic/ext1/vocab"
+
+
+def test_run_benchmark(tmp_path):
+    spec = benchmarks.synthetic.SyntheticVocabulary(n_concepts=30, extension_layers=1)
+    steps = [s for s in benchmarks.run.STEPS if s != "validate"]
+    result = benchmarks.run.run_benchmark(spec, str(tmp_path), steps=steps)
+    assert result["concepts"] == 30
+    assert set(result["timings"]) == set(steps)
@@ -0,0 +1,56 @@
+import os.path
+
+import vocab_tools
+import vocab_tools.search
+
+THIS_FOLDER = os.path.abspath(os.path.join(os.path.dirname(__file__), "../example"))
+
+
+def _get_store():
+    s = vocab_tools.VocabularyStore()
+    s.load(os.path.join(THIS_FOLDER, "data/example.ttl"))
+    s.load(os.path.join(THIS_FOLDER, "data/extension_example.ttl"))
+    s.load(os.path.join(THIS_FOLDER, "data/extension_extension.ttl"))
+    s.load(os.path.join(THIS_FOLDER, "data/beer.ttl"))
+    return s
+
+
+def test_lookups():
+    index = _get_store().search_index()
+    water = "https://example.net/my/extension/water"
+    assert [h.uri for h in index.exact("Water")] == [water]
+    assert index.exact("water") == []
+    assert [h.uri for h in index.casefold("  WATER ")] == [water]
+    hits = index.casefold("aqua")
+    assert [(h.uri, h.field, h.text) for h in hits] == [(water, "altLabel", "Aqua")]
+    assert water in [h.uri for h in index.prefix("aq")]
+    assert "https://example.net/my/extension/liquid" in [h.uri for h in index.prefix("LIQ")]
+
+
+def test_fuzzy():
+    s = _get_store()
+    hits = s.search_index().fuzzy("imperial stuot")
+    assert hits[0].label == "Russian Imperial Stout"
+    assert all(0 < h.score <= 1 for h in hits)
+    assert [h.score for h in hits] == sorted([h.score for h in hits], reverse=True)
+    assert s.search_index().fuzzy("zzzz") == []
+
+
+def test_search():
+    s = _get_store()
+    hits = s.search("pale ale", limit=3)
+    assert hits[0].label == "Pale Ale"
+    assert hits[0].kind == "casefold"
+    # Fuzzy matches are only looked for when nothing else matches
+    assert [h.kind for h in hits] == ["casefold"]
+    hits = s.search("imperial stuot", limit=3)
+    assert hits[0].label == "Russian Imperial Stout"
+    assert len(hits) == 3
+    assert len({h.uri for h in hits}) == 3
+    assert {h.kind for h in hits} == {"fuzzy"}
+    assert s.search("imperial stuot", fuzzy=False) == []
+    # The index is kept until more is loaded
+    index = s.search_index()
+    assert s.search_index() is index
+    s.load(os.path.join(THIS_FOLDER, "data/example_nolabel.ttl"))
+    assert s.search_index() is not index
@@ -0,0 +1,181 @@
+import os.path
+
+import pytest
+
+pytest.importorskip("rdflib_endpoint")
+pytest.importorskip("httpx")
+
+import fastapi.testclient
+
+import vocab_tools
+import vocab_tools.sparqlr
+
+THIS_FOLDER = os.path.abspath(os.path.join(os.path.dirname(__file__), "../example"))
+
+ACCEPT = {"accept": vocab_tools.sparqlr.DEFAULT_ACCEPT}
+
+
+def test_normalize_query():
+    q = 'SELECT  ?s # comment\n  WHERE { ?s <http://x.org/a#b> "a  b # c" }\n'
+    assert vocab_tools.sparqlr.normalize_query(q) == 'SELECT ?s WHERE { ?s <http://x.org/a#b> "a  b # c" }'
+    key = vocab_tools.sparqlr.ResultCache.key
+    assert key("SELECT  ?s {?s ?p ?o}", "text/csv, */*;q=0.5") == key("SELECT ?s {?s ?p ?o}", "text/csv,*/*;q=0.5")
+
+
+def test_result_cache_eviction():
+    cache = vocab_tools.sparqlr.ResultCache(max_entries=2, max_bytes=10)
+    response = lambda n: vocab_tools.sparqlr.CachedResponse(status=200, headers=[], body=b"x" * n)
+    cache.put(("a", ""), response(4))
+    cache.put(("b", ""), response(4))
+    assert cache.get(("a", "")) is not None
+    cache.put(("c", ""), response(4))
+    assert cache.get(("b", "")) is None
+    cache.put(("d", ""), response(11))
+    assert len(cache) == 2 and cache.size == 8
+    assert cache.stats()["evictions"] == 1
+
+
+def test_cached_endpoint():
+    s = vocab_tools.VocabularyStore()
+    s.load(os.path.join(THIS_FOLDER, "data/example.ttl"))
+    cache = vocab_tools.sparqlr.ResultCache()
+    app = vocab_tools.sparqlr.create_app(s, cache=cache)
+    query = vocab_tools.sparqlr.example_queries["vocabularies"]["query"]
+    with fastapi.testclient.TestClient(app) as client:
+        # The example queries are answered on start up
+        assert len(cache) == len(vocab_tools.sparqlr.example_queries)
+        res = client.get("/", params={"query": query}, headers=ACCEPT)
+        assert res.status_code == 200
+        assert res.headers["x-cache"] == "HIT"
+        vocabs = [b["vocab"]["value"] for b in res.json()["results"]["bindings"]]
+        assert vocabs == ["https://example.net/my/minimal/vocab"]
+        q = "SELECT (COUNT(?s) AS ?n) WHERE { ?s ?p ?o }"
+        res = client.post("/", content=q, headers={"content-type": "application/sparql-query", **ACCEPT})
+        assert res.headers["x-cache"] == "MISS"
+        res = client.get("/", params={"query": q + "\n"}, headers=ACCEPT)
+        assert res.headers["x-cache"] == "HIT"
+        # Loading a vocabulary empties the cache
+        s.load(os.path.join(THIS_FOLDER, "data/extension_example.ttl"))
+        res = client.get("/", params={"query": query}, headers=ACCEPT)
+        assert res.headers["x-cache"] == "HIT"
+        assert len(res.json()["results"]["bindings"]) == 2
+        stats = client.get(vocab_tools.sparqlr.CACHE_STATS_PATH).json()
+        assert stats["invalidations"] == 1
+        assert stats["hits"] == 3 and stats["misses"] == 1
+        assert stats["generation"] == s.generation
+
+
+def test_query_pool():
+    import asyncio
+    import time
+
+    import httpx
+
+    s = vocab_tools.VocabularyStore()
+    s.load(os.path.join(THIS_FOLDER, "data/example.ttl"))
+    pool = vocab_tools.sparqlr.QueryPool(max_concurrent=2, max_queue=0, timeout=3.0)
+    app = vocab_tools.sparqlr.create_app(s, pool=pool)
+    # Evaluated by rdflib for far longer than the timeout
+    slow = "SELECT (COUNT(*) AS ?n) WHERE {{ ?a ?b ?c . ?d ?e ?f . ?g ?h ?i . ?j ?k ?l . ?m ?n{} ?o }}"
+    fast = "ASK {{ ?s ?p{} ?o }}"
+    accept = {"accept": "application/sparql-results+json"}
+
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+
+            async def query(q):
+                res = await client.get("/", params={"query": q}, headers=accept)
+                return res.status_code
+
+            # Starts the workers
+            assert await query(fast.format(0)) == 200
+            started = time.monotonic()
+            first = asyncio.create_task(query(slow.format(1)))
+            await asyncio.sleep(0.2)
+            # Answered by the other worker while the slow query runs
+            assert await query(fast.format(1)) == 200
+            second = asyncio.create_task(query(slow.format(2)))
+            await asyncio.sleep(0.2)
+            # Both workers are busy and nothing may wait
+            assert await query(fast.format(2)) == 503
+            assert [await first, await second] == [504, 504]
+            assert time.monotonic() - started < 5.0
+            # The killed workers are replaced
+            assert await query(fast.format(3)) == 200
+
+    try:
+        asyncio.run(run())
+    finally:
+        pool.close()
+    assert pool.refused == 1 and pool.timed_out == 2
+
+
+def test_lookup_api():
+    s = vocab_tools.VocabularyStore()
+    s.load(os.path.join(THIS_FOLDER, "data/example.ttl"))
+    s.load(os.path.join(THIS_FOLDER, "data/extension_example.ttl"))
+    app = vocab_tools.sparqlr.create_app(s)
+    with fastapi.testclient.TestClient(app) as client:
+        res = client.get("/concept/ext:water")
+        assert res.status_code == 200
+        water = res.json()
+        assert water["uri"] == "https://example.net/my/extension/water"
+        assert water["label"] == "Water"
+        assert [b["curie"] for b in water["broader"]] == ["ext:liquid"]
+        assert water["path"][0] == "https://example.net/my/minimal/thing"
+        # Full URIs and labels are accepted too
+        res = client.get("/concept/https%3A%2F%2Fexample.net%2Fmy%2Fextension%2Fwater")
+        assert res.json()["uri"] == water["uri"]
+        assert client.get("/concept/Aqua").json()["uri"] == water["uri"]
+        assert client.get("/concept/nothing").status_code == 404
+        children = client.get("/children/ext:liquid").json()
+        assert [c["uri"] for c in children] == ["https://example.net/my/extension/water"]
+        ancestors = client.get("/ancestors/ext:water").json()
+        assert [(a["curie"], a["distance"]) for a in ancestors][0] == ("ext:liquid", 1)
+        tree = client.get("/tree/eg:thing", params={"depth": 1}).json()
+        assert all(c["children"] == [] for c in tree["children"])
+        hits = client.get("/search", params={"q": "water"}).json()
+        assert hits[0]["uri"] == water["uri"]
+        # Conditional requests
+        res = client.get("/concept/ext:water")
+        etag = res.headers["etag"]
+        res = client.get("/concept/ext:water", headers={"if-none-match": etag})
+        assert res.status_code == 304 and res.content == b""
+        s.load(os.path.join(THIS_FOLDER, "data/extension_extension.ttl"))
+        res = client.get("/concept/ext:water", headers={"if-none-match": etag})
+        assert res.status_code == 200 and res.headers["etag"] != etag
+
+
+def test_reloading_app(tmp_path):
+    sources = []
+    for name in ("example.ttl", "extension_example.ttl"):
+        dest = tmp_path / name
+        dest.write_text(open(os.path.join(THIS_FOLDER, "data", name)).read())
+        sources.append(str(dest))
+    s = vocab_tools.VocabularyStore()
+    s.load_many(sources)
+    app = vocab_tools.sparqlr.ReloadingApp(s, sources, interval=60)
+    with fastapi.testclient.TestClient(app) as client:
+        etag = client.get("/concept/ext:water").headers["etag"]
+        # Nothing changed since loading
+        assert not app.check()
+        with open(sources[1], "a") as dest:
+            dest.write('\next:water skos:altLabel "Eau"@fr .\n')
+        assert app.check()
+        assert app.reloads == 1 and app.store is not s
+        res = client.get("/concept/ext:water", headers={"if-none-match": etag})
+        assert res.status_code == 200
+        assert res.json()["labels"]["fr"]["alt"] == ["Eau"]
+        assert not app.check()
+        # A source that fails to parse is tried again at the next check
+        with open(sources[1], "a") as dest:
+            dest.write("\next:water skos:altLabel\n")
+        for _ in range(2):
+            with pytest.raises(Exception):
+                app.check()
+        assert app.reloads == 1
+        with open(sources[1], "w") as dest:
+            dest.write(open(os.path.join(THIS_FOLDER, "data", "extension_example.ttl")).read())
+        assert app.check()
+        assert app.reloads == 2
@@ -0,0 +1,122 @@
+import io
+import os.path
+import re
+
+import vocab_tools
+import vocab_tools.tomarkdown
+
+THIS_FOLDER = os.path.abspath(os.path.join(os.path.dirname(__file__), "../example"))
+
+
+def _get_store_for_all():
+    s = vocab_tools.VocabularyStore()
+    s.load(os.path.join(THIS_FOLDER, "data/example.ttl"))
+    s.load(os.path.join(THIS_FOLDER, "data/extension_example.ttl"))
+    s.load(os.path.join(THIS_FOLDER, "data/extension_extension.ttl"))
+    return s
+
+
+def _without_date(lines):
+    return [line for line in lines if not line.startswith("date:")]
+
+
+class _CountingWriter(io.StringIO):
+    def __init__(self):
+        super().__init__()
+        self.writes = 0
+
+    def write(self, s):
+        self.writes += 1
+        return super().write(s)
+
+
+def test_write_vocabulary():
+    s = _get_store_for_all()
+    vocab = s.base_vocabulary()
+    lines = vocab_tools.tomarkdown.describe_vocabulary(s, vocab.uri)
+    dest = _CountingWriter()
+    n = vocab_tools.tomarkdown.write_vocabulary(s, vocab.uri, dest, buffer_size=256)
+    assert n == len(lines)
+    assert dest.writes > 1
+    expected = "\n".join(lines) + "\n"
+    assert _without_date(dest.getvalue().split("\n")) == _without_date(expected.split("\n"))
+
+
+def test_iter_vocabulary_sections():
+    s = _get_store_for_all()
+    sections = list(vocab_tools.tomarkdown.iter_vocabulary(s, s.base_vocabulary().uri))
+    assert sections[0][0] == "---"
+    # Frontmatter, hierarchy, then one section per concept in each top concept tree
+    n = sum(1 + len(list(s.walk_narrower(tc.uri))) for tc in s.top_concept())
+    assert len(sections) == 2 + n
+
+
+def test_write_vocabulary_parts(tmp_path):
+    s = _get_store_for_all()
+    paths = vocab_tools.tomarkdown.write_vocabulary_parts(s, str(tmp_path), max_workers=2)
+    names = [os.path.basename(p) for p in paths]
+    assert names == ["eg_vocab.md", "ext_vocab.md", "ext2_vocab.md"]
+    with open(paths[1]) as src:
+        ext = src.read()
+    assert "**Extended concepts:**" in ext
+    assert "[`https://example.net/my/minimal/thing`]" in ext
+    assert "\n## Liquid\n" in ext
+    assert "\n## Thing\n" not in ext
+    with open(paths[0]) as src:
+        base = src.read()
+    assert "\n## Thing\n" in base
+    assert "Water" not in base
+
+
+def test_write_vocabulary_parts_links(tmp_path):
+    s = _get_store_for_all()
+    s.load(os.path.join(THIS_FOLDER, "data/beer.ttl"))
+    paths = vocab_tools.tomarkdown.write_vocabulary_parts(s, str(tmp_path), max_workers=1)
+    anchors = {}
+    for path in paths:
+        with open(path) as src:
+            anchors[os.path.basename(path)] = set(re.findall(r"\[\]\{#([^}]+)\}", src.read()))
+    n_other = 0
+    for path in paths:
+        name = os.path.basename(path)
+        with open(path) as src:
+            links = re.findall(r"\]\(([^)#]*)#([^)]+)\)", src.read())
+        for document, anchor in links:
+            if document != "":
+                n_other += 1
+            assert anchor in anchors[document or name], f"{name}: {document}#{anchor}"
+    assert n_other > 0
+    with open(os.path.join(tmp_path, "ext2_vocab.md")) as src:
+        ext2 = src.read()
+    assert "[`Thing`](eg_vocab.md#thing)" in ext2
+    assert "[`Ale`](beer_vocab.md#ale)" in ext2
+
+
+def test_render_cache(tmp_path):
+    source = tmp_path / "example.ttl"
+    with open(os.path.join(THIS_FOLDER, "data/example.ttl"), "r", encoding="utf-8") as src:
+        source.write_text(src.read())
+    key = vocab_tools.tomarkdown.render_key([str(source)])
+    assert key != vocab_tools.tomarkdown.render_key([str(source)], split=True)
+    # Remote sources are not cached
+    assert vocab_tools.tomarkdown.render_key([str(source), "https://example.net/vocab.ttl"]) is None
+
+    s = vocab_tools.VocabularyStore()
+    s.load(str(source))
+    dest = io.StringIO()
+    vocab_tools.tomarkdown.write_vocabulary(s, s.base_vocabulary().uri, dest)
+    path = str(tmp_path / "cache.json")
+    cache = vocab_tools.tomarkdown.RenderCache(path)
+    assert cache.get(key) is None
+    cache.put(key, {"-": dest.getvalue()})
+    cache.save()
+
+    cache = vocab_tools.tomarkdown.RenderCache(path)
+    cached = cache.get(key)["-"]
+    assert (cache.hits, cache.misses) == (1, 0)
+    assert _without_date(cached.split("\n")) == _without_date(dest.getvalue().split("\n"))
+    assert len([line for line in cached.split("\n") if line.startswith("date:")]) == 1
+
+    # Any change to a source changes the key
+    source.write_text(source.read_text() + "\n# edited\n")
+    assert vocab_tools.tomarkdown.render_key([str(source)]) != key
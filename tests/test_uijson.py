@@ -0,0 +1,76 @@
+import io
+import json
+import os.path
+
+import vocab_tools
+import vocab_tools.uijson
+
+THIS_FOLDER = os.path.abspath(os.path.join(os.path.dirname(__file__), "../example"))
+
+
+def _get_store():
+    s = vocab_tools.VocabularyStore()
+    s.load(os.path.join(THIS_FOLDER, "data/example.ttl"))
+    s.load(os.path.join(THIS_FOLDER, "data/extension_example.ttl"))
+    s.load(os.path.join(THIS_FOLDER, "data/extension_extension.ttl"))
+    return s
+
+
+def test_write_uijson():
+    s = _get_store()
+    dest = io.StringIO()
+    vocab_tools.uijson.write_uijson(s, dest)
+    doc = json.loads(dest.getvalue())
+    assert doc == {
+        "https://example.net/my/minimal/thing": {
+            "label": {"en": "Thing"},
+            "children": [
+                {
+                    "https://example.net/my/minimal/solid": {
+                        "label": {"en": "Solid"},
+                        "children": [],
+                    }
+                }
+            ],
+        }
+    }
+    assert dest.getvalue() == json.dumps(doc, indent=2) + "\n"
+
+
+def test_write_uijson_extensions():
+    s = _get_store()
+    dest = io.StringIO()
+    n = vocab_tools.uijson.write_uijson(s, dest, extensions=True, compact=True, buffer_size=10)
+    text = dest.getvalue()
+    assert n == len(text)
+    doc = json.loads(text)
+    assert text == json.dumps(doc, separators=(",", ":")) + "\n"
+    thing = doc["https://example.net/my/minimal/thing"]
+    children = [list(c.keys())[0] for c in thing["children"]]
+    assert "https://example.net/my/extension/liquid" in children
+    liquid = [c for c in thing["children"] if "https://example.net/my/extension/liquid" in c][0]
+    water = liquid["https://example.net/my/extension/liquid"]["children"]
+    assert {list(c.keys())[0] for c in water} == {
+        "https://example.net/my/extension/water",
+        "https://example.net/my/extension2/beer",
+    }
+
+
+def test_write_uijson_languages(tmp_path):
+    labels = tmp_path / "labels.ttl"
+    labels.write_text(
+        """@prefix skos: <http://www.w3.org/2004/02/skos/core#> .
+@prefix eg: <https://example.net/my/minimal/> .
+eg:thing skos:prefLabel "Ding"@de .
+"""
+    )
+    s = _get_store()
+    s.load(str(labels))
+    dest = io.StringIO()
+    vocab_tools.uijson.write_uijson(s, dest, languages=["en", "de"])
+    doc = json.loads(dest.getvalue())
+    thing = doc["https://example.net/my/minimal/thing"]
+    assert thing["label"] == {"en": "Thing", "de": "Ding"}
+    solid = thing["children"][0]["https://example.net/my/minimal/solid"]
+    assert solid["label"] == {"en": "Solid", "de": "Solid"}
+    assert dest.getvalue() == json.dumps(doc, indent=2) + "\n"
@@ -0,0 +1,105 @@
+import os.path
+
+import rdflib
+
+import vocab_tools
+import vocab_tools.validation
+
+THIS_FOLDER = os.path.abspath(os.path.join(os.path.dirname(__file__), "../example"))
+
+
+def test_shape_parsed_once():
+    assert vocab_tools.validation.get_shape() is vocab_tools.validation.get_shape()
+
+
+def test_needs_rdfs_inference():
+    s = vocab_tools.VocabularyStore()
+    s.load(os.path.join(THIS_FOLDER, "data/example.ttl"))
+    s.load(os.path.join(THIS_FOLDER, "data/extension_example.ttl"))
+    # The recorded vocabulary extensions do not call for inference
+    assert not vocab_tools.validation.needs_rdfs_inference(s.graph)
+    g = rdflib.Graph()
+    ex = rdflib.Namespace("https://example.net/")
+    g.add((ex.Thing, rdflib.RDFS.subClassOf, rdflib.SKOS.Concept))
+    assert vocab_tools.validation.needs_rdfs_inference(g)
+
+
+def test_validate_store():
+    s = vocab_tools.VocabularyStore()
+    s.load(os.path.join(THIS_FOLDER, "data/example.ttl"))
+    result = vocab_tools.validation.validate_store(s)
+    assert result.conforms
+    assert result.inference is None
+    s = vocab_tools.VocabularyStore()
+    s.load(os.path.join(THIS_FOLDER, "data/example_notop.ttl"))
+    conforms, graph, text = vocab_tools.validation.validate_store(s, inference="rdfs")
+    assert not conforms
+    assert "BaseVocabularyShape" in text
+
+
+def test_validation_cache(tmp_path):
+    cache = vocab_tools.validation.ValidationCache(str(tmp_path))
+    s = vocab_tools.VocabularyStore()
+    s.load(os.path.join(THIS_FOLDER, "data/example_notop.ttl"))
+    first = vocab_tools.validation.validate_store(s, cache=cache)
+    assert not first.cached
+    second = vocab_tools.validation.validate_store(s, cache=cache)
+    assert second.cached
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert second.conforms == first.conforms
+    assert second.text == first.text
+    assert len(second.graph) == len(first.graph)
+    # A source without a content hash, here a file: URI, is never cached
+    s = vocab_tools.VocabularyStore()
+    s.load(os.path.join(THIS_FOLDER, "data/example_notop.ttl"))
+    remote = "file://" + os.path.join(THIS_FOLDER, "data/extension_example.ttl")
+    s.load(remote)
+    assert s.sources()[remote] is None
+    assert vocab_tools.validation.validation_key(s.sources(), "shape.ttl", "None") is None
+    assert not vocab_tools.validation.validate_store(s, cache=cache).cached
+    assert not vocab_tools.validation.validate_store(s, cache=cache).cached
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_check_structure():
+    s = vocab_tools.VocabularyStore()
+    s.load(os.path.join(THIS_FOLDER, "data/example.ttl"))
+    assert vocab_tools.validation.check_structure(s).conforms
+    s = vocab_tools.VocabularyStore()
+    s.load(os.path.join(THIS_FOLDER, "data/example_notop.ttl"))
+    conforms, graph, text = vocab_tools.validation.check_structure(s)
+    assert not conforms
+    assert "BaseVocabularyShape" in text
+    assert "eg:solid is not connected to a top concept" in text
+    assert (None, rdflib.SH.conforms, rdflib.Literal(False)) in graph
+
+
+def test_check_structure_resolves_terms():
+    extension = os.path.join(THIS_FOLDER, "data/extension_example.ttl")
+    s = vocab_tools.VocabularyStore()
+    s.load(extension)
+    result = vocab_tools.validation.check_structure(s)
+    assert not result.conforms
+    assert "Unresolved term eg:thing on ext:liquid->skos:broader" in result.text
+    s.load(os.path.join(THIS_FOLDER, "data/example.ttl"))
+    result = vocab_tools.validation.check_structure(s, focus=s.source_graph(extension))
+    assert result.conforms
+    eg = rdflib.Namespace("https://example.net/my/minimal/")
+    s.graph.add((eg.thing, rdflib.SKOS.broader, rdflib.URIRef("https://example.net/my/extension/water")))
+    s.hierarchy().add(eg.thing, "https://example.net/my/extension/water")
+    result = vocab_tools.validation.check_structure(s)
+    assert "Cycle of skos:broader" in result.text
+
+
+def test_validate_sources():
+    names = ["extension_extension.ttl", "example.ttl", "extension_example.ttl", "example_notop.ttl"]
+    sources = [os.path.join(THIS_FOLDER, "data", name) for name in names]
+    reports = vocab_tools.validation.validate_sources(sources, max_workers=2)
+    assert [r.source for r in reports] == sources
+    assert [r.conforms for r in reports] == [True, True, True, False]
+    assert reports[0].bases == [sources[1], sources[2]]
+    assert reports[3].stage == "shacl"
+    assert all(r.seconds > 0 for r in reports)
+    reports = vocab_tools.validation.validate_sources(sources[3:], fast=True, max_workers=1)
+    assert reports[0].stage == "structure"
+    assert not reports[0].conforms
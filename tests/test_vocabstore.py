@@ -1,4 +1,9 @@
+import array
+import dataclasses
+import json
+import pickle
 import vocab_tools
+import rdflib
 import os.path
 
 THIS_FOLDER = os.path.abspath(os.path.join(os.path.dirname(__file__), "../example"))
@@ -92,3 +97,447 @@ def test_walk_narrower():
         counter += 1
         print(f"{'-'*(depth)} {cn}")
     assert counter == 4
+
+
+def test_concepts_bulk():
+    s = _get_store_for_all()
+    cs = s.concepts_bulk()
+    assert [c.uri for c in cs] == [str(c) for c in s.concepts()]
+    water = s.concept("ext:water")
+    assert water.label == ["Water", "Aqua", "H2O"]
+    assert water.broader == ["https://example.net/my/extension/liquid"]
+    assert len(water.notes) == 2
+    liquid = s.concept("ext:liquid")
+    assert [str(n) for n in liquid.narrower] == [
+        "https://example.net/my/extension/water",
+        "https://example.net/my/extension2/beer",
+    ]
+    cs = s.concepts_bulk("ext:vocab")
+    assert sorted(c.uri for c in cs) == [
+        "https://example.net/my/extension/liquid",
+        "https://example.net/my/extension/water",
+    ]
+
+
+def test_query_cache():
+    vocab_tools.VocabularyStore.query_cache_clear()
+    s = _get_store_for_all()
+    s.vocabularies()
+    info = vocab_tools.VocabularyStore.query_cache_info()
+    s.vocabularies()
+    s.vocabularies()
+    after = vocab_tools.VocabularyStore.query_cache_info()
+    assert after.misses == info.misses
+    assert after.hits == info.hits + 2
+    assert after.currsize <= after.maxsize
+
+
+def test_concept_index():
+    s = _get_store_for_all()
+    idx = s.concept_index()
+    assert len(idx) == 5
+    assert [c.uri for c in idx] == [c.uri for c in s.concepts_bulk()]
+    water = idx["https://example.net/my/extension/water"]
+    assert idx.get("ext:water") == water
+    assert idx.get("water") == water
+    assert "ext2:beer" in idx
+    assert idx.get("ext:nothing") is None
+    assert idx.by_uri(water.uri) == water
+    assert idx.by_curie("ext:water") == water
+    assert idx.by_curie("water") is None
+    assert idx.by_label("water") == water
+    assert idx.by_uri("ext:water") is None
+    assert vocab_tools.find_concept_in_concept_list("ext:liquid", idx).name == "liquid"
+
+
+def test_hierarchy():
+    s = _get_store_for_all()
+    h = s.hierarchy()
+    beer = "https://example.net/my/extension2/beer"
+    assert [str(u) for u in h.path_to_top(beer)] == [
+        "https://example.net/my/minimal/thing",
+        "https://example.net/my/extension/liquid",
+        beer,
+    ]
+    assert h.depth(beer) == 2
+    assert h.depth("https://example.net/my/minimal/thing") == 0
+    assert {str(u) for u in h.ancestors(beer)} == {
+        "https://example.net/my/minimal/thing",
+        "https://example.net/my/extension/liquid",
+    }
+    assert len(h.descendants("https://example.net/my/minimal/thing")) == 4
+    walked = [(str(u), d) for u, d in s.walk_broader("ext2:beer")]
+    assert walked[0] == ("ext2:beer", 0)
+    assert walked[-1] == ("https://example.net/my/minimal/thing", 2)
+    # The hierarchy is rebuilt when more triples are loaded
+    s.load(os.path.join(THIS_FOLDER, "data/beer.ttl"))
+    assert s.hierarchy() is not h
+    assert len(s.hierarchy().narrower(beer)) > 0
+
+
+def test_hierarchy_cycles():
+    h = vocab_tools.ConceptHierarchy()
+    h.add("b", "a")
+    h.add("c", "b")
+    h.add("a", "c")
+    h.add("d", "a")
+    h.add("e", "e")
+    cycles = sorted(sorted(str(u) for u in c) for c in h.cycles())
+    assert cycles == [["a", "b", "c"], ["e"]]
+    assert _get_store_for_all().hierarchy().cycles() == []
+
+
+def test_load_unchanged_source_skipped():
+    s = _get_store_for_all()
+    sources = s.sources()
+    assert len(sources) == 3
+    n = len(s)
+    s.load(os.path.join(THIS_FOLDER, "data/example.ttl"))
+    assert len(s) == n
+    assert s.sources() == sources
+    # The hashes are not part of the queried content
+    for source_id in sources:
+        assert (rdflib.URIRef(source_id), None, None) not in s.graph
+
+
+def test_content_tag_without_digest(tmp_path):
+    path = tmp_path / "example.ttl"
+    path.write_text(open(os.path.join(THIS_FOLDER, "data/example.ttl")).read())
+    # A file: URI is loaded like a remote source, without a content hash
+    source = path.as_uri()
+    s = vocab_tools.VocabularyStore()
+    s.load(source)
+    assert s.sources() == {source: None}
+    tag = s.content_tag()
+    s.load(source)
+    assert s.content_tag() == tag
+    path.write_text(path.read_text().replace('"Solid"', '"Solid matter"'))
+    n = len(s)
+    s.load(source)
+    assert len(s) == n
+    assert s.content_tag() != tag
+
+
+def test_persistent_store(tmp_path):
+    import pytest
+
+    pytest.importorskip("berkeleydb")
+    path = str(tmp_path / "store")
+    s = vocab_tools.VocabularyStore(storage_uri=path)
+    s.load(os.path.join(THIS_FOLDER, "data/example.ttl"))
+    n = len(s)
+    s.close()
+    s = vocab_tools.VocabularyStore(storage_uri=path)
+    assert len(s) == n
+    assert len(s.sources()) == 1
+    s.load(os.path.join(THIS_FOLDER, "data/example.ttl"))
+    assert len(s) == n
+    assert s.concept("https://example.net/my/minimal/solid").label == ["Solid"]
+    s.close()
+    s = vocab_tools.VocabularyStore(storage_uri=path, purge_existing=True)
+    assert len(s) == 0
+    assert s.sources() == {}
+    s.close()
+
+
+def test_snapshot(tmp_path):
+    import pytest
+
+    s = _get_store_for_all()
+    path = str(tmp_path / "vocab.snapshot")
+    s.save_snapshot(path)
+    sources = [
+        os.path.join(THIS_FOLDER, "data/example.ttl"),
+        os.path.join(THIS_FOLDER, "data/extension_example.ttl"),
+        os.path.join(THIS_FOLDER, "data/extension_extension.ttl"),
+    ]
+    assert vocab_tools.VocabularyStore.snapshot_is_current(path, sources)
+    t = vocab_tools.VocabularyStore.from_snapshot(path, sources=sources)
+    assert set(t.graph) == set(s.graph)
+    assert t.sources() == s.sources()
+    assert t.base_vocabulary().uri == "https://example.net/my/minimal/vocab"
+    assert t.concept("ext2:beer").label == ["Beer"]
+    assert [str(u) for u in t.narrower("eg:thing")] == [str(u) for u in s.narrower("eg:thing")]
+    assert t.hierarchy().to_data() == s.hierarchy().to_data()
+    header = vocab_tools.VocabularyStore.read_snapshot_header(path)
+    assert header.sources == s.sources()
+    assert vocab_tools.VocabularyStore.from_snapshot(header).snapshot == path
+    # Content referring to a class or function is not loaded
+    with open(path, "rb") as src:
+        bad = tmp_path / "bad.snapshot"
+        bad.write_bytes(src.read(header.offset) + pickle.dumps(print))
+    with pytest.raises(ValueError):
+        vocab_tools.VocabularyStore.from_snapshot(str(bad))
+    beer = os.path.join(THIS_FOLDER, "data/beer.ttl")
+    assert not vocab_tools.VocabularyStore.snapshot_is_current(path, [beer])
+    with pytest.raises(ValueError):
+        vocab_tools.VocabularyStore.from_snapshot(path, sources=[beer])
+
+
+def _rewrite_snapshot(path, dest, arrays):
+    """Copy the snapshot at path to dest, with the array header updated by arrays.
+
+    If the byte order changes, the integer arrays are swapped to match.
+    """
+    header = vocab_tools.VocabularyStore.read_snapshot_header(path)
+    with open(path, "rb") as src:
+        data = src.read()
+    meta = json.loads(data[len(vocab_tools.SNAPSHOT_MAGIC) + 6 : header.offset])
+    payload = pickle.loads(data[header.offset :])
+
+    def _swap(v):
+        if isinstance(v, bytes):
+            a = array.array(vocab_tools.SNAPSHOT_TYPECODE)
+            a.frombytes(v)
+            a.byteswap()
+            return a.tobytes()
+        if isinstance(v, dict):
+            return {k: _swap(x) for k, x in v.items()}
+        return v
+
+    if arrays.get("byteorder", header.byteorder) != header.byteorder:
+        payload = _swap(payload)
+    meta["array"].update(arrays)
+    encoded = json.dumps(meta).encode("utf-8")
+    with open(dest, "wb") as out:
+        out.write(vocab_tools.SNAPSHOT_MAGIC)
+        out.write(vocab_tools.SNAPSHOT_VERSION.to_bytes(2, "big"))
+        out.write(len(encoded).to_bytes(4, "big"))
+        out.write(encoded)
+        pickle.dump(payload, out)
+
+
+def test_snapshot_byte_order(tmp_path):
+    import sys
+
+    import pytest
+
+    s = _get_store_for_all()
+    path = str(tmp_path / "vocab.snapshot")
+    s.save_snapshot(path)
+    assert vocab_tools.VocabularyStore.read_snapshot_header(path).byteorder == sys.byteorder
+    other = str(tmp_path / "other.snapshot")
+    _rewrite_snapshot(path, other, {"byteorder": "big" if sys.byteorder == "little" else "little"})
+    t = vocab_tools.VocabularyStore.from_snapshot(other)
+    assert set(t.graph) == set(s.graph)
+    assert t.concept("ext2:beer").label == ["Beer"]
+    assert t.concepts_bulk() == s.concepts_bulk()
+    # Arrays of another item size are refused rather than misread
+    wide = str(tmp_path / "wide.snapshot")
+    _rewrite_snapshot(path, wide, {"itemsize": 8})
+    with pytest.raises(ValueError):
+        vocab_tools.VocabularyStore.read_snapshot_header(wide)
+    assert not vocab_tools.VocabularyStore.snapshot_is_current(wide, [])
+
+
+def test_load_many():
+    sources = [
+        os.path.join(THIS_FOLDER, "data/example.ttl"),
+        os.path.join(THIS_FOLDER, "data/extension_example.ttl"),
+        os.path.join(THIS_FOLDER, "data/extension_extension.ttl"),
+    ]
+    s = _get_store_for_all()
+    t = vocab_tools.VocabularyStore()
+    t.load_many(sources)
+    assert set(t.graph) == set(s.graph)
+    # Inferred once at the end, with the same result as loading in turn
+    assert t.concepts_bulk() == s.concepts_bulk()
+    assert sorted(t.namespaces()) == sorted(s.namespaces())
+    assert t.concept("ext2:beer").label == ["Beer"]
+    v = t.vocabulary("https://example.net/my/extension2/vocab")
+    assert v.extends == "https://example.net/my/extension/vocab"
+    assert len(t.sources()) == 3
+
+
+def test_profiler():
+    s = vocab_tools.VocabularyStore()
+    profiler = s.enable_profiling()
+    s.load(os.path.join(THIS_FOLDER, "data/example.ttl"))
+    s.concepts_bulk()
+    q = "SELECT ?s WHERE {?s rdf:type skos:Concept .}"
+    n = len(s.query(q))
+    s.query(q)
+    stats = profiler.queries[q]
+    assert stats.calls == 2
+    assert stats.rows == 2 * n
+    assert stats.total_time > 0
+    for name in ("load.parse", "load.commit", "load.infer", "store.concept_table"):
+        assert profiler.phases[name].calls == 1
+    report = profiler.to_dict()
+    assert len(report["queries"]) == len(profiler.queries)
+
+
+def test_label_table(tmp_path):
+    labels = tmp_path / "labels.ttl"
+    labels.write_text(
+        """@prefix skos: <http://www.w3.org/2004/02/skos/core#> .
+@prefix eg: <https://example.net/my/minimal/> .
+eg:thing skos:prefLabel "Ding"@de ; skos:altLabel "Sache"@de ; skos:prefLabel "Chose"@fr-CA .
+eg:solid skos:prefLabel "Solid, untagged" .
+"""
+    )
+    s = vocab_tools.VocabularyStore()
+    s.load(os.path.join(THIS_FOLDER, "data/example.ttl"))
+    s.load(str(labels))
+    thing = s.concept("eg:thing")
+    assert thing.labels["de"].pref == "Ding"
+    assert thing.labels["de"].alt == ["Sache"]
+    assert thing.get_label("de") == "Ding"
+    assert thing.get_label("fr") == "Chose"
+    assert thing.get_label("es") == thing.get_label()
+    table = s.label_table()
+    assert s.languages() == ["", "de", "en", "fr-ca"]
+    assert table.label("https://example.net/my/minimal/thing", "en") == "Thing"
+    assert table.get("https://example.net/my/minimal/thing", "fr-CA").pref == "Chose"
+    # Untagged labels are used when there is none in the language
+    assert table.label("https://example.net/my/minimal/solid", "de") == "Solid, untagged"
+    assert s.label_table() is table
+    assert "https://example.net/my/minimal/thing" in table
+    assert table.get("https://example.net/my/minimal/nothing") is None
+
+
+def test_resolve_many():
+    s = _get_store_for_all()
+    terms = ["ext2:beer", "https://example.net/my/extension/water", " aqua", "LIQUID", "nothing", "ext2:beer"]
+    res = list(s.resolve_many(terms))
+    assert [r.uri for r in res] == [
+        "https://example.net/my/extension2/beer",
+        "https://example.net/my/extension/water",
+        "https://example.net/my/extension/water",
+        "https://example.net/my/extension/liquid",
+        None,
+        "https://example.net/my/extension2/beer",
+    ]
+    assert [r.matched_by for r in res] == ["curie", "uri", "label", "label", None, "curie"]
+    assert res[0].path == (
+        "https://example.net/my/minimal/thing",
+        "https://example.net/my/extension/liquid",
+        "https://example.net/my/extension2/beer",
+    )
+    assert res[0] is res[5]
+    info = s.resolve_cache_info()
+    assert (info.hits, info.misses) == (1, 5)
+    s.load(os.path.join(THIS_FOLDER, "data/beer.ttl"))
+    assert s.resolve_cache_info() is None
+    assert s.resolve("Pale Ale").concept.name == "paleale"
+
+
+def test_namespace_table():
+    s = _get_store_for_all()
+    nm = s.graph.namespace_manager
+    uris = [
+        "https://example.net/my/extension2/beer",
+        "https://example.net/my/minimal/thing",
+        "http://www.w3.org/2004/02/skos/core#a.b",
+        "urn:not:bound",
+    ]
+    for uri in uris:
+        assert s.compact_name(uri) == rdflib.URIRef(uri).n3(nm)
+    assert s.compact_name("https://example.net/my/extension2/beer") == "ext2:beer"
+    assert str(s.expand_name("ext2:beer")) == "https://example.net/my/extension2/beer"
+    assert s.expand_name("ext2:beer") is s.expand_name("ext2:beer")
+    assert s.expand_name("nope:beer") == "nope:beer"
+    table = s.namespace_table()
+    assert table.longest_namespace("https://example.net/my/extension2/beer") == (
+        "ext2", "https://example.net/my/extension2/"
+    )
+    s.bind("brew", "https://example.net/my/extension2/", override=True)
+    assert s.namespace_table() is not table
+    assert s.compact_name("https://example.net/my/extension2/beer") == "brew:beer"
+    assert s.resolve("brew:beer").uri == "https://example.net/my/extension2/beer"
+
+
+def test_concept_table():
+    s = _get_store_for_all()
+    table = s._concept_table()
+    assert isinstance(table, vocab_tools.ConceptTable)
+    water = s.concept("https://example.net/my/extension/water")
+    assert type(water) is vocab_tools.VocabularyConcept
+    assert water.label == ["Water", "Aqua", "H2O"]
+    assert water.get_label() == "Water"
+    liquid = s.concept("https://example.net/my/extension/liquid")
+    # Strings are held once, however many concepts refer to them
+    assert water.broader[0] is liquid.uri
+    # Concepts are built on each access, changing one leaves the table as it was
+    assert s.concept(water.uri) == water
+    changed = dataclasses.replace(water, definition="Changed")
+    water.label.append("Eau")
+    assert s.concept(water.uri).label == ["Water", "Aqua", "H2O"]
+    assert s.concept(water.uri).definition != changed.definition
+    restored = pickle.loads(pickle.dumps(water))
+    assert restored == water
+    rebuilt = vocab_tools.ConceptTable(table.values())
+    assert list(rebuilt) == list(table)
+    assert list(rebuilt.values()) == list(table.values())
+
+
+def test_reloaded(tmp_path, monkeypatch):
+    sources = []
+    for name in ("example.ttl", "extension_example.ttl"):
+        dest = tmp_path / name
+        dest.write_text(open(os.path.join(THIS_FOLDER, "data", name)).read())
+        sources.append(str(dest))
+    s = vocab_tools.VocabularyStore()
+    s.load_many(sources)
+    assert s.changed_sources(sources) == []
+    with open(sources[1], "a") as dest:
+        dest.write('\next:water skos:altLabel "Eau"@fr .\n')
+    assert s.changed_sources(sources) == [sources[1]]
+    parsed = []
+    parse = rdflib.Graph.parse
+    monkeypatch.setattr(
+        rdflib.Graph, "parse", lambda g, source, **kw: parsed.append(source) or parse(g, source, **kw)
+    )
+    t = s.reloaded(sources)
+    # Only the changed source is parsed, the original store is unchanged
+    assert parsed == [sources[1]]
+    assert t.changed_sources(sources) == []
+    assert len(t) == len(s) + 1
+    assert t.concept("ext:water").labels["fr"].alt == ["Eau"]
+    assert "fr" not in s.concept("ext:water").labels
+    assert t.vocabularies() == s.vocabularies()
+    # The inferred extension relation is held with the source it was inferred from
+    extends = (
+        rdflib.URIRef("https://example.net/my/extension/vocab"),
+        rdflib.RDFS.subPropertyOf,
+        rdflib.URIRef("https://example.net/my/minimal/vocab"),
+    )
+    ext_graph = rdflib.URIRef(vocab_tools.source_identifier(sources[1]))
+    for store in (s, t):
+        assert [c.identifier for c in store.graph.contexts(extends)] == [ext_graph]
+    # and goes when the source no longer extends the vocabulary
+    with open(sources[1], "w") as dest:
+        dest.write(
+            "@prefix skos: <http://www.w3.org/2004/02/skos/core#> .\n"
+            "<https://example.net/my/extension/vocab> a skos:ConceptScheme .\n"
+        )
+    assert extends not in t.reloaded(sources).graph
+
+
+def test_copy(monkeypatch):
+    sources = [
+        os.path.join(THIS_FOLDER, "data/example.ttl"),
+        os.path.join(THIS_FOLDER, "data/extension_example.ttl"),
+        os.path.join(THIS_FOLDER, "data/extension_extension.ttl"),
+    ]
+    s = vocab_tools.VocabularyStore()
+    s.load_many(sources)
+
+    def _quads(store):
+        return {(t[0], t[1], t[2], t[3].identifier) for t in store.graph.quads((None, None, None, None))}
+
+    for exclude in ([], sources[:1], sources[1:2]):
+        t = s.copy(exclude=exclude)
+        with monkeypatch.context() as m:
+            # Copied a triple at a time
+            m.setattr(vocab_tools, "_copy_memory_store", lambda *args: False)
+            expected = s.copy(exclude=exclude)
+        assert _quads(t) == _quads(expected)
+        assert len(t) == len(expected)
+        assert {c.identifier for c in t.graph.contexts()} == {c.identifier for c in expected.graph.contexts()}
+        assert list(t.graph.triples((None, rdflib.RDF.type, None))) != []
+        # The copy can be changed without affecting the original
+        t.load_many(sources)
+        assert _quads(t) == _quads(s)
+        assert t.concept("ext2:beer").label == ["Beer"]
+        assert sorted(t.vocabularies()) == sorted(s.vocabularies())
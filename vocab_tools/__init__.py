@@ -3,16 +3,53 @@ Provides a convenience wrapper for vocabularies expressed in SKOS rdf.
 
 Part of the iSamples project.
 """
+import array
 import dataclasses
+import functools
+import gc
+import hashlib
+import json
 import logging
+import os
+import pathlib
+import pickle
+import re
+import shutil
+import sys
+import time
 import typing
 import rdflib
 import rdflib.namespace
+import rdflib.plugins.stores.memory
 import rdflib.plugins.sparql
 
+import vocab_tools.profiling
+
+# Maximum number of distinct prepared SPARQL queries kept by VocabularyStore
+QUERY_CACHE_SIZE = 128
+
+# Maximum number of distinct terms kept by VocabularyStore.resolve
+RESOLVE_CACHE_SIZE = 65536
+
+# Maximum number of names memoized by each of NamespaceTable.expand and compact
+NAME_CACHE_SIZE = 65536
+
 #TODO: this is too specific:
 STORE_IDENTIFIER = "https://w3id.org/isample/vocabulary"
 
+# File in the directory of an on-disk store recording the content hash of
+# each loaded source, kept out of the graph so it is not seen by queries
+SOURCES_FILE = "vocab_tools_sources.json"
+
+# Leading bytes of a store snapshot file, followed by the format version
+# and the length of the header
+SNAPSHOT_MAGIC = b"VOCABSNAP"
+SNAPSHOT_VERSION = 5
+
+# Type code of the integer arrays in snapshots, written with the native item
+# size and byte order that are recorded in the header
+SNAPSHOT_TYPECODE = "I"
+
 #TODO: should use namespaces from rdflib
 NS = {
     "rdf": "http://www.w3.org/1999/02/22-rdf-syntax-ns#",
@@ -44,15 +81,249 @@ def dctermT(term):
     return rdflib.URIRef(f"{NS['rdfs']}{term}")
 
 
+def source_identifier(source: str) -> str:
+    """Return the graph identifier used for the content of source.
+
+    Local files are identified by their file: URI, anything else as given.
+    """
+    if os.path.exists(source):
+        return pathlib.Path(source).absolute().as_uri()
+    return str(source)
+
+
+def source_hash(source: str) -> typing.Optional[str]:
+    """Return the SHA-256 hex digest of a local source, None if not a local file."""
+    if not os.path.isfile(source):
+        return None
+    h = hashlib.sha256()
+    with open(source, "rb") as src:
+        for block in iter(lambda: src.read(1024 * 1024), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _encode_term(term: rdflib.term.Node) -> tuple:
+    if isinstance(term, rdflib.Literal):
+        dt = term.datatype
+        return ("l", str(term), term.language, None if dt is None else str(dt))
+    if isinstance(term, rdflib.BNode):
+        return ("b", str(term))
+    return ("u", str(term))
+
+
+def _decode_term(t: tuple) -> rdflib.term.Node:
+    if t[0] == "l":
+        return rdflib.Literal(t[1], lang=t[2], datatype=t[3])
+    if t[0] == "b":
+        return rdflib.BNode(t[1])
+    return rdflib.URIRef(t[1])
+
+
+class _DataUnpickler(pickle.Unpickler):
+    """Unpickler of snapshot content, which refuses anything but builtin types.
+
+    Pickles of builtin types never refer to a class or function, so no
+    code named by the file can be run when loading it.
+    """
+
+    def find_class(self, module, name):
+        raise pickle.UnpicklingError(f"{module}.{name} is not allowed in a snapshot")
+
+
+def _bytes_array(
+    data: bytes, typecode: str = SNAPSHOT_TYPECODE, byteswap: bool = False
+) -> array.array:
+    a = array.array(typecode)
+    a.frombytes(data)
+    if byteswap:
+        a.byteswap()
+    return a
+
+
+def _ordered_predicates(g: rdflib.Graph) -> typing.List[rdflib.term.Node]:
+    """Return the distinct predicates of g, rdf:type first.
+
+    Copying triples grouped by predicate follows the in-memory store's
+    predicate index order, so the copy returns values in the same order.
+    """
+    return sorted(set(g.predicates()), key=lambda p: (p != rdfT("type"), p))
+
+
+# Indexes of rdflib's Memory store copied by _copy_memory_store
+_MEMORY_INDEXES = ("spo", "pos", "osp")
+
+
+def _copy_memory_store(
+    source: rdflib.ConjunctiveGraph,
+    dest: rdflib.ConjunctiveGraph,
+    skip: typing.Set[rdflib.URIRef],
+) -> bool:
+    """Copy the triples of source outside the contexts in skip to the empty dest.
+
+    Copies the index dicts of rdflib's in-memory store directly, which is
+    several times faster than adding each triple. Only triples found in
+    the skipped contexts are handled one at a time. Returns False, having
+    changed nothing, if either graph is not held in a Memory store.
+    """
+    memory = rdflib.plugins.stores.memory.Memory
+    src, dst = source.store, dest.store
+    if type(src) is not memory or type(dst) is not memory:
+        return False
+
+    def a(store, name):
+        # The private attributes of Memory, as named by rdflib 7
+        return getattr(store, f"_Memory__{name}")
+
+    skip_keys = {f"{ctx.__class__.__name__}:{ctx}" for ctx in skip}
+    default_contexts = a(src, "defaultContexts")
+    triple_contexts = {t: dict(c) for t, c in a(src, "tripleContexts").items()}
+    dropped = set()
+    for key in skip_keys:
+        for triple in a(src, "contextTriples").get(key, ()):
+            contexts = triple_contexts.get(triple)
+            if contexts is None:
+                # Only in the default contexts, which include key
+                dropped.add(triple)
+                continue
+            del contexts[key]
+            if all(c is None for c in contexts):
+                dropped.add(triple)
+                del triple_contexts[triple]
+            elif contexts == default_contexts:
+                del triple_contexts[triple]
+    for name in _MEMORY_INDEXES:
+        index = {
+            k1: {k2: values.copy() for k2, values in inner.items()}
+            for k1, inner in a(src, name).items()
+        }
+        setattr(dst, f"_Memory__{name}", index)
+    spo, pos, osp = (a(dst, name) for name in _MEMORY_INDEXES)
+    for s, p, o in dropped:
+        for index, k1, k2, k3 in ((spo, s, p, o), (pos, p, o, s), (osp, o, s, p)):
+            inner = index[k1]
+            del inner[k2][k3]
+            if len(inner[k2]) == 0:
+                del inner[k2]
+                if len(inner) == 0:
+                    del index[k1]
+    setattr(dst, "_Memory__tripleContexts", triple_contexts)
+    setattr(dst, "_Memory__defaultContexts", None if default_contexts is None else dict(default_contexts))
+    context_triples = {
+        key: (triples - dropped if key is None else triples.copy())
+        for key, triples in a(src, "contextTriples").items()
+        if key not in skip_keys
+    }
+    setattr(dst, "_Memory__contextTriples", context_triples)
+    # Context graphs are bound to their store, so new ones are made for dest
+    all_contexts = a(dst, "all_contexts")
+    context_map = a(dst, "context_obj_map")
+    for ctx in a(src, "all_contexts"):
+        if ctx.identifier not in skip:
+            all_contexts.add(dest.get_context(ctx.identifier))
+    for key, ctx in a(src, "context_obj_map").items():
+        if key not in skip_keys:
+            context_map[key] = dest.get_context(ctx.identifier) if isinstance(ctx, rdflib.Graph) else ctx
+    return True
+
+
+class _TermTable:
+    """Distinct terms numbered in the order first seen.
+
+    Triples and quads are encoded as arrays of these numbers, with the
+    terms listed once as tuples of strings by encoded().
+    """
+
+    def __init__(self):
+        self._ids: typing.Dict[rdflib.term.Node, int] = {}
+
+    def id(self, term: rdflib.term.Node) -> int:
+        i = self._ids.get(term)
+        if i is None:
+            i = len(self._ids)
+            self._ids[term] = i
+        return i
+
+    def encoded(self) -> typing.List[tuple]:
+        return [_encode_term(t) for t in self._ids]
+
+
 def find_concept_in_concept_list(
-    uri: str, concept_list: typing.List["VocabularyConcept"]
+    uri: str,
+    concept_list: typing.Union[typing.List["VocabularyConcept"], "ConceptIndex"],
 ) -> typing.Optional["VocabularyConcept"]:
+    if isinstance(concept_list, ConceptIndex):
+        return concept_list.get(uri)
     for c in concept_list:
         if str(c.uri) == str(uri):
             return c
     return None
 
 
+@dataclasses.dataclass
+class LanguageLabels:
+    """The preferred and alternate labels of a concept in one language."""
+    pref: typing.Optional[str] = None
+    alt: typing.List[str] = dataclasses.field(default_factory=list)
+
+
+def language_labels(
+    pref: typing.Iterable[rdflib.term.Node], alt: typing.Iterable[rdflib.term.Node]
+) -> typing.Dict[str, LanguageLabels]:
+    """Group skos:prefLabel and skos:altLabel values by language tag.
+
+    Labels without a language tag are held under "". Where there is more
+    than one skos:prefLabel in a language, the others are kept as alternates.
+    """
+    res: typing.Dict[str, LanguageLabels] = {}
+    for terms, is_pref in ((pref, True), (alt, False)):
+        for term in terms:
+            value = str(term).strip()
+            if len(value) == 0:
+                continue
+            lang = getattr(term, "language", None) or ""
+            labels = res.setdefault(lang.lower(), LanguageLabels())
+            if is_pref and labels.pref is None:
+                labels.pref = value
+            else:
+                labels.alt.append(value)
+    return res
+
+
+def pick_label(
+    labels: typing.Dict[str, LanguageLabels], lang: typing.Optional[str] = None
+) -> typing.Optional[str]:
+    """Return the preferred label for lang from labels.
+
+    Falls back to a label whose tag has the same primary language (e.g.
+    "en-GB" for "en"), then an untagged label. Returns None if none match.
+    """
+    if lang is None:
+        lang = ""
+    lang = lang.lower()
+    labels_lang = labels.get(lang)
+    if labels_lang is not None and labels_lang.pref is not None:
+        return labels_lang.pref
+    primary = lang.split("-")[0]
+    for tag, labels_lang in labels.items():
+        if labels_lang.pref is not None and tag.split("-")[0] == primary:
+            return labels_lang.pref
+    labels_lang = labels.get("")
+    if labels_lang is not None:
+        return labels_lang.pref
+    return None
+
+
+def md_link_label(label: str) -> str:
+    """Return the markdown anchor of a concept with label."""
+    tag = label.strip()
+    tag = tag.split("/")[-1]
+    tag = tag.lower().strip()
+    tag = tag.replace(",", "")
+    tag = tag.replace(" ", "-")
+    tag = tag.replace("'", "")
+    return tag
+
+
 @dataclasses.dataclass
 class VocabularyConcept:
     uri: str
@@ -69,22 +340,22 @@ class VocabularyConcept:
     related: typing.List[str] = dataclasses.field(default_factory=list)
     example: typing.List[str] = dataclasses.field(default_factory=list)
     #changenote: typing.List[str] = dataclasses.field(default_factory=list)
-
-    def get_label(self):
+    # skos:prefLabel and skos:altLabel by language tag, "" for untagged labels
+    labels: typing.Dict[str, LanguageLabels] = dataclasses.field(default_factory=dict)
+
+    def get_label(self, lang: typing.Optional[str] = None):
+        """Return the label of the concept, in lang if one is available."""
+        if lang is not None:
+            tag = pick_label(self.labels, lang)
+            if tag is not None:
+                return tag
         tag = self.name
         if len(self.label) > 0:
             tag = self.label[0]
         return tag
 
     def md_link_label(self):
-        tag = self.get_label()
-        tag = tag.strip()
-        tag = tag.split("/")[-1]
-        tag = tag.lower().strip()
-        tag = tag.replace(",", "")
-        tag = tag.replace(" ", "-")
-        tag = tag.replace("'", "")
-        return tag
+        return md_link_label(self.get_label())
 
     def md_link(self, fixed_width=False):
         if fixed_width:
@@ -92,16 +363,20 @@ class VocabularyConcept:
         return f"[{self.get_label()}](#{self.md_link_label()})"
 
     def markdown(
-        self, level=1, concept_list: typing.List["VocabularyConcept"] = None
+        self,
+        level=1,
+        concept_list: typing.Union[
+            typing.List["VocabularyConcept"], "ConceptIndex", None
+        ] = None,
     ) -> typing.List[str]:
         """Return lines of markdown describing self.
 
         Level is the heading level for the block.
 
-        concept_list is an optional list of loaded VocabularyConcept instances.
+        concept_list is an optional list or ConceptIndex of loaded
+        VocabularyConcept instances.
         """
-        if concept_list is None:
-            concept_list = []
+        concept_list = ConceptIndex.wrap(concept_list)
         res = [
             f"{'#' * level} {self.get_label()}",
             "[]{#" + self.md_link_label() + "}",
@@ -116,7 +391,7 @@ class VocabularyConcept:
             res.append("")
             for broader in self.broader:
                 if len(concept_list) > 0:
-                    bc = find_concept_in_concept_list(broader, concept_list)
+                    bc = concept_list.get(broader)
                     res.append(f"- {bc.md_link()}")
                 else:
                     res.append(f"- {broader}")
@@ -126,7 +401,7 @@ class VocabularyConcept:
             res.append("")
             for narrower in self.narrower:
                 if len(concept_list) > 0:
-                    nc = find_concept_in_concept_list(narrower, concept_list)
+                    nc = concept_list.get(narrower)
                     res.append(f"- {nc.md_link()}")
                 else:
                     res.append(f"- {narrower}")
@@ -137,6 +412,557 @@ class VocabularyConcept:
         return res
 
 
+class StringPool:
+    """Distinct strings, each held once and identified by an integer id."""
+
+    def __init__(self):
+        self._ids: typing.Dict[str, int] = {}
+        self._strings: typing.List[str] = []
+
+    def intern(self, value: str) -> int:
+        """Return the id of value, adding it to the pool if necessary."""
+        if type(value) is not str:
+            value = str(value)
+        i = self._ids.get(value)
+        if i is None:
+            i = len(self._strings)
+            self._ids[value] = i
+            self._strings.append(value)
+        return i
+
+    def __getitem__(self, i: int) -> str:
+        return self._strings[i]
+
+    def __len__(self) -> int:
+        return len(self._strings)
+
+    def __getstate__(self):
+        return self._strings
+
+    def __setstate__(self, state):
+        self._strings = state
+        self._ids = {value: i for i, value in enumerate(state)}
+
+
+# Id recorded in ConceptTable for an absent value
+_NO_VALUE = 0xFFFFFFFF
+
+
+class ConceptTable:
+    """All the concepts of a store held in columns of string ids.
+
+    Every string, URIs and labels alike, is held once in a StringPool.
+    Single valued fields are arrays with one id per concept, list fields
+    one array of ids for all concepts with an array of offsets to the
+    first value of each concept. Concepts are returned as VocabularyConcept
+    instances built from the table on each access, so changing one leaves
+    the table as it was. The table is ordered as concepts were added and
+    supports the read only dict interface keyed by URI.
+    """
+
+    SCALAR_FIELDS = ("name", "definition", "vocabulary")
+    LIST_FIELDS = (
+        "label", "broader", "narrower", "history", "sources", "notes", "related", "example"
+    )
+
+    def __init__(self, concepts: typing.Iterable[VocabularyConcept] = ()):
+        self._pool = StringPool()
+        self._rows: typing.Dict[str, int] = {}
+        self._uris = array.array("I")
+        self._scalars = {f: array.array("I") for f in self.SCALAR_FIELDS}
+        self._values = {f: array.array("I") for f in self.LIST_FIELDS}
+        self._offsets = {f: array.array("I", [0]) for f in self.LIST_FIELDS}
+        # Per concept: number of languages, then for each the language tag,
+        # the preferred label, the number of alternates and the alternates
+        self._labels = array.array("I")
+        self._label_offsets = array.array("I", [0])
+        for concept in concepts:
+            self.add(concept)
+
+    def add(self, concept: VocabularyConcept) -> int:
+        """Add concept, replacing none, and return its row."""
+        intern = self._pool.intern
+        uri = str(concept.uri)
+        row = len(self._uris)
+        self._uris.append(intern(uri))
+        self._rows[self._pool[self._uris[row]]] = row
+        for f in self.SCALAR_FIELDS:
+            value = getattr(concept, f)
+            self._scalars[f].append(_NO_VALUE if value is None else intern(value))
+        for f in self.LIST_FIELDS:
+            values = self._values[f]
+            values.extend(intern(v) for v in getattr(concept, f))
+            self._offsets[f].append(len(values))
+        self._labels.append(len(concept.labels))
+        for lang, labels in concept.labels.items():
+            self._labels.append(intern(lang))
+            self._labels.append(_NO_VALUE if labels.pref is None else intern(labels.pref))
+            self._labels.append(len(labels.alt))
+            self._labels.extend(intern(v) for v in labels.alt)
+        self._label_offsets.append(len(self._labels))
+        return row
+
+    def to_data(self) -> dict:
+        """Return the content of the table as builtin types, as held in snapshots."""
+        return {
+            "strings": list(self._pool._strings),
+            "uris": self._uris.tobytes(),
+            "scalars": {f: a.tobytes() for f, a in self._scalars.items()},
+            "values": {f: a.tobytes() for f, a in self._values.items()},
+            "offsets": {f: a.tobytes() for f, a in self._offsets.items()},
+            "labels": self._labels.tobytes(),
+            "label_offsets": self._label_offsets.tobytes(),
+        }
+
+    @classmethod
+    def from_data(cls, data: dict, byteswap: bool = False) -> "ConceptTable":
+        """Return the table with the content returned by to_data().
+
+        byteswap is True if data was written with the other byte order.
+        """
+        table = cls()
+        table._pool.__setstate__(data["strings"])
+
+        def _array(b):
+            return _bytes_array(b, byteswap=byteswap)
+
+        table._uris = _array(data["uris"])
+        table._scalars = {f: _array(b) for f, b in data["scalars"].items()}
+        table._values = {f: _array(b) for f, b in data["values"].items()}
+        table._offsets = {f: _array(b) for f, b in data["offsets"].items()}
+        table._labels = _array(data["labels"])
+        table._label_offsets = _array(data["label_offsets"])
+        strings = table._pool._strings
+        table._rows = {strings[i]: row for row, i in enumerate(table._uris)}
+        return table
+
+    def get_value(self, field: str, row: int) -> typing.Optional[str]:
+        """Return single valued field of row."""
+        i = self._scalars[field][row]
+        return None if i == _NO_VALUE else self._pool[i]
+
+    def get_values(self, field: str, row: int) -> typing.List[str]:
+        """Return the values of list field of row."""
+        offsets = self._offsets[field]
+        values = self._values[field]
+        strings = self._pool._strings
+        return [strings[values[i]] for i in range(offsets[row], offsets[row + 1])]
+
+    def get_labels(self, row: int) -> typing.Dict[str, LanguageLabels]:
+        """Return the labels of row by language tag."""
+        res = {}
+        data = self._labels
+        strings = self._pool._strings
+        i = self._label_offsets[row]
+        for _ in range(data[i]):
+            lang, pref, n_alt = data[i + 1], data[i + 2], data[i + 3]
+            res[strings[lang]] = LanguageLabels(
+                pref=None if pref == _NO_VALUE else strings[pref],
+                alt=[strings[data[j]] for j in range(i + 4, i + 4 + n_alt)],
+            )
+            i += 3 + n_alt
+        return res
+
+    def languages(self) -> typing.Set[str]:
+        """Return the language tags of the labels of all rows."""
+        res = set()
+        data = self._labels
+        strings = self._pool._strings
+        for row in range(len(self._uris)):
+            i = self._label_offsets[row]
+            for _ in range(data[i]):
+                res.add(strings[data[i + 1]])
+                i += 3 + data[i + 3]
+        return res
+
+    def uri(self, row: int) -> str:
+        return self._pool[self._uris[row]]
+
+    def row(self, uri: str) -> typing.Optional[int]:
+        return self._rows.get(str(uri))
+
+    def concept(self, row: int) -> VocabularyConcept:
+        """Return a new VocabularyConcept with the fields of row."""
+        strings = self._pool._strings
+        fields = {"uri": strings[self._uris[row]]}
+        for f, ids in self._scalars.items():
+            i = ids[row]
+            fields[f] = None if i == _NO_VALUE else strings[i]
+        for f, values in self._values.items():
+            offsets = self._offsets[f]
+            start, end = offsets[row], offsets[row + 1]
+            fields[f] = [strings[i] for i in values[start:end]] if start < end else []
+        fields["labels"] = self.get_labels(row)
+        return VocabularyConcept(**fields)
+
+    def get(self, uri: str, default=None) -> typing.Optional[VocabularyConcept]:
+        row = self._rows.get(str(uri))
+        if row is None:
+            return default
+        return self.concept(row)
+
+    def __getitem__(self, uri: str) -> VocabularyConcept:
+        return self.concept(self._rows[str(uri)])
+
+    def __contains__(self, uri) -> bool:
+        return str(uri) in self._rows
+
+    def __iter__(self) -> typing.Iterator[str]:
+        return iter(self._rows)
+
+    def __len__(self) -> int:
+        return len(self._uris)
+
+    def keys(self) -> typing.Iterable[str]:
+        return self._rows.keys()
+
+    def values(self) -> typing.Iterator[VocabularyConcept]:
+        return (self.concept(row) for row in range(len(self._uris)))
+
+    def items(self) -> typing.Iterator[typing.Tuple[str, VocabularyConcept]]:
+        return ((uri, self.concept(row)) for uri, row in self._rows.items())
+
+
+class ConceptIndex:
+    """An insertion ordered collection of concepts, held as rows of a ConceptTable.
+
+    Iterating yields the concepts in the order they were added. Concepts
+    can be retrieved by URI, by compacted name (e.g. "eg:thing") or by
+    md_link_label() with constant time lookups. Only row numbers are
+    indexed, and each lookup returns a new VocabularyConcept built from
+    the table.
+
+    compact_name is an optional callable that returns the compacted form
+    of a URI, typically VocabularyStore.compact_name.
+    """
+
+    def __init__(
+        self,
+        concepts: typing.Optional[typing.Iterable[VocabularyConcept]] = None,
+        compact_name: typing.Optional[typing.Callable[[str], str]] = None,
+    ):
+        self._compact_name = compact_name
+        self._table = ConceptTable()
+        self._read_only = False
+        self._by_uri: typing.Dict[str, int] = {}
+        self._by_curie: typing.Dict[str, int] = {}
+        self._by_label: typing.Dict[str, int] = {}
+        if concepts is not None:
+            for concept in concepts:
+                self.add(concept)
+
+    @classmethod
+    def from_table(
+        cls,
+        table: ConceptTable,
+        rows: typing.Optional[typing.Iterable[int]] = None,
+        compact_name: typing.Optional[typing.Callable[[str], str]] = None,
+    ) -> "ConceptIndex":
+        """Return a read only index of rows of table, all of them if rows is None.
+
+        The table is shared, not copied.
+        """
+        index = cls(compact_name=compact_name)
+        index._table = table
+        index._read_only = True
+        for row in range(len(table)) if rows is None else rows:
+            index._add_row(row)
+        return index
+
+    @classmethod
+    def wrap(
+        cls,
+        concepts: typing.Union[
+            typing.Iterable[VocabularyConcept], "ConceptIndex", None
+        ],
+    ) -> "ConceptIndex":
+        """Return concepts as a ConceptIndex, building one only if necessary."""
+        if isinstance(concepts, cls):
+            return concepts
+        return cls(concepts)
+
+    def add(self, concept: VocabularyConcept):
+        """Add concept, replacing any existing entry with the same URI."""
+        if self._read_only:
+            raise TypeError("Concepts cannot be added to an index of a shared table")
+        self._add_row(self._table.add(concept))
+
+    def _add_row(self, row: int):
+        table = self._table
+        uri = table.uri(row)
+        self._by_uri[uri] = row
+        if self._compact_name is not None:
+            curie = self._compact_name(uri)
+            # URIs without a bound prefix come back as <uri>
+            if curie is not None and not curie.startswith("<"):
+                self._by_curie.setdefault(curie, row)
+        self._by_label.setdefault(md_link_label(self._label(row)), row)
+
+    def _label(self, row: int) -> str:
+        # VocabularyConcept.get_label() without building the concept
+        labels = self._table.get_values("label", row)
+        return labels[0] if len(labels) > 0 else self._table.get_value("name", row)
+
+    def _row(self, key: str) -> typing.Optional[int]:
+        key = str(key)
+        row = self._by_uri.get(key)
+        if row is None:
+            row = self._by_curie.get(key)
+        if row is None:
+            row = self._by_label.get(key)
+        return row
+
+    def _concept(self, row: typing.Optional[int]) -> typing.Optional[VocabularyConcept]:
+        return None if row is None else self._table.concept(row)
+
+    def by_uri(self, uri: str) -> typing.Optional[VocabularyConcept]:
+        """Return the concept with URI uri, or None."""
+        return self._concept(self._by_uri.get(str(uri)))
+
+    def by_curie(self, curie: str) -> typing.Optional[VocabularyConcept]:
+        """Return the concept with compacted name curie, or None."""
+        return self._concept(self._by_curie.get(str(curie)))
+
+    def by_label(self, label: str) -> typing.Optional[VocabularyConcept]:
+        """Return the first concept added with md_link_label() label, or None."""
+        return self._concept(self._by_label.get(str(label)))
+
+    def get(
+        self, key: str, default: typing.Optional[VocabularyConcept] = None
+    ) -> typing.Optional[VocabularyConcept]:
+        """Return the concept matching key as a URI, CURIE or md_link_label."""
+        row = self._row(key)
+        if row is None:
+            return default
+        return self._table.concept(row)
+
+    def md_link(self, key: str, fixed_width=False, document: str = "") -> typing.Optional[str]:
+        """Return VocabularyConcept.md_link() of the concept matching key, or None.
+
+        document is the file holding the anchor, by default the current one.
+        The link is built from the table, without materialising the concept.
+        """
+        row = self._row(key)
+        if row is None:
+            return None
+        label = self._label(row)
+        if fixed_width:
+            return f"[`{label}`]({document}#{md_link_label(label)})"
+        return f"[{label}]({document}#{md_link_label(label)})"
+
+    def vocabulary(self, key: str) -> typing.Optional[str]:
+        """Return the vocabulary of the concept matching key, or None."""
+        row = self._row(key)
+        if row is None:
+            return None
+        return self._table.get_value("vocabulary", row)
+
+    def uris(self) -> typing.List[str]:
+        return list(self._by_uri.keys())
+
+    def __getitem__(self, key: str) -> VocabularyConcept:
+        c = self.get(key)
+        if c is None:
+            raise KeyError(key)
+        return c
+
+    def __contains__(self, key) -> bool:
+        if isinstance(key, VocabularyConcept):
+            key = key.uri
+        return self._row(key) is not None
+
+    def __iter__(self) -> typing.Iterator[VocabularyConcept]:
+        return (self._table.concept(row) for row in self._by_uri.values())
+
+    def __len__(self) -> int:
+        return len(self._by_uri)
+
+
+class LabelTable:
+    """Labels of concepts by URI and language, for constant time lookups.
+
+    Labels are read from the columns of a ConceptTable, not copied.
+    """
+
+    def __init__(self, table: ConceptTable):
+        self._table = table
+
+    @classmethod
+    def from_concepts(cls, concepts: typing.Iterable[VocabularyConcept]) -> "LabelTable":
+        return cls(ConceptTable(concepts))
+
+    def _labels(self, uri: str) -> typing.Optional[typing.Dict[str, LanguageLabels]]:
+        row = self._table.row(uri)
+        if row is None:
+            return None
+        return self._table.get_labels(row)
+
+    def get(self, uri: str, lang: str = "") -> typing.Optional[LanguageLabels]:
+        """Return the labels of uri with exactly the language tag lang."""
+        labels = self._labels(uri)
+        if labels is None:
+            return None
+        return labels.get(lang.lower())
+
+    def label(self, uri: str, lang: typing.Optional[str] = None) -> typing.Optional[str]:
+        """Return the preferred label of uri for lang, as from pick_label."""
+        labels = self._labels(uri)
+        if labels is None:
+            return None
+        return pick_label(labels, lang)
+
+    def languages(self) -> typing.List[str]:
+        """Return the language tags of all labels, "" for untagged labels."""
+        return sorted(self._table.languages())
+
+    def __contains__(self, uri) -> bool:
+        return uri in self._table
+
+    def __len__(self) -> int:
+        return len(self._table)
+
+
+# Local names that rdflib writes as prefix:name without further checks
+_SIMPLE_LOCAL_NAME = re.compile(r"[A-Za-z_][A-Za-z0-9_\-]*")
+
+# Characters that may appear in a local name, so cannot end a namespace
+# that rdflib splits a URI at
+_NAME_CHARS = frozenset("-._%()\u00b7\u0387")
+
+
+class NamespaceTable:
+    """Prefix expansion and compaction of names for a set of namespace bindings.
+
+    Namespaces are held in a character trie for longest prefix matching,
+    so translating a name not seen before is O(len(name)). Results are
+    memoized, so repeated names are a single dict lookup. Names the trie
+    cannot compact the same way rdflib would are passed to the namespace
+    manager. The table must be rebuilt when the bindings change.
+    """
+
+    def __init__(self, namespace_manager: rdflib.namespace.NamespaceManager):
+        self._nm = namespace_manager
+        self._namespaces: typing.Dict[str, str] = {}
+        # Nested dicts keyed by character, the prefix is stored under None
+        self._trie: dict = {}
+        self._expanded: typing.Dict[str, typing.Any] = {}
+        self._compacted: typing.Dict[typing.Any, typing.Any] = {}
+        for prefix, ns in namespace_manager.namespaces():
+            self._namespaces[prefix] = str(ns)
+            node = self._trie
+            for ch in str(ns):
+                node = node.setdefault(ch, {})
+            node[None] = prefix
+
+    def longest_namespace(self, uri: str) -> typing.Optional[typing.Tuple[str, str]]:
+        """Return (prefix, namespace) of the longest bound namespace uri starts with."""
+        node = self._trie
+        match = None
+        for i, ch in enumerate(uri):
+            node = node.get(ch)
+            if node is None:
+                break
+            if None in node:
+                match = (i + 1, node[None])
+        if match is None:
+            return None
+        return match[1], uri[: match[0]]
+
+    def expand(self, n: typing.Optional[str]) -> typing.Optional[str]:
+        """Return the URIRef for CURIE n, or n if it is not a CURIE with a bound prefix."""
+        if type(n) is not str:
+            # As for NamespaceManager.expand_curie, which only accepts str
+            return n
+        res = self._expanded.get(n)
+        if res is None:
+            res = n
+            prefix, sep, name = n.partition(":")
+            if sep:
+                ns = self._namespaces.get(prefix)
+                if ns is not None:
+                    res = rdflib.URIRef(ns + name)
+            if len(self._expanded) >= NAME_CACHE_SIZE:
+                self._expanded.clear()
+            self._expanded[n] = res
+        return res
+
+    def _compact(self, n) -> str:
+        uri = str(n)
+        match = self.longest_namespace(uri)
+        if match is not None:
+            prefix, ns = match
+            local = uri[len(ns):]
+            last = ns[-1]
+            if not (last.isalnum() or last in _NAME_CHARS) and _SIMPLE_LOCAL_NAME.fullmatch(local):
+                return f"{prefix}:{local}"
+        return rdflib.URIRef(uri).n3(self._nm)
+
+    def compact(self, n: typing.Optional[str]) -> typing.Optional[str]:
+        """Return n as prefix:name, or as <n> if no bound namespace applies."""
+        if n is None:
+            return n
+        res = self._compacted.get(n)
+        if res is None:
+            try:
+                res = self._compact(n)
+            except (ValueError, TypeError):
+                res = n
+            if len(self._compacted) >= NAME_CACHE_SIZE:
+                self._compacted.clear()
+            self._compacted[n] = res
+        return res
+
+    def __len__(self) -> int:
+        return len(self._namespaces)
+
+
+@dataclasses.dataclass(frozen=True)
+class Resolution:
+    """The concept that a term resolved to.
+
+    matched_by is "uri", "curie" or "label", or None with concept None if
+    the term did not resolve. path lists the URIs from a top concept down
+    to the concept, following the first broader concept at each step.
+    """
+    term: str
+    concept: typing.Optional[VocabularyConcept] = None
+    matched_by: typing.Optional[str] = None
+    path: typing.Tuple[str, ...] = ()
+
+    @property
+    def uri(self) -> typing.Optional[str]:
+        return None if self.concept is None else str(self.concept.uri)
+
+
+@dataclasses.dataclass
+class SnapshotHeader:
+    """The header of a snapshot file, read without loading the snapshot content.
+
+    sources holds the content hash of each source the snapshot was built
+    from, keyed by source identifier. offset is the position in the file
+    of the content following the header. byteorder is that of the integer
+    arrays in the content, "little" or "big".
+    """
+    path: str
+    store_identifier: str
+    sources: typing.Dict[str, typing.Optional[str]]
+    offset: int
+    byteorder: str = sys.byteorder
+
+    def stale_sources(self, sources: typing.Iterable[str]) -> typing.List[str]:
+        """Return the sources whose content does not match the recorded hash."""
+        stale = []
+        for source in sources:
+            digest = source_hash(source)
+            if digest is None or self.sources.get(source_identifier(source)) != digest:
+                stale.append(source)
+        return stale
+
+    def is_current(self, sources: typing.Iterable[str]) -> bool:
+        """True if the snapshot was built from the current content of sources."""
+        return len(self.stale_sources(sources)) == 0
+
+
 @dataclasses.dataclass
 class Vocabulary:
     uri: str
@@ -147,6 +973,256 @@ class Vocabulary:
     sourceRepository: typing.Optional[str] = None
 
 
+class ConceptHierarchy:
+    """Adjacency of the skos:broader relations between concepts.
+
+    Each node is given an integer id in the order first seen. Parent and
+    child lists are held in arrays indexed by that id, so walking the
+    hierarchy costs O(depth) or O(subtree) with no graph access.
+
+    The transitive ancestor closure is optional and computed on the first
+    call to ancestors(), or explicitly with compute_closure().
+    """
+
+    def __init__(self):
+        self._ids: typing.Dict[str, int] = {}
+        self._nodes: typing.List[rdflib.URIRef] = []
+        self._parents: typing.List[typing.List[int]] = []
+        self._children: typing.List[typing.List[int]] = []
+        self._ancestors: typing.Optional[typing.List[typing.FrozenSet[int]]] = None
+
+    @classmethod
+    def from_graph(cls, g: rdflib.Graph) -> "ConceptHierarchy":
+        """Build the hierarchy from the skos:broader statements in g."""
+        h = cls()
+        broader = skosT("broader")
+        for child, parent in g.subject_objects(broader):
+            h._children[h._node(parent)].append(h._node(child))
+        # Parents are listed in the order stored for each child.
+        for i, child in enumerate(h._nodes):
+            h._parents[i] = [h._ids[str(p)] for p in g.objects(child, broader)]
+        return h
+
+    def to_data(self) -> dict:
+        """Return the hierarchy as builtin types, as held in snapshots."""
+        return {
+            "nodes": [str(n) for n in self._nodes],
+            "parents": self._parents,
+            "children": self._children,
+        }
+
+    @classmethod
+    def from_data(cls, data: dict) -> "ConceptHierarchy":
+        """Return the hierarchy with the content returned by to_data()."""
+        h = cls()
+        h._nodes = [rdflib.URIRef(n) for n in data["nodes"]]
+        h._ids = {n: i for i, n in enumerate(data["nodes"])}
+        h._parents = data["parents"]
+        h._children = data["children"]
+        return h
+
+    def _node(self, uri) -> int:
+        key = str(uri)
+        i = self._ids.get(key)
+        if i is None:
+            i = len(self._nodes)
+            self._ids[key] = i
+            self._nodes.append(rdflib.URIRef(uri))
+            self._parents.append([])
+            self._children.append([])
+            self._ancestors = None
+        return i
+
+    def add(self, child: str, parent: str):
+        """Record that parent is skos:broader than child."""
+        c = self._node(child)
+        p = self._node(parent)
+        self._children[p].append(c)
+        self._parents[c].append(p)
+        self._ancestors = None
+
+    def __contains__(self, uri) -> bool:
+        return str(uri) in self._ids
+
+    def __len__(self) -> int:
+        return len(self._nodes)
+
+    def broader(self, uri: str) -> typing.List[rdflib.URIRef]:
+        i = self._ids.get(str(uri))
+        if i is None:
+            return []
+        return [self._nodes[p] for p in self._parents[i]]
+
+    def narrower(self, uri: str) -> typing.List[rdflib.URIRef]:
+        i = self._ids.get(str(uri))
+        if i is None:
+            return []
+        return [self._nodes[c] for c in self._children[i]]
+
+    def _walk(self, adjacency, i: int, level: int):
+        """Depth first traversal of adjacency from node i.
+
+        A node already on the current path is yielded but not expanded
+        again, so cycles do not cause infinite recursion.
+        """
+        path = [i]
+        stack = [iter(adjacency[i])]
+        while stack:
+            j = next(stack[-1], None)
+            if j is None:
+                stack.pop()
+                path.pop()
+                continue
+            yield self._nodes[j], level + len(stack) - 1
+            if j in path:
+                continue
+            path.append(j)
+            stack.append(iter(adjacency[j]))
+
+    def walk_narrower(self, uri: str, level: int = 0):
+        """Yield (URI, depth) for each concept below uri, depth first."""
+        i = self._ids.get(str(uri))
+        if i is None:
+            return
+        yield from self._walk(self._children, i, level)
+
+    def walk_broader(self, uri: str, level: int = 0):
+        """Yield (uri, level) then (URI, depth) for each broader concept."""
+        yield uri, level
+        i = self._ids.get(str(uri))
+        if i is None:
+            return
+        yield from self._walk(self._parents, i, level + 1)
+
+    def descendants(self, uri: str) -> typing.List[rdflib.URIRef]:
+        """Return the distinct concepts below uri in depth first order."""
+        seen = set()
+        res = []
+        for n, _ in self.walk_narrower(uri):
+            if n not in seen:
+                seen.add(n)
+                res.append(n)
+        return res
+
+    def compute_closure(self):
+        """Compute the set of ancestor ids for every node.
+
+        Ancestor sets of nodes that are part of a cycle may be incomplete.
+        """
+        closure: typing.List[typing.Optional[typing.FrozenSet[int]]] = [None] * len(
+            self._nodes
+        )
+        for i in range(len(self._nodes)):
+            if closure[i] is not None:
+                continue
+            # Iterative post-order so deep hierarchies do not hit the recursion limit.
+            stack = [(i, False)]
+            active = set()
+            while stack:
+                j, expanded = stack.pop()
+                if closure[j] is not None:
+                    continue
+                if expanded:
+                    anc = set(self._parents[j])
+                    for p in self._parents[j]:
+                        if closure[p] is not None:
+                            anc.update(closure[p])
+                    closure[j] = frozenset(anc)
+                    active.discard(j)
+                    continue
+                active.add(j)
+                stack.append((j, True))
+                for p in self._parents[j]:
+                    if closure[p] is None and p not in active:
+                        stack.append((p, False))
+        self._ancestors = closure
+
+    def ancestors(self, uri: str) -> typing.Set[rdflib.URIRef]:
+        """Return all concepts transitively broader than uri."""
+        i = self._ids.get(str(uri))
+        if i is None:
+            return set()
+        if self._ancestors is None:
+            self.compute_closure()
+        return {self._nodes[a] for a in self._ancestors[i]}
+
+    def path_to_top(self, uri: str) -> typing.List[rdflib.URIRef]:
+        """Return the concepts from a top concept down to uri.
+
+        Follows the first broader concept at each step.
+        """
+        res = [rdflib.URIRef(uri)]
+        i = self._ids.get(str(uri))
+        seen = set()
+        while i is not None and i not in seen and len(self._parents[i]) > 0:
+            seen.add(i)
+            i = self._parents[i][0]
+            res.append(self._nodes[i])
+        res.reverse()
+        return res
+
+    def depth(self, uri: str) -> int:
+        """Number of broader steps from uri to a top concept."""
+        return len(self.path_to_top(uri)) - 1
+
+    def roots(self) -> typing.List[rdflib.URIRef]:
+        """Return the concepts that have narrower but no broader concepts."""
+        return [self._nodes[i] for i in range(len(self._nodes)) if not self._parents[i]]
+
+    def cycles(self) -> typing.List[typing.List[rdflib.URIRef]]:
+        """Return each group of concepts that are broader than themselves.
+
+        The groups are the strongly connected components of the broader
+        relation with more than one member, or a single concept broader
+        than itself.
+        """
+        n = len(self._nodes)
+        index = [-1] * n
+        low = [0] * n
+        on_stack = [False] * n
+        stack = []
+        res = []
+        counter = 0
+        for start in range(n):
+            if index[start] >= 0:
+                continue
+            # Iterative Tarjan, so deep hierarchies do not hit the recursion limit.
+            work = [(start, iter(self._parents[start]))]
+            index[start] = low[start] = counter
+            counter += 1
+            stack.append(start)
+            on_stack[start] = True
+            while work:
+                i, parents = work[-1]
+                p = next(parents, None)
+                if p is not None:
+                    if index[p] < 0:
+                        index[p] = low[p] = counter
+                        counter += 1
+                        stack.append(p)
+                        on_stack[p] = True
+                        work.append((p, iter(self._parents[p])))
+                    elif on_stack[p]:
+                        low[i] = min(low[i], index[p])
+                    continue
+                work.pop()
+                if work:
+                    low[work[-1][0]] = min(low[work[-1][0]], low[i])
+                if low[i] != index[i]:
+                    continue
+                component = []
+                while True:
+                    j = stack.pop()
+                    on_stack[j] = False
+                    component.append(j)
+                    if j == i:
+                        break
+                if len(component) > 1 or i in self._parents[i]:
+                    component.reverse()
+                    res.append([self._nodes[j] for j in component])
+        return res
+
+
 class VocabularyStore:
     _PFX = f"""
 PREFIX skos: <{NS['skos']}>
@@ -156,6 +1232,24 @@ PREFIX rdfs: <{NS['rdfs']}>
 """
     DEFAULT_FORMAT = "text/turtle"
     DEFAULT_STORE = "default"
+    # rdflib store plugin used when storage_uri is a path
+    PERSISTENT_STORE = "BerkeleyDB"
+
+    @staticmethod
+    @functools.lru_cache(maxsize=QUERY_CACHE_SIZE)
+    def _prepare(q: str) -> rdflib.plugins.sparql.sparql.Query:
+        """Parse and translate a SPARQL query, caching the result by query text."""
+        return rdflib.plugins.sparql.prepareQuery(VocabularyStore._PFX + q)
+
+    @staticmethod
+    def query_cache_info() -> functools._CacheInfo:
+        """Return hits, misses, maxsize and currsize of the prepared query cache."""
+        return VocabularyStore._prepare.cache_info()
+
+    @staticmethod
+    def query_cache_clear():
+        """Empty the prepared query cache and reset its counters."""
+        VocabularyStore._prepare.cache_clear()
 
     def __init__(
         self,
@@ -163,28 +1257,346 @@ PREFIX rdfs: <{NS['rdfs']}>
         store_identifier=STORE_IDENTIFIER,
         purge_existing=False,
     ):
+        """Create or open a store.
+
+        storage_uri is DEFAULT_STORE for an in-memory store, otherwise the
+        path of an on-disk store that is opened, or created if necessary.
+        purge_existing removes any existing content of an on-disk store.
+        """
         self.origin = None
         self.storage_uri = storage_uri
         self.store_identifier = store_identifier
         self._g = None
         self._terms = {}
         self._literals = ""
+        # Content hash of each loaded source, keyed by source identifier
+        self._sources: typing.Dict[str, typing.Optional[str]] = {}
+        # Path of the snapshot the store was loaded from, if any
+        self.snapshot = None
+        # Optional vocab_tools.profiling.Profiler recording query and phase timings
+        self.profiler = None
+        # Incremented whenever the content or namespace bindings of the store change
+        self.generation = 0
+        # (generation, content_tag()) of the last computed tag
+        self._content_tag = None
+        # Concept table, index, hierarchy, labels and search index, computed on demand from the graph
+        self._concepts = None
+        self._concept_index = None
+        self._hierarchy = None
+        self._label_table = None
+        self._search_index = None
+        self._resolver = None
+        # Expansion and compaction of names, built on demand from the namespace bindings
+        self._namespace_table = None
         self._initialize_store(purge=purge_existing)
 
     def __len__(self):
         return len(self._g)
 
-    def _initialize_store(self, purge=False, store="default"):
+    @property
+    def is_persistent(self) -> bool:
+        return self.storage_uri != VocabularyStore.DEFAULT_STORE
+
+    def _initialize_store(self, purge=False, store=None):
+        if store is None:
+            store = VocabularyStore.DEFAULT_STORE
+            if self.is_persistent:
+                # Imported here so the plugin is only loaded for on-disk stores
+                from rdflib.plugins.stores import berkeleydb
+
+                store = VocabularyStore.PERSISTENT_STORE
+                if not berkeleydb.has_bsddb:
+                    raise ImportError(
+                        "The berkeleydb package is required for on-disk stores."
+                    )
+                # The BerkeleyDB store does not implement destroy()
+                if purge and os.path.isdir(self.storage_uri):
+                    shutil.rmtree(self.storage_uri)
         graph = rdflib.ConjunctiveGraph(store=store, identifier=self.store_identifier)
         if purge:
             graph.destroy(self.storage_uri)
         graph.open(self.storage_uri, create=True)
         self._g = graph
+        self._sources = self._read_sources()
+
+    def close(self):
+        """Commit any pending changes and close the underlying store."""
+        self._g.commit()
+        self._g.close()
+
+    def _sources_path(self) -> typing.Optional[str]:
+        if not self.is_persistent:
+            return None
+        return os.path.join(self.storage_uri, SOURCES_FILE)
+
+    def _read_sources(self) -> typing.Dict[str, typing.Optional[str]]:
+        path = self._sources_path()
+        if path is None or not os.path.exists(path):
+            return {}
+        with open(path, "r", encoding="utf-8") as src:
+            return json.load(src)
+
+    def _write_sources(self):
+        """Save the source hashes of an on-disk store, once its triples are committed."""
+        path = self._sources_path()
+        if path is None:
+            return
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as dest:
+            json.dump(self._sources, dest, indent=2)
+        os.replace(tmp, path)
+
+    def sources(self) -> typing.Dict[str, typing.Optional[str]]:
+        """Return the content hash of each loaded source, keyed by source identifier.
+
+        The hash is None for sources that are not local files, such as
+        remote URLs, as their content is not known.
+        """
+        return dict(self._sources)
+
+    def source_graph(self, source: str) -> rdflib.Graph:
+        """Return the graph holding the triples loaded from source."""
+        return self._g.get_context(rdflib.URIRef(source_identifier(source)))
 
     @property
     def graph(self):
         return self._g
 
+    def _invalidate_caches(self):
+        """Drop any tables derived from the graph content.
+
+        Must be called whenever triples are added to the store.
+        """
+        self.generation += 1
+        self._concepts = None
+        self._concept_index = None
+        self._hierarchy = None
+        self._label_table = None
+        self._search_index = None
+        self._resolver = None
+        self._namespace_table = None
+
+    def save_snapshot(self, path: str):
+        """Write the store content to a binary snapshot file at path.
+
+        A header with the store identifier and the content hashes of the
+        loaded sources is followed by the quads as arrays of indexes into a
+        table of distinct terms, the namespace bindings, the concept table
+        and the hierarchy. The content is held in builtin types only, so it
+        can be loaded without running any code from the file.
+        """
+        terms = _TermTable()
+        quads = array.array(SNAPSHOT_TYPECODE)
+        for predicate in _ordered_predicates(self._g):
+            for s, p, o, c in self._g.quads((None, predicate, None, None)):
+                quads.extend((terms.id(s), terms.id(p), terms.id(o), terms.id(c.identifier)))
+        header = json.dumps({
+            "store_identifier": str(self.store_identifier),
+            "sources": self.sources(),
+            "array": {
+                "typecode": SNAPSHOT_TYPECODE,
+                "itemsize": quads.itemsize,
+                "byteorder": sys.byteorder,
+            },
+        }).encode("utf-8")
+        payload = {
+            "namespaces": [(prefix, str(ns)) for prefix, ns in self.namespaces()],
+            "terms": terms.encoded(),
+            "quads": quads.tobytes(),
+            "concepts": self._concept_table().to_data(),
+            "hierarchy": self.hierarchy().to_data(),
+        }
+        with open(path, "wb") as dest:
+            dest.write(SNAPSHOT_MAGIC)
+            dest.write(SNAPSHOT_VERSION.to_bytes(2, "big"))
+            dest.write(len(header).to_bytes(4, "big"))
+            dest.write(header)
+            pickle.dump(payload, dest, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def read_snapshot_header(path: str) -> "SnapshotHeader":
+        """Return the header of the snapshot at path, without reading its content.
+
+        Raises ValueError if path is not a snapshot of the current version,
+        or if its integer arrays have a different item size than on this
+        platform. Arrays of the other byte order are swapped when loaded.
+        """
+        with open(path, "rb") as src:
+            prefix = src.read(len(SNAPSHOT_MAGIC) + 6)
+            n = len(SNAPSHOT_MAGIC)
+            if len(prefix) < n + 6 or prefix[:n] != SNAPSHOT_MAGIC:
+                raise ValueError(f"{path} is not a vocabulary snapshot.")
+            version = int.from_bytes(prefix[n : n + 2], "big")
+            if version != SNAPSHOT_VERSION:
+                raise ValueError(f"Unsupported snapshot version {version} in {path}.")
+            size = int.from_bytes(prefix[n + 2 :], "big")
+            try:
+                header = json.loads(src.read(size).decode("utf-8"))
+            except ValueError as e:
+                raise ValueError(f"Invalid snapshot header in {path}: {e}") from e
+        arrays = header.get("array", {})
+        itemsize = array.array(SNAPSHOT_TYPECODE).itemsize
+        if arrays.get("typecode") != SNAPSHOT_TYPECODE or arrays.get("itemsize") != itemsize:
+            raise ValueError(
+                f"Snapshot {path} holds arrays of {arrays.get('itemsize')} byte integers, "
+                f"not {itemsize} as on this platform."
+            )
+        if arrays.get("byteorder") not in ("little", "big"):
+            raise ValueError(f"Invalid snapshot byte order in {path}.")
+        return SnapshotHeader(
+            path=path,
+            store_identifier=header["store_identifier"],
+            sources=header["sources"],
+            offset=len(prefix) + size,
+            byteorder=arrays["byteorder"],
+        )
+
+    @staticmethod
+    def snapshot_is_current(path: str, sources: typing.Iterable[str]) -> bool:
+        """True if the snapshot at path was built from the current content of sources.
+
+        Only the header of the snapshot is read.
+        """
+        try:
+            header = VocabularyStore.read_snapshot_header(path)
+        except (OSError, ValueError) as e:
+            L.debug("Snapshot %s not usable: %s", path, e)
+            return False
+        return header.is_current(sources)
+
+    @classmethod
+    def from_snapshot(
+        cls,
+        path: typing.Union[str, "SnapshotHeader"],
+        sources: typing.Optional[typing.Iterable[str]] = None,
+    ) -> "VocabularyStore":
+        """Return an in-memory store populated from the snapshot at path.
+
+        path may also be the SnapshotHeader returned by read_snapshot_header,
+        so the header is not read again. If sources is provided, raises
+        ValueError unless the snapshot was built from the current content
+        of each of them. The snapshot content may only hold builtin types,
+        and ValueError is raised for anything else.
+        """
+        header = path
+        if not isinstance(header, SnapshotHeader):
+            header = cls.read_snapshot_header(path)
+        if sources is not None:
+            stale = header.stale_sources(sources)
+            if len(stale) > 0:
+                raise ValueError(
+                    f"Snapshot {header.path} is out of date for: {', '.join(stale)}"
+                )
+        with open(header.path, "rb") as src:
+            src.seek(header.offset)
+            try:
+                payload = _DataUnpickler(src).load()
+            except (pickle.UnpicklingError, EOFError) as e:
+                raise ValueError(f"Invalid snapshot content in {header.path}: {e}") from e
+        store = cls(store_identifier=header.store_identifier)
+        store.snapshot = header.path
+        for prefix, ns in payload["namespaces"]:
+            store._g.namespace_manager.bind(prefix, ns, override=True, replace=True)
+        terms = [_decode_term(t) for t in payload["terms"]]
+        byteswap = header.byteorder != sys.byteorder
+        quads = _bytes_array(payload["quads"], byteswap=byteswap)
+        contexts = {}
+
+        def _quads():
+            for i in range(0, len(quads), 4):
+                c = quads[i + 3]
+                ctx = contexts.get(c)
+                if ctx is None:
+                    ctx = store._g.get_context(terms[c])
+                    contexts[c] = ctx
+                yield terms[quads[i]], terms[quads[i + 1]], terms[quads[i + 2]], ctx
+
+        store._g.addN(_quads())
+        store._sources = dict(header.sources)
+        store._concepts = ConceptTable.from_data(payload["concepts"], byteswap=byteswap)
+        store._hierarchy = ConceptHierarchy.from_data(payload["hierarchy"])
+        return store
+
+    def changed_sources(self, sources: typing.Iterable[str]) -> typing.List[str]:
+        """Return the local sources whose content differs from when they were loaded.
+
+        Remote sources, which have no content hash, are not included.
+        """
+        recorded = self.sources()
+        changed = []
+        for source in sources:
+            digest = source_hash(source)
+            if digest is not None and recorded.get(source_identifier(source)) != digest:
+                changed.append(source)
+        return changed
+
+    def copy(self, exclude: typing.Iterable[str] = ()) -> "VocabularyStore":
+        """Return an in-memory store with the same content and namespace bindings.
+
+        The triples loaded from the sources in exclude are left out.
+        """
+        skip = {rdflib.URIRef(source_identifier(source)) for source in exclude}
+        store = VocabularyStore(store_identifier=self.store_identifier)
+        store.profiler = self.profiler
+        with self._phase("store.copy"):
+            for prefix, ns in self.namespaces():
+                store._g.namespace_manager.bind(prefix, ns, override=True, replace=True)
+            # The copy allocates many small dicts, for which garbage
+            # collection would cost more than copying
+            collecting = gc.isenabled()
+            gc.disable()
+            try:
+                copied = _copy_memory_store(self._g, store._g, skip)
+            finally:
+                if collecting:
+                    gc.enable()
+            if not copied:
+                contexts = {}
+
+                def _quads():
+                    for s, p, o, c in self._g.quads((None, None, None, None)):
+                        if c.identifier in skip:
+                            continue
+                        ctx = contexts.get(c.identifier)
+                        if ctx is None:
+                            ctx = store._g.get_context(c.identifier)
+                            contexts[c.identifier] = ctx
+                        yield s, p, o, ctx
+
+                store._g.addN(_quads())
+        store._sources = {
+            source_id: digest
+            for source_id, digest in self._sources.items()
+            if rdflib.URIRef(source_id) not in skip
+        }
+        return store
+
+    def reloaded(
+        self,
+        sources: typing.Iterable[str],
+        format: str = DEFAULT_FORMAT,
+    ) -> "VocabularyStore":
+        """Return a copy of the store with the changed sources among sources loaded again.
+
+        The triples of unchanged sources are copied rather than parsed.
+        The store itself is not modified, so it can go on answering
+        queries while the copy is built.
+        """
+        sources = list(sources)
+        store = self.copy(exclude=self.changed_sources(sources))
+        store.load_many(sources, format=format)
+        return store
+
+    def hierarchy(self) -> ConceptHierarchy:
+        """Return the skos:broader hierarchy of the store.
+
+        Built once and kept until the store changes.
+        """
+        if self._hierarchy is None:
+            with self._phase("store.hierarchy"):
+                self._hierarchy = ConceptHierarchy.from_graph(self._g)
+        return self._hierarchy
+
     def load(
         self,
         source: str,
@@ -194,60 +1606,124 @@ PREFIX rdfs: <{NS['rdfs']}>
         """
         Loads a vocabulary into the store.
 
+        Local sources whose content hash matches the one recorded when they
+        were previously loaded are skipped. A changed source, or one that is
+        not a local file, replaces the triples loaded from its earlier version.
+        """
+        self.load_many([source], format=format, bindings=bindings)
+
+    def _pending_sources(
+        self, sources: typing.Iterable[str]
+    ) -> typing.List[typing.Tuple[str, str, typing.Optional[str]]]:
+        """Return (source, identifier, hash) for each source that needs parsing.
+
+        Sources that are unchanged since they were last loaded are skipped.
+        Triples from an earlier version of a changed source are removed.
+        """
+        recorded = self.sources()
+        pending = []
+        for source in sources:
+            source_id = source_identifier(source)
+            digest = source_hash(source)
+            previous = recorded.get(source_id)
+            if digest is not None and digest == previous:
+                L.info("Source unchanged, skipping %s", source)
+                continue
+            if source_id in recorded:
+                L.info("Source changed, reloading %s", source)
+                self._g.remove_context(self._g.get_context(rdflib.URIRef(source_id)))
+                del self._sources[source_id]
+            pending.append((source, source_id, digest))
+        return pending
+
+    def load_many(
+        self,
+        sources: typing.Iterable[str],
+        format: str = DEFAULT_FORMAT,
+        bindings: typing.Optional[dict] = None,
+    ):
+        """
+        Loads several vocabularies into the store.
+
+        Each source is parsed in turn into its own named graph, then the
+        extended vocabularies are inferred once over the merged content.
+
+        Sources are skipped or replaced as described for load().
+        """
+        pending = self._pending_sources(sources)
+        if len(pending) == 0:
+            return
+        # Each source is held in a named graph so it can be replaced later.
+        loaded_graphs = [
+            self._g.get_context(rdflib.URIRef(source_id)) for _, source_id, _ in pending
+        ]
+        with self._phase("load.parse"):
+            for g_loaded, (source, source_id, _) in zip(loaded_graphs, pending):
+                g_loaded.parse(source, format=format, publicID=source_id)
+        with self._phase("load.commit"):
+            for _, source_id, digest in pending:
+                self._sources[source_id] = digest
+            if bindings is not None:
+                for k, v in bindings.items():
+                    self._g.bind(k, v)
+            self._g.commit()
+            self._write_sources()
+        self._invalidate_caches()
+        with self._phase("load.infer"):
+            for g_loaded in loaded_graphs:
+                self._infer_extended_vocabulary(g_loaded)
+
+    def _infer_extended_vocabulary(self, g_loaded: rdflib.Graph):
+        """Record the vocabularies extended by the vocabulary in g_loaded.
+
+        Adds loaded_vocabulary rdfs:subPropertyOf extended_vocabulary unless
+        the relation is already present. The statement is added to g_loaded,
+        so it is removed, and inferred again, when the source is replaced.
         """
-        g_loaded = self._g.parse(source, format=format)
-        if bindings is not None:
-            for k, v in bindings.items():
-                self._g.bind(k, v)
         # Figure the broader concept vocabularies.
         # First check for extension_vocab rdfs:subPropertyOf extended_vocab
         # if not present, then compute and add it for later use.
         # What vocabulary did we just load?
-        q = (
-            VocabularyStore._PFX
-            + """SELECT ?s
+        q = """SELECT ?s
         WHERE {
             ?s rdf:type skos:ConceptScheme .
         }"""
-        )
-        qres = g_loaded.query(q)
+        qres = self._query_graph(g_loaded, q)
         loaded_vocabulary = self._result_single_value(qres, abbreviate=False)
         if loaded_vocabulary is not None:
             L.info("Loaded vocabulary %s", loaded_vocabulary)
-            q = (
-                VocabularyStore._PFX
-                + """SELECT ?extended
+            q = """SELECT ?extended
             WHERE {
                 ?vocabulary rdfs:subPropertyOf ?extended .
             }"""
-            )
-            qres = self._g.query(q, initBindings={"vocabulary": loaded_vocabulary})
+            qres = self.query(q, vocabulary=loaded_vocabulary)
             _extended_vocab = self._result_single_value(qres, abbreviate=False)
             if _extended_vocab is not None:
                 L.info("Extends: %s", _extended_vocab)
                 return
             # The extended vocabulary is not specified
             # Figure it by examining the broader concepts for each
-            # concept in the loaded vocabulary
-            q = (
-                VocabularyStore._PFX
-                + """SELECT ?s
-            WHERE {
-                ?child rdf:type skos:Concept .
-                ?child skos:broader ?s .
-            }"""
-            )
-            qres = g_loaded.query(q)
-            broader_concepts = self._one_res(qres)
+            # concept in the loaded vocabulary. The triples are read
+            # directly, as building the concept table here would be
+            # repeated for every load
+            is_concept = rdfT("type"), skosT("Concept")
+            broader_concepts = set()
+            for child, _, c in g_loaded.triples((None, skosT("broader"), None)):
+                if (child,) + is_concept in g_loaded:
+                    broader_concepts.add(c)
             vocabs = set()
+            in_scheme = skosT("inScheme")
+            top_concept_of = skosT("topConceptOf")
             for c in broader_concepts:
-                concept = self.concept(str(c))
-                if concept.vocabulary is not None:
-                    vocabs.add(concept.vocabulary)
+                vocabulary = self._g.value(c, in_scheme)
+                if vocabulary is None:
+                    vocabulary = self._g.value(c, top_concept_of)
+                if vocabulary is not None:
+                    vocabs.add(str(vocabulary))
             for vocab in vocabs:
                 if str(vocab) != str(loaded_vocabulary):
                     L.info("Extends: %s", vocab)
-                    self._g.add(
+                    g_loaded.add(
                         (
                             rdflib.URIRef(loaded_vocabulary),
                             rdfsT("subPropertyOf"),
@@ -258,23 +1734,20 @@ PREFIX rdfs: <{NS['rdfs']}>
             return
         L.warning("Loaded vocabulary does not specify skos:ConceptScheme")
 
+    def namespace_table(self) -> NamespaceTable:
+        """Return the NamespaceTable of the current namespace bindings.
+
+        Built once and kept until a namespace is bound or sources are loaded.
+        """
+        if self._namespace_table is None:
+            self._namespace_table = NamespaceTable(self._g.namespace_manager)
+        return self._namespace_table
+
     def expand_name(self, n: typing.Optional[str]) -> typing.Optional[str]:
-        if n is None:
-            return n
-        try:
-            return self._g.namespace_manager.expand_curie(n)
-        except (ValueError, TypeError):
-            pass
-        return n
+        return self.namespace_table().expand(n)
 
     def compact_name(self, n: typing.Optional[str]) -> typing.Optional[str]:
-        if n is None:
-            return n
-        try:
-            return rdflib.URIRef(n).n3(self._g.namespace_manager)
-        except (ValueError, TypeError):
-            pass
-        return n
+        return self.namespace_table().compact(n)
 
     def _one_res(self, rows, abbreviate=False) -> list[str]:
         res = []
@@ -316,13 +1789,76 @@ PREFIX rdfs: <{NS['rdfs']}>
     def namespaces(self) -> list[str, rdflib.URIRef]:
         return [n for n in self._g.namespace_manager.namespaces()]
 
+    def content_tag(self) -> str:
+        """Return a hash identifying the content and namespace bindings of the store.
+
+        Derived from the content hashes of the loaded sources, the number
+        of triples and the bindings, so a store loaded from a snapshot has
+        the same tag as the store that wrote it. Sources without a content
+        hash, such as remote URLs, are hashed by the triples loaded from
+        them. Computed once per generation.
+        """
+        if self._content_tag is None or self._content_tag[0] != self.generation:
+            h = hashlib.sha256()
+            for source, digest in sorted(self.sources().items()):
+                if digest is None:
+                    digest = self._source_graph_hash(source)
+                h.update(f"{source} {digest}\n".encode())
+            h.update(f"{len(self)}\n".encode())
+            for prefix, ns in sorted(self.namespaces()):
+                h.update(f"{prefix} {ns}\n".encode())
+            self._content_tag = (self.generation, h.hexdigest())
+        return self._content_tag[1]
+
+    def _source_graph_hash(self, source_id: str) -> str:
+        """Return a hash of the triples loaded from source_id, in any order.
+
+        Blank nodes are hashed by label, so a source containing them gets a
+        new hash each time it is parsed.
+        """
+        h = hashlib.sha256()
+        g = self._g.get_context(rdflib.URIRef(source_id))
+        for line in sorted(f"{s.n3()} {p.n3()} {o.n3()}" for s, p, o in g):
+            h.update(line.encode())
+            h.update(b"\n")
+        return h.hexdigest()
+
     def bind(self, prefix: str, uri: str, override: bool = True):
         self._g.namespace_manager.bind(prefix, uri, override=override)
+        # The concept index and resolver are keyed by compact names
+        self._namespace_table = None
+        self._concept_index = None
+        self._resolver = None
+        self.generation += 1
+
+    def _phase(self, name: str):
+        """Context manager timing phase name if profiling is enabled."""
+        return vocab_tools.profiling.phase(self.profiler, name)
+
+    def enable_profiling(
+        self, profiler: typing.Optional[vocab_tools.profiling.Profiler] = None
+    ) -> vocab_tools.profiling.Profiler:
+        """Start recording query and phase timings, returning the profiler used."""
+        if profiler is None:
+            profiler = vocab_tools.profiling.Profiler()
+        self.profiler = profiler
+        return profiler
+
+    def _query_graph(self, g: rdflib.Graph, q: str, **bindings):
+        # L.debug(f"query: {q}")
+        if self.profiler is None:
+            return g.query(VocabularyStore._prepare(q), initBindings=bindings)
+        t0 = time.perf_counter()
+        prepared = VocabularyStore._prepare(q)
+        t1 = time.perf_counter()
+        qres = g.query(prepared, initBindings=bindings)
+        # Evaluate all the rows now so they are included in the timing
+        n_rows = len(qres)
+        self.profiler.record_query(q, t1 - t0, time.perf_counter() - t1, n_rows)
+        return qres
 
     def query(self, q, **bindings):
-        # L.debug(f"query: {q}")
-        sparql = rdflib.plugins.sparql.prepareQuery(VocabularyStore._PFX + q)
-        return self._g.query(sparql, initBindings=bindings)
+        return self._query_graph(self._g, q, **bindings)
 
     def vocabulary(self, uri: str) -> Vocabulary:
         """Return a Vocabulary given its URI.
@@ -366,8 +1902,7 @@ PREFIX rdfs: <{NS['rdfs']}>
         q = """SELECT DISTINCT ?vocabulary
         WHERE {
             ?vocabulary rdf:type skos:ConceptScheme .
-            ?subject ?predicate ?foo .
-            FILTER (?predicate != skos:inScheme) .
+            FILTER NOT EXISTS { ?vocabulary skos:inScheme ?extended . } .
         }"""
         qres = self.query(q)
         for res in qres:
@@ -386,58 +1921,231 @@ PREFIX rdfs: <{NS['rdfs']}>
         qres = self.query(q)
         return [row[0] for row in qres]
 
-    def concept(self, term: str):
-        """Given a URI, return the matching VocabularyConcept
+    def _concept_properties(self, subject) -> typing.Dict[str, typing.List[rdflib.term.Node]]:
+        """Return the non-empty object values of subject, grouped by predicate.
 
-        Raises KeyError if not found.
+        Values are in the same order as returned by objects().
         """
-        term = self.expand_name(term)
+        props = {}
+        for p, o in self._g.predicate_objects(rdflib.URIRef(subject)):
+            if len(str(o).strip()) > 0:
+                props.setdefault(str(p), []).append(o)
+        return props
+
+    @staticmethod
+    def _make_concept(
+        term: str, props: typing.Dict[str, typing.List[rdflib.term.Node]], narrower: list
+    ) -> VocabularyConcept:
+        """Build a VocabularyConcept from the grouped properties of term."""
+
+        def _values(predicate) -> typing.List[str]:
+            return [str(v).strip() for v in props.get(str(predicate), [])]
+
         if "#" in term:
             ab = term.split("#")
         else:
             ab = term.split("/")
         name = ab[-1]
-        labels = self.objects(term, skosT("prefLabel"))
-        labels += self.objects(term, skosT("altLabel"))
-        #labels += self.objects(term, rdfsT("label"))  # these are by convention the same as skos:prefLabel
-        tmp = self.objects(term, skosT("definition"))
-        definition = "\n".join(tmp)
-        broader = self.objects(term, skosT("broader"))
-        narrower = self.narrower(term)
-        notes = self.objects(term, skosT("note"))
-        notes += self.objects(term, skosT("editorialNote"))
-        notes += self.objects(term, skosT("scopeNote"))
-        notes += self.objects(term, skosT("changeNote"))
-        notes += self.objects(term, rdfsT("comment"))
-        vocabulary = self.objects(term, skosT("inScheme"))
+        labels = _values(skosT("prefLabel"))
+        labels += _values(skosT("altLabel"))
+        #labels += _values(rdfsT("label"))  # these are by convention the same as skos:prefLabel
+        definition = "\n".join(_values(skosT("definition")))
+        notes = _values(skosT("note"))
+        notes += _values(skosT("editorialNote"))
+        notes += _values(skosT("scopeNote"))
+        notes += _values(skosT("changeNote"))
+        notes += _values(rdfsT("comment"))
+        vocabulary = _values(skosT("inScheme"))
         if len(vocabulary) > 0:
             vocabulary = vocabulary[0]
         else:
             # May be set with topConceptOf
-            vocabulary = self.objects(term, skosT("topConceptOf"))
+            vocabulary = _values(skosT("topConceptOf"))
             if len(vocabulary) > 0:
                 vocabulary = vocabulary[0]
             else:
                 vocabulary = None
-        history = self.objects(term, skosT("historyNote"))
-        sources = self.objects(term, dctermT("source"))
         return VocabularyConcept(
             uri=str(term),
             name=name,
             label=labels,
             definition=definition.strip(),
-            broader=broader,
+            broader=_values(skosT("broader")),
             narrower=narrower,
             vocabulary=vocabulary,
-            history=history,
+            history=_values(skosT("historyNote")),
             notes=notes,
-            sources=sources,
-            #scopenote=self.objects(term, skosT("scopeNote")),
-            related=self.objects(term, skosT("related")),
-            example=self.objects(term, skosT("example")),
-            #changenote=self.objects(term, skosT("changeNote")),
+            sources=_values(dctermT("source")),
+            related=_values(skosT("related")),
+            example=_values(skosT("example")),
+            labels=language_labels(
+                props.get(str(skosT("prefLabel")), []),
+                props.get(str(skosT("altLabel")), []),
+            ),
         )
 
+    def _concept_table(self) -> ConceptTable:
+        """Return all skos:Concept instances keyed by URI string.
+
+        The table is built with a single pass over the skos:broader triples
+        and one index lookup per concept, then kept until the store changes.
+        """
+        if self._concepts is None:
+            with self._phase("store.concept_table"):
+                self._concepts = self._build_concept_table()
+        return self._concepts
+
+    def _build_concept_table(self) -> ConceptTable:
+        narrower = {}
+        for child, parent in self._g.subject_objects(skosT("broader")):
+            narrower.setdefault(str(parent), []).append(child)
+        table = ConceptTable()
+        for subject in self._g.subjects(rdfT("type"), skosT("Concept")):
+            key = str(subject)
+            if key in table:
+                continue
+            table.add(
+                self._make_concept(key, self._concept_properties(subject), narrower.get(key, []))
+            )
+        return table
+
+    def concepts_bulk(
+        self, vocabulary: typing.Optional[str] = None
+    ) -> typing.List[VocabularyConcept]:
+        """Return VocabularyConcept instances for all the concepts in vocabulary.
+
+        If vocabulary is None, all skos:Concept instances in the store are
+        returned. Order matches the URIs returned by concepts().
+        """
+        table = self._concept_table()
+        if vocabulary is None:
+            return list(table.values())
+        return [table.concept(row) for row in self._vocabulary_rows(vocabulary)]
+
+    def _vocabulary_rows(self, vocabulary: str) -> typing.List[int]:
+        """Return the concept table rows of the concepts in vocabulary, in table order."""
+        v = rdflib.URIRef(self.expand_name(vocabulary))
+        members = set(str(s) for s in self._g.subjects(skosT("inScheme"), v))
+        members.update(str(s) for s in self._g.subjects(skosT("topConceptOf"), v))
+        table = self._concept_table()
+        return sorted(row for row in (table.row(uri) for uri in members) if row is not None)
+
+    def concept_index(self, vocabulary: typing.Optional[str] = None) -> ConceptIndex:
+        """Return a ConceptIndex of the concepts in vocabulary.
+
+        The index reads the concepts from the concept table. If vocabulary
+        is None, it covers all concepts in the store and is kept until the
+        store changes.
+        """
+        if vocabulary is not None:
+            return ConceptIndex.from_table(
+                self._concept_table(), self._vocabulary_rows(vocabulary), compact_name=self.compact_name
+            )
+        if self._concept_index is None:
+            self._concept_index = ConceptIndex.from_table(
+                self._concept_table(), compact_name=self.compact_name
+            )
+        return self._concept_index
+
+    def label_table(self) -> LabelTable:
+        """Return the labels of all concepts by language.
+
+        The table reads the labels held in the concept table, and is kept
+        until the store changes.
+        """
+        if self._label_table is None:
+            self._label_table = LabelTable(self._concept_table())
+        return self._label_table
+
+    def languages(self) -> typing.List[str]:
+        """Return the language tags of the concept labels, "" for untagged labels."""
+        return self.label_table().languages()
+
+    def search_index(self) -> "vocab_tools.search.SearchIndex":
+        """Return the text search index of all concepts.
+
+        The index is built from the concept table and kept until the store changes.
+        """
+        if self._search_index is None:
+            import vocab_tools.search
+
+            with self._phase("store.search_index"):
+                self._search_index = vocab_tools.search.SearchIndex(self.concepts_bulk())
+        return self._search_index
+
+    def search(
+        self, text: str, limit: typing.Optional[int] = 10, fuzzy: bool = True
+    ) -> typing.List["vocab_tools.search.SearchHit"]:
+        """Return concepts with labels or definitions matching text, best first.
+
+        See vocab_tools.search.SearchIndex.search.
+        """
+        return self.search_index().search(text, limit=limit, fuzzy=fuzzy)
+
+    def concept(self, term: str):
+        """Given a URI, return the matching VocabularyConcept
+
+        Raises KeyError if not found.
+        """
+        term = self.expand_name(term)
+        c = self._concept_table().get(str(term))
+        if c is not None:
+            return c
+        # Not typed as a skos:Concept, build it from whatever is available.
+        return self._make_concept(
+            str(term),
+            self._concept_properties(term),
+            list(self._g.subjects(skosT("broader"), rdflib.URIRef(term))),
+        )
+
+
+    def _resolve(self, term: str) -> Resolution:
+        index = self.concept_index()
+        c = index.by_uri(term)
+        matched_by = "uri"
+        if c is None:
+            c = index.by_curie(term)
+            if c is None and ":" in term:
+                c = index.by_uri(self.expand_name(term))
+            matched_by = "curie"
+        if c is None:
+            matched_by = "label"
+            hits = [
+                h for h in self.search_index().casefold(term) if h.field != "definition"
+            ]
+            if len(hits) > 0:
+                hits.sort(key=lambda h: -h.score)
+                c = index.by_uri(hits[0].uri)
+        if c is None:
+            return Resolution(term=term)
+        path = tuple(str(u) for u in self.hierarchy().path_to_top(c.uri))
+        return Resolution(term=term, concept=c, matched_by=matched_by, path=path)
+
+    def resolve(self, term: str) -> Resolution:
+        """Resolve a URI, CURIE or label to a concept and its path from a top concept.
+
+        Labels are matched ignoring case, preferred labels first. Results
+        are kept in an LRU cache of RESOLVE_CACHE_SIZE terms until the store
+        changes. Once the concept index, hierarchy and search index are
+        built, no graph access is needed.
+        """
+        if self._resolver is None:
+            self._resolver = functools.lru_cache(maxsize=RESOLVE_CACHE_SIZE)(self._resolve)
+        return self._resolver(str(term).strip())
+
+    def resolve_many(self, terms: typing.Iterable[str]) -> typing.Iterator[Resolution]:
+        """Yield the Resolution of each of terms, in order.
+
+        Repeated terms are only resolved once while they remain in the cache.
+        """
+        for term in terms:
+            yield self.resolve(term)
+
+    def resolve_cache_info(self) -> typing.Optional[functools._CacheInfo]:
+        """Return hits, misses, maxsize and currsize of the resolve cache, None before first use."""
+        if self._resolver is None:
+            return None
+        return self._resolver.cache_info()
 
     def top_concept(self):
         """Get the root concept(s) in the specified vocabulary.
@@ -480,10 +2188,7 @@ PREFIX rdfs: <{NS['rdfs']}>
         Returns a list of the skos:Concept instances in the specified vocabulary
         as it exists in the current graph store.
         """
-        try:
-            v = self._g.namespace_manager.expand_curie(v)
-        except (ValueError, TypeError):
-            pass
+        v = self.expand_name(v)
         if v is None:
             q = """SELECT ?s
             WHERE {
@@ -505,11 +2210,7 @@ PREFIX rdfs: <{NS['rdfs']}>
     ) -> list[str]:
         concept = rdflib.URIRef(self.expand_name(concept))
         if v is None:
-            q = """SELECT ?s
-            WHERE {
-                ?child skos:broader ?s .
-            }"""
-            qres = self.query(q, child=concept)
+            qres = [(uri,) for uri in self.hierarchy().broader(concept)]
         else:
             v = self.expand_name(v)
             q = """SELECT ?s
@@ -528,11 +2229,7 @@ PREFIX rdfs: <{NS['rdfs']}>
     ) -> list[str]:
         concept = rdflib.URIRef(self.expand_name(concept))
         if v is None:
-            q = """SELECT ?s
-            WHERE {
-                ?s skos:broader ?parent .
-            }"""
-            qres = self.query(q, parent=concept)
+            qres = [(uri,) for uri in self.hierarchy().narrower(concept)]
         else:
             v = self.expand_name(v)
             q = """SELECT ?s
@@ -550,14 +2247,18 @@ PREFIX rdfs: <{NS['rdfs']}>
         Yielded content is URI, depth
         where depth is the path length from the starting URI.
         """
-        for uri in self.narrower(concept_uri):
-            yield uri, level
-            yield from self.walk_narrower(uri, level=level + 1)
+        concept_uri = self.expand_name(concept_uri)
+        yield from self.hierarchy().walk_narrower(concept_uri, level=level)
 
     def walk_broader(self, concept_uri: str, level: int = 0):
+        """
+        Yields concept_uri then the broader concepts by depth first traversal.
+        """
+        walk = self.hierarchy().walk_broader(self.expand_name(concept_uri), level=level)
+        # The hierarchy yields the expanded name first, report it as given.
+        next(walk)
         yield concept_uri, level
-        for uri in self.broader(concept_uri):
-            yield from self.walk_broader(uri, level=level + 1)
+        yield from walk
 
     def vocab_path(self, v: str) -> typing.List[str]:
         """Get the list of vocabularies progressively broader than vocabulary v.
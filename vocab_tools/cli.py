@@ -1,6 +1,7 @@
 """Script for validating and generating vocabulary artifacts.
 """
-import importlib.resources
+import dataclasses
+import io
 import json
 import logging
 import os
@@ -8,14 +9,18 @@ import sys
 import typing
 
 import click
-import pyshacl
 import rdflib
+import rich.console
 import rich.logging
+import rich.table
 
 import vocab_tools
+import vocab_tools.profiling
 import vocab_tools.tomarkdown
+import vocab_tools.uijson
+import vocab_tools.validation
 
-DEFAULT_SHAPE = "data/vocabulary_shape.ttl"
+DEFAULT_SHAPE = vocab_tools.validation.DEFAULT_SHAPE
 
 
 FORMAT = "%(message)s"
@@ -30,10 +35,59 @@ def get_shape(path:typing.Optional[str] = None) -> typing.Optional[rdflib.Graph]
         if not os.path.exists(path):
             L.error("No SHACL file at %s", path)
             return None
-    else:
-        path = str(importlib.resources.files(vocab_tools).joinpath(DEFAULT_SHAPE))
-    g = rdflib.ConjunctiveGraph()
-    return g.parse(path)
+    return vocab_tools.validation.get_shape(path)
+
+
+def get_profiler() -> typing.Optional[vocab_tools.profiling.Profiler]:
+    """Return the profiler enabled by --profile or --profile-json, if any."""
+    ctx = click.get_current_context(silent=True)
+    if ctx is None or ctx.find_root().obj is None:
+        return None
+    return ctx.find_root().obj.get("profiler")
+
+
+def load_store(
+    sources: typing.Iterable[str],
+    storage: typing.Optional[str] = None,
+    snapshot: typing.Optional[str] = None,
+) -> vocab_tools.VocabularyStore:
+    """Return a VocabularyStore with sources loaded.
+
+    storage is the path of an on-disk store to open or create, or None for
+    an in-memory store. Sources already in an on-disk store are only
+    parsed again if their content has changed.
+
+    snapshot is the path of a snapshot written by the compile command. It is
+    used instead of parsing sources if it is current for all of them, in
+    which case store.snapshot is set to its path.
+    """
+    profiler = get_profiler()
+    if snapshot is not None:
+        try:
+            header = vocab_tools.VocabularyStore.read_snapshot_header(snapshot)
+        except (OSError, ValueError) as e:
+            L.debug(e)
+            header = None
+        if header is not None and header.is_current(sources):
+            L.info("Using snapshot %s", snapshot)
+            with vocab_tools.profiling.phase(profiler, "load.snapshot"):
+                store = vocab_tools.VocabularyStore.from_snapshot(header)
+            store.profiler = profiler
+            return store
+        L.warning("Snapshot %s is missing or out of date, loading sources.", snapshot)
+    try:
+        if storage is None:
+            store = vocab_tools.VocabularyStore()
+        else:
+            store = vocab_tools.VocabularyStore(storage_uri=storage)
+    except ImportError as e:
+        L.error(e)
+        L.info("pip install berkeleydb")
+        raise click.Abort()
+    click.get_current_context().call_on_close(store.close)
+    store.profiler = profiler
+    store.load_many(sources)
+    return store
 
 
 def getDefaultVocabulary(vs:vocab_tools.VocabularyStore, abbreviate:bool=False) -> str:
@@ -45,43 +99,137 @@ def getDefaultVocabulary(vs:vocab_tools.VocabularyStore, abbreviate:bool=False)
 
 
 @click.group()
-def main():
+@click.option("--profile", is_flag=True, help="Print query and phase timings to stderr")
+@click.option("--profile-json", default=None, help="Write query and phase timings to this JSON file")
+@click.pass_context
+def main(ctx, profile, profile_json):
     logging.basicConfig(
         level="INFO", format=FORMAT, datefmt="[%X]"
     )
+    ctx.obj = {"profiler": None}
+    if profile or profile_json is not None:
+        profiler = vocab_tools.profiling.Profiler()
+        ctx.obj["profiler"] = profiler
+
+        def _report():
+            if profile:
+                profiler.print_summary()
+            if profile_json is not None:
+                profiler.write_json(profile_json)
+
+        ctx.call_on_close(_report)
 
 @main.command()
 @click.argument("source", nargs=1)
 @click.option("-v", "--vocab", default=None, help="Vocabulary to load", multiple=True)
 @click.option("-s", "--shape", default=None, help="SHACL shape file for vocabulary structure validation")
-def validate(source: str, vocab:typing.List[str], shape:typing.Optional[str]):
+@click.option(
+    "-i", "--inference", type=click.Choice(["auto", "rdfs", "none"]), default="auto",
+    help="Inference before validation, auto runs RDFS inference only if SOURCE needs it",
+)
+@click.option("-c", "--cache", "cache_dir", default=None, help="Directory for reusing results of unchanged vocabularies")
+@click.option("--fast", is_flag=True, help="Only run the built in structural checks, not SHACL")
+def validate(source: str, vocab:typing.List[str], shape:typing.Optional[str], inference:str, cache_dir:typing.Optional[str], fast:bool):
     """Validate vocabulary structure.
+
+    SOURCE is validated against the SHACL shape, then checked for undefined
+    terms, skos:broader cycles and concepts not connected to a top concept,
+    with the vocabularies given by --vocab loaded to resolve terms.
+
+    --fast skips SHACL and makes the structural checks only, which cover
+    the rules of the packaged shape.
     """
+    if shape is not None and get_shape(shape) is None:
+        return
     dataset = vocab_tools.VocabularyStore()
+    dataset.profiler = get_profiler()
     dataset.load(source)
-    shape_graph = get_shape(shape)
-    conforms, results_graph, results = pyshacl.validate(
-        dataset.graph,
-        shacl_graph = shape_graph,
-        inference='rdfs',
-        abort_on_first=False,
-        allow_warnings=True,
-        meta_shacl=False,
-        advanced=True,
-        js=False,
-        debug=False
-    )
-    L.info("SHACL conformance: %s", conforms)
-    if not conforms:
-        # Show problems
-        print(results)
-        L.error("Vocabulary not in conformance. Skipping further tests.")
-        return
+    if not fast:
+        cache = None
+        if cache_dir is not None:
+            cache = vocab_tools.validation.ValidationCache(cache_dir)
+        result = vocab_tools.validation.validate_store(
+            dataset,
+            shape=shape,
+            inference=None if inference == "none" else inference,
+            cache=cache,
+        )
+        conforms, results_graph, results = result
+        if result.cached:
+            L.info("Using cached validation result")
+        L.info("SHACL conformance: %s", conforms)
+        if not conforms:
+            # Show problems
+            print(results)
+            L.error("Vocabulary not in conformance. Skipping further tests.")
+            return
     for v in vocab:
         dataset.load(v)
-    # TODO: additional tests
-    #   - resolvable terms
-    #   - all leaves connected to a topConcept
+    with vocab_tools.profiling.phase(dataset.profiler, "validate.structure"):
+        conforms, results_graph, results = vocab_tools.validation.check_structure(
+            dataset, focus=dataset.source_graph(source)
+        )
+    L.info("Structure conformance: %s", conforms)
+    if not conforms:
+        print(results)
+        L.error("Vocabulary not in conformance.")
+
+
+@main.command("validate-batch")
+@click.argument("sources", nargs=-1, required=True)
+@click.option("-s", "--shape", default=None, help="SHACL shape file for vocabulary structure validation")
+@click.option(
+    "-i", "--inference", type=click.Choice(["auto", "rdfs", "none"]), default="auto",
+    help="Inference before validation, auto runs RDFS inference only if a source needs it",
+)
+@click.option("-c", "--cache", "cache_dir", default=None, help="Directory for reusing results of unchanged vocabularies")
+@click.option("--fast", is_flag=True, help="Only run the built in structural checks, not SHACL")
+@click.option("-j", "--jobs", default=None, type=int, help="Worker processes, by default the number of CPUs")
+@click.option("--fail-fast", is_flag=True, help="Stop after the first source that does not conform")
+@click.option("-o", "--output", default=None, help="Write the report as JSON to this file")
+@click.pass_context
+def validate_batch(ctx, sources, shape, inference, cache_dir, fast, jobs, fail_fast, output):
+    """Validate each of SOURCES as the validate command does, in parallel.
+
+    The vocabularies a source extends are loaded to resolve its terms when
+    they are defined by one of SOURCES. Exits with status 1 if any source
+    does not conform.
+    """
+    if shape is not None and get_shape(shape) is None:
+        ctx.exit(2)
+    with vocab_tools.profiling.phase(get_profiler(), "validate.batch"):
+        reports = vocab_tools.validation.validate_sources(
+            sources,
+            shape=shape,
+            inference=None if inference == "none" else inference,
+            fast=fast,
+            cache_dir=cache_dir,
+            max_workers=jobs,
+            fail_fast=fail_fast,
+        )
+    table = rich.table.Table(title="Validation")
+    table.add_column("Source")
+    table.add_column("Conforms")
+    table.add_column("Stage")
+    table.add_column("Seconds", justify="right")
+    for report in reports:
+        if not report.conforms:
+            print(f"# {report.source}")
+            print(report.text if report.error is None else report.error)
+        stage = report.stage or ""
+        if report.cached:
+            stage += " (cached)"
+        table.add_row(report.source, str(report.conforms), stage, f"{report.seconds:.3f}")
+    rich.console.Console(stderr=True).print(table)
+    skipped = len(set(sources)) - len(reports)
+    if skipped > 0:
+        L.warning("Skipped %s sources after the first failure", skipped)
+    if output is not None:
+        with open(output, "w") as dest:
+            json.dump([dataclasses.asdict(r) for r in reports], dest, indent=2)
+    if skipped > 0 or not all(r.conforms for r in reports):
+        L.error("Not all vocabularies are in conformance.")
+        ctx.exit(1)
 
 
 @main.command("uijson")
@@ -89,94 +237,183 @@ def validate(source: str, vocab:typing.List[str], shape:typing.Optional[str]):
 @click.option(
     "-e", "--extensions", is_flag=True, help="Traverse vocabulary extensions"
 )
-def uijson(sources, extensions):
+@click.option("--compact", is_flag=True, help="Write JSON without indentation or spaces")
+@click.option(
+    "-l", "--lang", "languages", multiple=True, default=vocab_tools.uijson.DEFAULT_LANGUAGES,
+    show_default=True, help="Language of the labels to include (repeatable)",
+)
+@click.option("-d", "--store", "storage", default=None, help="Path of an on-disk store to use")
+@click.option("-s", "--snapshot", default=None, help="Snapshot to use if current for SOURCES")
+def uijson(sources, extensions, compact, languages, storage, snapshot):
     """Render VOCABULARY as JSON suitable for inclusion in iSamples WebUI.
     """
-    def _narrower(s, v, c, indent=0, level=0, max=100):
-        ns = s.narrower(c, v, abbreviate=False)
-        for n in ns:
-            entry = _json_for_uri_ref(n, s)
-            if level < max:
-                for nn in _narrower(s, v, n, indent=indent + 2, level=level + 1, max=max):
-                    entry["children"].append(nn)
-            yield entry
-
-    def _json_for_uri_ref(n: rdflib.URIRef, s: rdflib.store.Store):
-        _c = s.concept(n)
-        # TODO: use provided lang instead of assuming everything is @en
-        entry = {
-            "concept": str(n),
-            "label": {
-                "en": _c.label[0] if len(_c.label) > 0 else str(s.compact_name(n))
-            },
-            "children": []
-        }
-        return entry
-
-    def _convert_to_ui_format(entry: dict) -> dict:
-        child_dict = {
-            "label": entry["label"]
-        }
-        ui_dict = {
-            entry["concept"]: child_dict
-        }
-        children = []
-        for child in entry["children"]:
-            children.append(_convert_to_ui_format(child))
-        child_dict["children"] = children
-        return ui_dict
-
-    raise NotImplementedError("Json generation needs to be updated.")
-    dataset = vocab_tools.VocabularyStore()
-    for source in sources:
-        dataset.load(source)
-    vocabularies = dataset.vocabularies()
-    base_vocabulary = dataset.base_vocabulary()
-    top_concept = dataset.top_concept()  # note this returns a list, or throws error
-    concept, vocabulary = dataset.getVocabRoot(None)
-    L.info("Using vocabulary %s", base_vocabulary)
-    L.debug("Using %s as root concept", top_concept)
-    if extensions:
-        vocabulary = None
-    result = []
-    for n in _narrower(dataset, vocabulary, concept):
-        result.append(n)
-    root_entry = _json_for_uri_ref(rdflib.URIRef(concept), dataset)
-    for child in result:
-        root_entry["children"].append(child)
-
-    # Note that due to the way the RDF queries are structured, if we construct the dictionaries in the format
-    # the UI expects while we are iterating, the RDF query blows up.  So, keep it in one format while iterating and
-    # convert when done.
-    root_entry = _convert_to_ui_format(root_entry)
-    print(json.dumps(root_entry, indent=2))
+    store = load_store(sources, storage=storage, snapshot=snapshot)
+    L.info("Using vocabulary %s", store.base_vocabulary().uri)
+    vocab_tools.uijson.write_uijson(
+        store, sys.stdout, extensions=extensions, compact=compact, languages=languages
+    )
 
 
 @main.command()
 @click.argument("sources", nargs=-1)
-def markdown(sources):
+@click.option("-d", "--store", "storage", default=None, help="Path of an on-disk store to use")
+@click.option("-s", "--snapshot", default=None, help="Snapshot to use if current for SOURCES")
+@click.option(
+    "-j", "--jobs", default=None, type=int,
+    help="Worker processes rendering the --split files, by default the number of CPUs",
+)
+@click.option("--split", "split_dir", default=None, help="Write one file per vocabulary to this folder")
+@click.option(
+    "--cache", "cache_path", default=None,
+    help="JSON file keeping the documents, reused while SOURCES are unchanged",
+)
+def markdown(sources, storage, snapshot, jobs, split_dir, cache_path):
     """Generate markdown representation of the vocabulary.
+
+    With --split, each vocabulary and extension is written to its own file,
+    rendered in parallel worker processes.
+
+    With --cache, the documents are written again from the cache without
+    loading SOURCES if none of them has changed, with only the date updated.
     """
-    store = vocab_tools.VocabularyStore()
-    for source in sources:
-        store.load(source)
+    cache = None
+    key = None
+    if cache_path is not None:
+        cache = vocab_tools.tomarkdown.RenderCache(cache_path)
+        key = vocab_tools.tomarkdown.render_key(sources, split=split_dir is not None)
+        documents = None if key is None else cache.get(key)
+        if documents is not None:
+            L.info("Using documents cached in %s", cache_path)
+            if split_dir is not None:
+                os.makedirs(split_dir, exist_ok=True)
+                for name, text in documents.items():
+                    path = os.path.join(split_dir, name)
+                    with open(path, "w", encoding="utf-8") as dest:
+                        dest.write(text)
+                    L.info("Wrote %s", path)
+            else:
+                sys.stdout.write(documents["-"])
+            cache.save()
+            return
+    store = load_store(sources, storage=storage, snapshot=snapshot)
+    if split_dir is not None:
+        paths = vocab_tools.tomarkdown.write_vocabulary_parts(store, split_dir, max_workers=jobs)
+        for path in paths:
+            L.info("Wrote %s", path)
+        if key is not None:
+            documents = {}
+            for path in paths:
+                with open(path, "r", encoding="utf-8") as src:
+                    documents[os.path.basename(path)] = src.read()
+            cache.put(key, documents)
+            cache.save()
+        return
     vocab = store.base_vocabulary()
-    # TODO: enable presentation of individual extensions
-    #   This will require the renderer to handle multiple top level concepts
-    #   with those concepts being the external concepts referenced by the extension.
-    vocab_docs = [vocab_tools.tomarkdown.describe_vocabulary(store, vocab.uri), ]
-    for document in vocab_docs:
-        for line in document:
-            print(line)
+    if key is None:
+        vocab_tools.tomarkdown.write_vocabulary(store, vocab.uri, sys.stdout)
+        return
+    dest = io.StringIO()
+    vocab_tools.tomarkdown.write_vocabulary(store, vocab.uri, dest)
+    sys.stdout.write(dest.getvalue())
+    cache.put(key, {"-": dest.getvalue()})
+    cache.save()
+
+
+@main.command("search")
+@click.argument("text")
+@click.argument("sources", nargs=-1)
+@click.option("-n", "--limit", default=10, help="Maximum number of concepts to list")
+@click.option(
+    "-m", "--mode", type=click.Choice(["auto", "exact", "casefold", "prefix", "fuzzy"]), default="auto",
+    help="Kind of match, auto tries fuzzy matching only if nothing else matches",
+)
+@click.option("--json", "as_json", is_flag=True, help="Write the hits as JSON")
+@click.option("-d", "--store", "storage", default=None, help="Path of an on-disk store to use")
+@click.option("-s", "--snapshot", default=None, help="Snapshot to use if current for SOURCES")
+def search(text, sources, limit, mode, as_json, storage, snapshot):
+    """Find concepts with labels or definitions matching TEXT.
+
+    e.g.: vocab search "imperial stout" example/data/*.ttl
+    """
+    store = load_store(sources, storage=storage, snapshot=snapshot)
+    index = store.search_index()
+    if mode == "auto":
+        hits = index.search(text, limit=limit)
+    elif mode == "fuzzy":
+        hits = index.fuzzy(text, limit=limit)
+    else:
+        hits = getattr(index, mode)(text)[:limit]
+    if as_json:
+        json.dump([dataclasses.asdict(h) for h in hits], sys.stdout, indent=2)
+        print()
+        return
+    table = rich.table.Table()
+    table.add_column("Concept")
+    table.add_column("Label")
+    table.add_column("Match")
+    table.add_column("Field")
+    table.add_column("Score", justify="right")
+    for hit in hits:
+        table.add_row(
+            store.compact_name(hit.uri), hit.label, hit.kind, hit.field, f"{hit.score:.3f}"
+        )
+    rich.console.Console().print(table)
+
+
+@main.command("compile")
+@click.argument("sources", nargs=-1)
+@click.option("-o", "--output", required=True, help="Snapshot file to write")
+def compile_snapshot(sources, output):
+    """Compile SOURCES into a binary snapshot for fast loading.
+
+    The snapshot is used by commands given --snapshot for as long as
+    the content of the sources is unchanged.
+    """
+    store = load_store(sources)
+    store.save_snapshot(output)
+    L.info("Wrote snapshot of %s triples to %s", len(store), output)
 
 
 @main.command("sparqlr")
 @click.argument("sources", nargs=-1)
 @click.option("--host", default="localhost", help="Hostname for service")
 @click.option("-p", "--port", default=9000, help="Port for service listener")
-def sparqler(sources, host, port):
+@click.option("-d", "--store", "storage", default=None, help="Path of an on-disk store to use")
+@click.option("-s", "--snapshot", default=None, help="Snapshot to use if current for SOURCES")
+@click.option(
+    "--cache-size", default=256, show_default=True, help="Query responses to cache, 0 to disable"
+)
+@click.option("-w", "--workers", default=1, show_default=True, help="Worker processes serving requests")
+@click.option(
+    "--concurrency", default=1, show_default=True, help="Processes evaluating queries for each worker"
+)
+@click.option(
+    "--queue", "max_queue", default=32, show_default=True,
+    help="Queries each worker holds waiting, more are refused with 503",
+)
+@click.option(
+    "--timeout", default=30.0, show_default=True, help="Seconds to answer a query before a 504 response"
+)
+@click.option("--watch", is_flag=True, help="Reload SOURCES when they change")
+@click.option(
+    "--watch-interval", default=2.0, show_default=True,
+    help="Seconds between checks of SOURCES for changes",
+)
+def sparqler(
+    sources, host, port, storage, snapshot, cache_size, workers, concurrency, max_queue, timeout,
+    watch, watch_interval,
+):
     """Run a SPARQL endpoint for querying loaded vocabularies.
 
+    Responses are cached until the loaded vocabularies change. Cache
+    statistics are available at /cache-stats.
+
+    With --workers above 1, each worker process loads the vocabularies
+    from --snapshot if it is current, otherwise from a temporary snapshot.
+
+    With --watch, changed SOURCES are loaded in the background into a copy
+    of the store, which then replaces the one answering requests.
+
     e.g.: vocab sparqlr tests/data/example.ttl tests/data/extension_example.ttl
     """
     try:
@@ -185,10 +422,20 @@ def sparqler(sources, host, port):
         L.error("Please pip install rdflib-endpoint and uvicorn to enable the sparqlet service.")
         L.info("pip install uvicorn git+https://github.com/vemonet/rdflib-endpoint.git@main")
         return
-    store = vocab_tools.VocabularyStore()
-    for source in sources:
-        store.load(source)
-    vocab_tools.sparqlr.run_service(store.graph, host=host, port=port)
+    store = load_store(sources, storage=storage, snapshot=snapshot)
+    vocab_tools.sparqlr.run_service(
+        store,
+        host=host,
+        port=port,
+        cache_size=cache_size,
+        workers=workers,
+        max_concurrent=concurrency,
+        max_queue=max_queue,
+        timeout=timeout,
+        snapshot=store.snapshot,
+        sources=sources,
+        watch_interval=watch_interval if watch else None,
+    )
 
 
 if __name__ == "__main__":
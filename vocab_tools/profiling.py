@@ -0,0 +1,134 @@
+"""
+Opt-in instrumentation of store queries, loading and rendering.
+
+A Profiler assigned to VocabularyStore.profiler records the parse and
+execution time and number of rows of every query, and the time spent in
+named phases of loading and rendering.
+"""
+import contextlib
+import dataclasses
+import json
+import time
+import typing
+
+import rich.console
+import rich.table
+
+
+@dataclasses.dataclass
+class QueryStats:
+    query: str
+    calls: int = 0
+    rows: int = 0
+    parse_time: float = 0.0
+    exec_time: float = 0.0
+    max_time: float = 0.0
+
+    @property
+    def total_time(self) -> float:
+        return self.parse_time + self.exec_time
+
+
+@dataclasses.dataclass
+class PhaseStats:
+    name: str
+    calls: int = 0
+    total_time: float = 0.0
+    max_time: float = 0.0
+
+
+def _query_label(q: str, width: int = 70) -> str:
+    """Single line abbreviation of a query for display."""
+    label = " ".join(q.split())
+    if len(label) > width:
+        label = label[: width - 3] + "..."
+    return label
+
+
+class Profiler:
+    """Accumulates query and phase timings."""
+
+    def __init__(self):
+        self.queries: typing.Dict[str, QueryStats] = {}
+        self.phases: typing.Dict[str, PhaseStats] = {}
+
+    def record_query(self, q: str, parse_time: float, exec_time: float, rows: int):
+        stats = self.queries.get(q)
+        if stats is None:
+            stats = QueryStats(query=q)
+            self.queries[q] = stats
+        stats.calls += 1
+        stats.rows += rows
+        stats.parse_time += parse_time
+        stats.exec_time += exec_time
+        stats.max_time = max(stats.max_time, parse_time + exec_time)
+
+    def record_phase(self, name: str, elapsed: float):
+        stats = self.phases.get(name)
+        if stats is None:
+            stats = PhaseStats(name=name)
+            self.phases[name] = stats
+        stats.calls += 1
+        stats.total_time += elapsed
+        stats.max_time = max(stats.max_time, elapsed)
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        """Context manager recording the time spent in the block as phase name."""
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_phase(name, time.perf_counter() - t0)
+
+    def to_dict(self) -> dict:
+        return {
+            "queries": [
+                dict(dataclasses.asdict(s), total_time=s.total_time)
+                for s in self.queries.values()
+            ],
+            "phases": [dataclasses.asdict(s) for s in self.phases.values()],
+        }
+
+    def write_json(self, path: str):
+        with open(path, "w") as dest:
+            json.dump(self.to_dict(), dest, indent=2)
+
+    def print_summary(self, console: typing.Optional[rich.console.Console] = None):
+        """Print tables of the phases and queries, slowest first."""
+        if console is None:
+            console = rich.console.Console(stderr=True)
+        table = rich.table.Table(title="Phases")
+        table.add_column("Phase")
+        table.add_column("Calls", justify="right")
+        table.add_column("Total s", justify="right")
+        table.add_column("Max s", justify="right")
+        for s in sorted(self.phases.values(), key=lambda s: -s.total_time):
+            table.add_row(s.name, str(s.calls), f"{s.total_time:.4f}", f"{s.max_time:.4f}")
+        console.print(table)
+        table = rich.table.Table(title="Queries")
+        table.add_column("Query")
+        table.add_column("Calls", justify="right")
+        table.add_column("Rows", justify="right")
+        table.add_column("Parse s", justify="right")
+        table.add_column("Exec s", justify="right")
+        table.add_column("Total s", justify="right")
+        table.add_column("Max s", justify="right")
+        for s in sorted(self.queries.values(), key=lambda s: -s.total_time):
+            table.add_row(
+                _query_label(s.query),
+                str(s.calls),
+                str(s.rows),
+                f"{s.parse_time:.4f}",
+                f"{s.exec_time:.4f}",
+                f"{s.total_time:.4f}",
+                f"{s.max_time:.4f}",
+            )
+        console.print(table)
+
+
+def phase(profiler: typing.Optional[Profiler], name: str):
+    """Return a context manager timing phase name, or doing nothing if profiler is None."""
+    if profiler is None:
+        return contextlib.nullcontext()
+    return profiler.phase(name)
@@ -0,0 +1,187 @@
+"""
+JSON lookup of concepts, served alongside the SPARQL endpoint.
+
+Answers come from the concept table, hierarchy and search index of the
+store, so no SPARQL is parsed or evaluated. Every response carries an
+ETag derived from the store content, and a request with a matching
+If-None-Match header is answered with 304 Not Modified.
+"""
+import typing
+
+import fastapi
+import fastapi.responses
+
+import vocab_tools
+import vocab_tools.uijson
+
+# Sent with every response so clients revalidate cached copies using the ETag
+CACHE_CONTROL = "no-cache"
+
+
+def store_etag(store: vocab_tools.VocabularyStore) -> str:
+    """Return the ETag of every response for store, from its content tag."""
+    return f'"{store.content_tag()[:32]}"'
+
+
+def etag_matches(if_none_match: typing.Optional[str], etag: str) -> bool:
+    """Return True if an If-None-Match header value matches etag, ignoring weakness."""
+    if if_none_match is None:
+        return False
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag == "*":
+            return True
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if tag == etag:
+            return True
+    return False
+
+
+def concept_summary(
+    store: vocab_tools.VocabularyStore, uri: str, lang: typing.Optional[str] = None
+) -> typing.Dict[str, str]:
+    uri = str(uri)
+    return {
+        "uri": uri,
+        "curie": str(store.compact_name(uri)),
+        "label": vocab_tools.uijson.concept_label(store, uri, lang),
+    }
+
+
+def concept_detail(
+    store: vocab_tools.VocabularyStore,
+    resolution: vocab_tools.Resolution,
+    lang: typing.Optional[str] = None,
+) -> typing.Dict[str, typing.Any]:
+    c = resolution.concept
+    res = concept_summary(store, c.uri, lang)
+    res.update({
+        "name": c.name,
+        "definition": c.definition,
+        "vocabulary": c.vocabulary,
+        "labels": {
+            tag: {"pref": labels.pref, "alt": labels.alt} for tag, labels in c.labels.items()
+        },
+        "broader": [concept_summary(store, u, lang) for u in c.broader],
+        "narrower": [concept_summary(store, u, lang) for u in c.narrower],
+        "path": list(resolution.path),
+    })
+    return res
+
+
+def concept_tree(
+    store: vocab_tools.VocabularyStore,
+    uri: str,
+    lang: typing.Optional[str] = None,
+    depth: typing.Optional[int] = None,
+) -> typing.Dict[str, typing.Any]:
+    """Return the concepts below uri as nested summaries with "children".
+
+    depth limits the number of levels below uri. A concept that is its
+    own ancestor is listed but not expanded again.
+    """
+    hierarchy = store.hierarchy()
+
+    def _node(u: str, level: int, path: typing.Set[str]):
+        node = concept_summary(store, u, lang)
+        children = []
+        if u not in path and (depth is None or level < depth):
+            path.add(u)
+            children = [_node(str(c), level + 1, path) for c in hierarchy.narrower(u)]
+            path.discard(u)
+        node["children"] = children
+        return node
+
+    return _node(str(uri), 0, set())
+
+
+def create_router(store: vocab_tools.VocabularyStore) -> fastapi.APIRouter:
+    """Return the router of the lookup endpoints for store.
+
+    Terms are a URI, a CURIE such as "eg:thing", or a label, as accepted
+    by VocabularyStore.resolve. URIs in the path should be percent encoded.
+    """
+    router = fastapi.APIRouter(tags=["lookup"])
+
+    def _respond(request: fastapi.Request, build: typing.Callable[[], typing.Any]):
+        etag = store_etag(store)
+        headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            return fastapi.Response(status_code=304, headers=headers)
+        return fastapi.responses.JSONResponse(build(), headers=headers)
+
+    def _resolve(term: str) -> vocab_tools.Resolution:
+        resolution = store.resolve(term)
+        if resolution.concept is None:
+            raise fastapi.HTTPException(status_code=404, detail=f"No concept matches {term}")
+        return resolution
+
+    @router.get("/concept/{term:path}")
+    def get_concept(request: fastapi.Request, term: str, lang: typing.Optional[str] = None):
+        """Return a concept with its labels, definition, broader and narrower concepts."""
+        resolution = _resolve(term)
+        return _respond(request, lambda: concept_detail(store, resolution, lang))
+
+    @router.get("/children/{term:path}")
+    def get_children(request: fastapi.Request, term: str, lang: typing.Optional[str] = None):
+        """Return the concepts immediately narrower than a concept."""
+        uri = _resolve(term).uri
+        return _respond(request, lambda: [
+            concept_summary(store, u, lang) for u in store.hierarchy().narrower(uri)
+        ])
+
+    @router.get("/ancestors/{term:path}")
+    def get_ancestors(request: fastapi.Request, term: str, lang: typing.Optional[str] = None):
+        """Return the concepts broader than a concept, nearest first, with their distance."""
+
+        def _build():
+            distances = {}
+            for u, level in store.hierarchy().walk_broader(uri):
+                u = str(u)
+                if u != uri and (u not in distances or level < distances[u]):
+                    distances[u] = level
+            res = []
+            for u, distance in sorted(distances.items(), key=lambda item: item[1]):
+                summary = concept_summary(store, u, lang)
+                summary["distance"] = distance
+                res.append(summary)
+            return res
+
+        uri = _resolve(term).uri
+        return _respond(request, _build)
+
+    @router.get("/tree/{term:path}")
+    def get_tree(
+        request: fastapi.Request,
+        term: str,
+        lang: typing.Optional[str] = None,
+        depth: typing.Optional[int] = fastapi.Query(None, ge=0),
+    ):
+        """Return the concepts below a concept as a nested tree."""
+        uri = _resolve(term).uri
+        return _respond(request, lambda: concept_tree(store, uri, lang=lang, depth=depth))
+
+    @router.get("/search")
+    def get_search(
+        request: fastapi.Request,
+        q: str,
+        limit: int = fastapi.Query(10, ge=1),
+        fuzzy: bool = True,
+        lang: typing.Optional[str] = None,
+    ):
+        """Return concepts with labels or definitions matching q, best first."""
+
+        def _build():
+            res = []
+            for hit in store.search(q, limit=limit, fuzzy=fuzzy):
+                summary = concept_summary(store, hit.uri, lang)
+                summary.update({
+                    "field": hit.field, "text": hit.text, "kind": hit.kind, "score": hit.score,
+                })
+                res.append(summary)
+            return res
+
+        return _respond(request, _build)
+
+    return router
@@ -0,0 +1,266 @@
+"""
+Text search over the labels and definitions of concepts.
+
+A SearchIndex is built once from the concept table of a store. It holds
+tables of the exact and case folded text of each skos:prefLabel,
+skos:altLabel and skos:definition, a sorted list of the folded text for
+prefix lookups, and an inverted index of word tokens for ranked fuzzy
+matching. Tokens close to a misspelt query token are found through an
+index of the character n-grams of the indexed tokens.
+"""
+import bisect
+import collections
+import dataclasses
+import difflib
+import heapq
+import math
+import re
+import typing
+
+import vocab_tools
+
+# Relative weight of a match in each field
+FIELD_WEIGHTS = {
+    "prefLabel": 3.0,
+    "altLabel": 2.0,
+    "definition": 1.0,
+}
+
+# Order in which hits of each kind are ranked by SearchIndex.search
+MATCH_KINDS = ("exact", "casefold", "prefix", "fuzzy")
+
+# Minimum difflib similarity of a query token and an indexed token
+FUZZY_CUTOFF = 0.75
+
+# Most indexed tokens matched by one query token for being close to it
+FUZZY_MATCHES = 5
+
+# Most indexed tokens compared with a query token, those sharing the most n-grams
+FUZZY_CANDIDATES = 20
+
+# Length of the character n-grams of tokens, which are padded at both ends
+NGRAM = 2
+
+# Query tokens of at least this length also match longer tokens they start
+MIN_PREFIX_TOKEN = 3
+
+_TOKEN = re.compile(r"\w+")
+
+
+def fold(text: str) -> str:
+    """Return text case folded with runs of whitespace collapsed."""
+    return " ".join(text.casefold().split())
+
+
+def tokenize(text: str) -> typing.List[str]:
+    return _TOKEN.findall(text.casefold())
+
+
+def ngrams(token: str) -> typing.Set[str]:
+    """Return the character n-grams of token, padded with ^ and $."""
+    padded = f"^{token}$"
+    return {padded[i:i + NGRAM] for i in range(len(padded) - NGRAM + 1)}
+
+
+@dataclasses.dataclass
+class SearchHit:
+    """A concept matching a search.
+
+    field is the field that matched, text its value, kind one of
+    MATCH_KINDS, and score the rank of the hit among hits of the same kind.
+    """
+    uri: str
+    label: str
+    field: str
+    text: str
+    kind: str
+    score: float
+
+
+class SearchIndex:
+    """Exact, case folded, prefix and fuzzy lookup of concepts by text."""
+
+    def __init__(self, concepts: typing.Iterable[vocab_tools.VocabularyConcept] = ()):
+        self._labels: typing.Dict[str, str] = {}
+        # text -> [(uri, field, text)]
+        self._exact: typing.Dict[str, typing.List[typing.Tuple[str, str, str]]] = {}
+        self._folded: typing.Dict[str, typing.List[typing.Tuple[str, str, str]]] = {}
+        self._sorted_folded: typing.Optional[typing.List[str]] = None
+        # token -> {uri: (weight, field, text)}
+        self._postings: typing.Dict[str, typing.Dict[str, typing.Tuple[float, str, str]]] = {}
+        self._sorted_tokens: typing.Optional[typing.List[str]] = None
+        # n-gram -> [token]
+        self._grams: typing.Optional[typing.Dict[str, typing.List[str]]] = None
+        for concept in concepts:
+            self.add(concept)
+
+    def add(self, concept: vocab_tools.VocabularyConcept):
+        """Index the labels, in every language, and definition of concept."""
+        uri = str(concept.uri)
+        self._labels[uri] = concept.get_label()
+        fields = []
+        for labels in concept.labels.values():
+            if labels.pref is not None:
+                fields.append(("prefLabel", labels.pref))
+            fields.extend(("altLabel", alt) for alt in labels.alt)
+        if len(concept.labels) == 0:
+            fields.extend(("prefLabel", label) for label in concept.label)
+        if len(concept.definition) > 0:
+            fields.append(("definition", concept.definition))
+        for field, text in fields:
+            entry = (uri, field, text)
+            self._exact.setdefault(text, []).append(entry)
+            self._folded.setdefault(fold(text), []).append(entry)
+            weight = FIELD_WEIGHTS[field]
+            for token in set(tokenize(text)):
+                postings = self._postings.setdefault(token, {})
+                if uri not in postings or postings[uri][0] < weight:
+                    postings[uri] = (weight, field, text)
+        self._sorted_folded = None
+        self._sorted_tokens = None
+        self._grams = None
+
+    def __len__(self) -> int:
+        return len(self._labels)
+
+    def _hits(self, entries, kind: str) -> typing.List[SearchHit]:
+        return [
+            SearchHit(
+                uri=uri, label=self._labels[uri], field=field, text=text,
+                kind=kind, score=FIELD_WEIGHTS[field],
+            )
+            for uri, field, text in entries
+        ]
+
+    def exact(self, text: str) -> typing.List[SearchHit]:
+        """Return hits whose field value is exactly text."""
+        return self._hits(self._exact.get(text, []), "exact")
+
+    def casefold(self, text: str) -> typing.List[SearchHit]:
+        """Return hits whose field value equals text ignoring case and spacing."""
+        return self._hits(self._folded.get(fold(text), []), "casefold")
+
+    def prefix(self, text: str) -> typing.List[SearchHit]:
+        """Return hits whose field value starts with text, ignoring case and spacing."""
+        if self._sorted_folded is None:
+            self._sorted_folded = sorted(self._folded)
+        key = fold(text)
+        res = []
+        i = bisect.bisect_left(self._sorted_folded, key)
+        while i < len(self._sorted_folded) and self._sorted_folded[i].startswith(key):
+            res += self._hits(self._folded[self._sorted_folded[i]], "prefix")
+            i += 1
+        return res
+
+    def _similar_tokens(self, token: str) -> typing.Dict[str, float]:
+        """Return indexed tokens matching a query token, with their similarity."""
+        if self._sorted_tokens is None:
+            self._sorted_tokens = sorted(self._postings)
+        res = {}
+        if token in self._postings:
+            res[token] = 1.0
+        if len(token) >= MIN_PREFIX_TOKEN:
+            i = bisect.bisect_right(self._sorted_tokens, token)
+            while i < len(self._sorted_tokens) and self._sorted_tokens[i].startswith(token):
+                res.setdefault(self._sorted_tokens[i], 0.9)
+                i += 1
+        for close, similarity in self._close_tokens(token):
+            res.setdefault(close, similarity)
+        return res
+
+    def _close_tokens(self, token: str) -> typing.List[typing.Tuple[str, float]]:
+        """Return up to FUZZY_MATCHES indexed tokens with a difflib similarity
+        to token of at least FUZZY_CUTOFF, most similar first.
+
+        Only the FUZZY_CANDIDATES tokens sharing the largest proportion of
+        n-grams with token are compared.
+        """
+        if self._grams is None:
+            self._grams = {}
+            for indexed in self._postings:
+                for gram in ngrams(indexed):
+                    self._grams.setdefault(gram, []).append(indexed)
+        grams = ngrams(token)
+        shared = collections.Counter()
+        for gram in grams:
+            shared.update(self._grams.get(gram, ()))
+        candidates = heapq.nlargest(
+            FUZZY_CANDIDATES,
+            shared,
+            key=lambda c: (2 * shared[c] / (len(grams) + len(ngrams(c))), c),
+        )
+        matcher = difflib.SequenceMatcher()
+        matcher.set_seq2(token)
+        res = []
+        for candidate in candidates:
+            matcher.set_seq1(candidate)
+            if matcher.real_quick_ratio() >= FUZZY_CUTOFF and matcher.quick_ratio() >= FUZZY_CUTOFF:
+                similarity = matcher.ratio()
+                if similarity >= FUZZY_CUTOFF:
+                    res.append((candidate, similarity))
+        res.sort(key=lambda item: (-item[1], item[0]))
+        return res[:FUZZY_MATCHES]
+
+    def fuzzy(self, text: str, limit: typing.Optional[int] = 10) -> typing.List[SearchHit]:
+        """Return hits ranked by how well their words match those of text.
+
+        Each word of text adds the weight of the best matching field times
+        the inverse document frequency of the matched word, scaled by the
+        similarity of the words. Scores are divided by the score of a
+        perfect prefLabel match, so are between 0 and 1.
+        """
+        n = max(len(self._labels), 1)
+        scores: typing.Dict[str, float] = {}
+        best: typing.Dict[str, typing.Tuple[float, str, str]] = {}
+        query_tokens = list(dict.fromkeys(tokenize(text)))
+        for q in query_tokens:
+            contribution: typing.Dict[str, float] = {}
+            for token, similarity in self._similar_tokens(q).items():
+                postings = self._postings[token]
+                idf = math.log(1 + n / len(postings))
+                for uri, (weight, field, value) in postings.items():
+                    s = similarity * idf * weight
+                    if s > contribution.get(uri, 0.0):
+                        contribution[uri] = s
+                        if uri not in best or best[uri][0] < weight:
+                            best[uri] = (weight, field, value)
+            for uri, s in contribution.items():
+                scores[uri] = scores.get(uri, 0.0) + s
+        if len(scores) == 0:
+            return []
+        top = FIELD_WEIGHTS["prefLabel"] * math.log(1 + n) * len(query_tokens)
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], self._labels[item[0]]))
+        if limit is not None:
+            ranked = ranked[:limit]
+        return [
+            SearchHit(
+                uri=uri, label=self._labels[uri], field=best[uri][1], text=best[uri][2],
+                kind="fuzzy", score=score / top,
+            )
+            for uri, score in ranked
+        ]
+
+    def search(
+        self, text: str, limit: typing.Optional[int] = 10, fuzzy: bool = True
+    ) -> typing.List[SearchHit]:
+        """Return one hit per concept matching text, best first.
+
+        Exact matches rank first, then case folded, then prefix matches.
+        Only if there are none of these, and fuzzy is True, are fuzzy
+        matches returned. Within each kind, label matches rank before
+        definitions.
+        """
+        res = []
+        seen = set()
+        for lookup in (self.exact, self.casefold, self.prefix):
+            hits = sorted(lookup(text), key=lambda h: (-h.score, h.label))
+            for hit in hits:
+                if hit.uri in seen:
+                    continue
+                seen.add(hit.uri)
+                res.append(hit)
+                if limit is not None and len(res) >= limit:
+                    return res
+        if fuzzy and len(res) == 0:
+            res = self.fuzzy(text, limit=limit)
+        return res
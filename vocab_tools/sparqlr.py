@@ -1,7 +1,56 @@
+"""
+Serve the vocabularies of a store as a SPARQL endpoint.
+
+Responses are cached in front of rdflib_endpoint, keyed by the normalized
+query text and the Accept header, until the store changes. Other queries
+are evaluated in worker processes, which are killed when a query takes
+too long. The answers to example_queries are computed when the service
+starts. The store can be replaced while the service runs when its sources
+change.
+"""
+import asyncio
+import collections
+import concurrent.futures
+import dataclasses
+import json
+import logging
+import multiprocessing
+import os
+import re
+import tempfile
+import threading
+import typing
+import urllib.parse
+
 import fastapi
+import fastapi.middleware.cors
 import rdflib_endpoint
+import rdflib_endpoint.utils
 import uvicorn
 
+import vocab_tools
+import vocab_tools.restapi
+
+L = logging.getLogger("sparqlr")
+
+# Maximum number of responses kept by ResultCache
+RESULT_CACHE_SIZE = 256
+
+# Maximum total size in bytes of the response bodies kept by ResultCache
+RESULT_CACHE_BYTES = 64 * 1024 * 1024
+
+# Path serving the ResultCache statistics as JSON
+CACHE_STATS_PATH = "/cache-stats"
+
+# Accept header of the precomputed answers to example_queries, as sent by the WebUI
+DEFAULT_ACCEPT = "application/sparql-results+json"
+
+# Environment variable passing the ServiceConfig to worker processes
+CONFIG_ENV = "VOCAB_SPARQLR_CONFIG"
+
+# Seconds between checks of the sources for changes
+WATCH_INTERVAL = 2.0
+
 # list named graphs
 example_query = """PREFIX rdf: <http://www.w3.org/1999/02/22-rdf-syntax-ns#>
 PREFIX xsd: <http://www.w3.org/2001/XMLSchema#>
@@ -50,13 +99,852 @@ WHERE {
     }
 }
 
-def run_service(g, port:int=9000, host:str="localhost") -> None:
-    app = rdflib_endpoint.SparqlEndpoint(
-        graph=g,
+# Strings and IRIs, which are matched first so their content is left
+# alone, or runs of whitespace and comments
+_QUERY_TOKENS = re.compile(
+    r'("""[\s\S]*?"""|\'\'\'[\s\S]*?\'\'\'|"(?:[^"\\\n]|\\.)*"|\'(?:[^\'\\\n]|\\.)*\''
+    r'|<[^<>"{}|^`\\\s]*>)|(?:\s|#[^\n]*)+'
+)
+
+
+def normalize_query(query: str) -> str:
+    """Return query with comments removed and runs of whitespace collapsed.
+
+    Whitespace inside string literals and IRIs is kept.
+    """
+
+    def _token(match):
+        if match.group(1) is not None:
+            return match.group(1)
+        return " "
+
+    return _QUERY_TOKENS.sub(_token, query).strip()
+
+
+def accept_hint(accept: typing.Optional[str]) -> str:
+    """Return the media types of an Accept header in order of preference."""
+    if accept is None or accept.strip() == "":
+        return ""
+    return ",".join(
+        m.lower() for m in rdflib_endpoint.utils.parse_accept_header(accept) if m != ""
+    )
+
+
+@dataclasses.dataclass
+class CachedResponse:
+    status: int
+    headers: typing.List[typing.Tuple[bytes, bytes]]
+    body: bytes
+
+
+class ResultCache:
+    """Responses to SPARQL queries in least recently used order.
+
+    Holds at most max_entries responses with bodies totalling at most
+    max_bytes. Counts hits, misses, evictions and invalidations.
+    """
+
+    def __init__(self, max_entries: int = RESULT_CACHE_SIZE, max_bytes: int = RESULT_CACHE_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: typing.OrderedDict[typing.Tuple[str, str], CachedResponse] = (
+            collections.OrderedDict()
+        )
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def key(query: str, accept: typing.Optional[str] = None) -> typing.Tuple[str, str]:
+        return normalize_query(query), accept_hint(accept)
+
+    def get(self, key: typing.Tuple[str, str]) -> typing.Optional[CachedResponse]:
+        response = self._entries.get(key)
+        if response is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return response
+
+    def put(self, key: typing.Tuple[str, str], response: CachedResponse):
+        """Add response, evicting the least recently used entries to make room.
+
+        Responses larger than max_bytes are not kept.
+        """
+        if len(response.body) > self.max_bytes or self.max_entries < 1:
+            return
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self.size -= len(previous.body)
+        self._entries[key] = response
+        self.size += len(response.body)
+        while len(self._entries) > self.max_entries or self.size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.size -= len(evicted.body)
+            self.evictions += 1
+
+    def clear(self):
+        if len(self._entries) > 0:
+            self.invalidations += 1
+        self._entries.clear()
+        self.size = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> typing.Dict[str, typing.Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self.size,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups > 0 else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+
+def _replay(body: bytes, receive):
+    """Return a receive callable giving body, then deferring to receive."""
+    pending = [{"type": "http.request", "body": body, "more_body": False}]
+
+    async def _receive():
+        if len(pending) > 0:
+            return pending.pop()
+        if receive is None:
+            return {"type": "http.disconnect"}
+        return await receive()
+
+    return _receive
+
+
+async def _read_body(receive) -> bytes:
+    body = b""
+    more_body = True
+    while more_body:
+        message = await receive()
+        body += message.get("body", b"")
+        more_body = message.get("more_body", False)
+    return body
+
+
+async def _collect(app, scope, receive) -> CachedResponse:
+    """Return the response of ASGI app to a request."""
+    response = CachedResponse(status=500, headers=[], body=b"")
+    chunks = []
+
+    async def _send(message):
+        if message["type"] == "http.response.start":
+            response.status = message["status"]
+            response.headers = list(message.get("headers", []))
+        elif message["type"] == "http.response.body":
+            chunks.append(message.get("body", b""))
+
+    await app(scope, receive, _send)
+    response.body = b"".join(chunks)
+    return response
+
+
+async def _send_response(send, response: CachedResponse, headers=()):
+    await send({
+        "type": "http.response.start",
+        "status": response.status,
+        "headers": response.headers + list(headers),
+    })
+    await send({"type": "http.response.body", "body": response.body})
+
+
+def _json_response(status: int, content: dict, headers=()) -> CachedResponse:
+    body = json.dumps(content).encode()
+    return CachedResponse(
+        status=status,
+        headers=[
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+        ] + list(headers),
+        body=body,
+    )
+
+
+def _request_query(scope: dict, body: bytes) -> typing.Optional[str]:
+    """Return the SPARQL query of a request, None for updates and other requests.
+
+    Follows the SPARQL protocol handling of rdflib_endpoint.
+    """
+    headers = dict(scope.get("headers", []))
+    params = urllib.parse.parse_qs(scope.get("query_string", b"").decode("latin-1"))
+    if scope["method"] == "GET":
+        values = params.get("query", [])
+    else:
+        content_type = headers.get(b"content-type", b"").decode("latin-1")
+        if "application/sparql-query" in content_type:
+            values = [body.decode("utf-8")]
+        elif "application/x-www-form-urlencoded" in content_type:
+            form = urllib.parse.parse_qs(body.decode("utf-8"))
+            if "update" in form:
+                return None
+            values = form.get("query", [])
+        elif len(body) == 0:
+            values = params.get("query", [])
+        else:
+            return None
+    if "update" in params or len(values) == 0 or values[0].strip() == "":
+        return None
+    return values[0]
+
+
+class QueryCacheMiddleware:
+    """ASGI middleware answering repeated SPARQL queries from a ResultCache.
+
+    Only successful responses to queries sent to path are cached. The
+    cache is emptied when the generation of store changes, and the
+    answers to warm_queries are then computed again before the next
+    request is answered. Cache statistics are served at CACHE_STATS_PATH
+    and each response has an X-Cache header of HIT or MISS.
+    """
+
+    def __init__(
+        self,
+        app,
+        store: vocab_tools.VocabularyStore,
+        cache: typing.Optional[ResultCache] = None,
+        path: str = "/",
+        warm_queries: typing.Iterable[str] = (),
+        warm_accept: str = DEFAULT_ACCEPT,
+    ):
+        self.app = app
+        self.store = store
+        self.cache = ResultCache() if cache is None else cache
+        self.paths = {path, path.rstrip("/") or "/"}
+        self.warm_queries = list(warm_queries)
+        self.warm_accept = warm_accept
+        self._generation = None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self.app(scope, receive, self._on_startup(scope, send))
+            return
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        if scope["path"] == CACHE_STATS_PATH and scope["method"] == "GET":
+            await self._send_stats(send)
+            return
+        if scope["path"] not in self.paths or scope["method"] not in ("GET", "POST"):
+            await self.app(scope, receive, send)
+            return
+        body = b""
+        if scope["method"] == "POST":
+            body = await _read_body(receive)
+        query = _request_query(scope, body)
+        if query is None:
+            await self.app(scope, _replay(body, receive), send)
+            return
+        await self._refresh(scope)
+        headers = dict(scope.get("headers", []))
+        accept = headers.get(b"accept")
+        key = self.cache.key(query, None if accept is None else accept.decode("latin-1"))
+        response = self.cache.get(key)
+        status = b"HIT"
+        if response is None:
+            status = b"MISS"
+            generation = self.store.generation
+            response = await _collect(self.app, scope, _replay(body, receive))
+            if response.status == 200 and generation == self.store.generation:
+                self.cache.put(key, response)
+        await _send_response(send, response, [(b"x-cache", status)])
+
+    def _on_startup(self, scope, send):
+        async def _send(message):
+            if message["type"] == "lifespan.startup.complete":
+                await self._refresh(scope)
+            await send(message)
+
+        return _send
+
+    async def _refresh(self, scope):
+        """Empty the cache and precompute warm_queries if the store has changed."""
+        if self._generation == self.store.generation:
+            return
+        self._generation = self.store.generation
+        self.cache.clear()
+        path = min(self.paths, key=len)
+        for query in self.warm_queries:
+            request = {
+                "type": "http",
+                "asgi": scope.get("asgi", {"version": "3.0"}),
+                "http_version": "1.1",
+                "method": "GET",
+                "scheme": "http",
+                "path": path,
+                "raw_path": path.encode(),
+                "root_path": scope.get("root_path", ""),
+                "query_string": urllib.parse.urlencode({"query": query}).encode(),
+                "headers": [(b"accept", self.warm_accept.encode())],
+                "client": None,
+                "server": None,
+            }
+            if "app" in scope:
+                request["app"] = scope["app"]
+            response = await _collect(self.app, request, _replay(b"", None))
+            if response.status == 200:
+                self.cache.put(self.cache.key(query, self.warm_accept), response)
+            else:
+                L.warning("Precomputing query failed with status %s", response.status)
+        L.info("Query cache refreshed for store generation %s", self._generation)
+
+    async def _send_stats(self, send):
+        stats = self.cache.stats()
+        stats["generation"] = self.store.generation
+        await _send_response(send, _json_response(200, stats))
+
+
+def _endpoint(store: vocab_tools.VocabularyStore) -> fastapi.FastAPI:
+    return rdflib_endpoint.SparqlEndpoint(
+        graph=store.graph,
         path="/",
         title="Vocabulary SPARQL",
-        cors_enabled=True,
+        # Added by create_app, outside the cache
+        cors_enabled=False,
         example_query=example_query,
         example_queries=example_queries
     )
-    uvicorn.run(app, host=host, port=port)
+
+
+# Keys of the ASGI scope sent to query worker processes
+_SCOPE_KEYS = (
+    "type", "asgi", "http_version", "method", "scheme", "path", "raw_path",
+    "root_path", "query_string", "headers", "client", "server",
+)
+
+
+def _query_worker(snapshot: str, conn) -> None:
+    """Answer the requests received on conn from the store saved in snapshot.
+
+    Sends None once the store is loaded, then (status, headers, body) for
+    each (scope, body) request received, until conn is closed.
+    """
+    store = vocab_tools.VocabularyStore.from_snapshot(snapshot)
+    app = _endpoint(store)
+    loop = asyncio.new_event_loop()
+    conn.send(None)
+    try:
+        while True:
+            try:
+                scope, body = conn.recv()
+            except EOFError:
+                break
+            response = loop.run_until_complete(_collect(app, scope, _replay(body, None)))
+            conn.send((response.status, response.headers, response.body))
+    finally:
+        loop.close()
+
+
+class _QueryWorker:
+    """A process answering SPARQL queries, started by QueryPool."""
+
+    def __init__(self, context, snapshot: str):
+        self.conn, child = context.Pipe()
+        self.process = context.Process(
+            target=_query_worker, args=(snapshot, child), name="sparqlr-query", daemon=True
+        )
+        self.process.start()
+        child.close()
+        # Raises EOFError if the process fails to load the store
+        self.conn.recv()
+
+    def answer(self, scope: dict, body: bytes, timeout: typing.Optional[float]) -> typing.Optional[CachedResponse]:
+        """Return the response to a request, None if not answered within timeout."""
+        self.conn.send((scope, body))
+        if not self.conn.poll(timeout):
+            return None
+        status, headers, body = self.conn.recv()
+        return CachedResponse(status=status, headers=headers, body=body)
+
+    def stop(self):
+        self.conn.close()
+        self.process.join(1.0)
+        if self.process.is_alive():
+            self.kill()
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+
+class _WorkerSet:
+    """The worker processes of a QueryPool answering from one snapshot."""
+
+    def __init__(self, pool: "QueryPool", snapshot: str, temporary: bool):
+        self.pool = pool
+        self.snapshot = snapshot
+        self.temporary = temporary
+        self.loop = asyncio.get_running_loop()
+        self.idle: asyncio.Queue = asyncio.Queue()
+        self.waiting = 0
+        self.busy = 0
+        self.starting = 0
+        self.closed = False
+        for _ in range(pool.max_concurrent):
+            self._spawn()
+
+    def _spawn(self):
+        if not self.closed:
+            self.starting += 1
+            self.pool._executor.submit(self._start)
+
+    def _start(self):
+        """Start a worker process, run in an executor thread."""
+        worker = None
+        try:
+            worker = _QueryWorker(self.pool._context, self.snapshot)
+        except Exception:
+            if not self.closed:
+                L.exception("Starting a query worker failed")
+        try:
+            self.loop.call_soon_threadsafe(self._started, worker)
+        except RuntimeError:
+            # The event loop has been closed
+            if worker is not None:
+                worker.stop()
+
+    def _started(self, worker: typing.Optional[_QueryWorker]):
+        self.starting -= 1
+        if worker is not None:
+            self._release(worker)
+        self._retire()
+
+    def _release(self, worker: _QueryWorker):
+        if self.closed and self.waiting == 0:
+            worker.stop()
+        else:
+            self.idle.put_nowait(worker)
+
+    def _answer(self, worker: _QueryWorker, scope: dict, body: bytes, timeout: typing.Optional[float]):
+        """Answer a request with worker, run in an executor thread.
+
+        The worker is made available again, or killed and replaced if it
+        did not answer within timeout, so a query is never left running.
+        """
+        try:
+            response = worker.answer(scope, body, timeout)
+        except (EOFError, OSError):
+            L.exception("Query worker %s failed", worker.process.pid)
+            response = _json_response(500, {"message": "The query worker failed."})
+            worker.kill()
+        else:
+            if response is not None:
+                self.loop.call_soon_threadsafe(self._release, worker)
+                return response
+            worker.kill()
+        self.loop.call_soon_threadsafe(self._spawn)
+        return response
+
+    async def answer(self, scope: dict, body: bytes) -> CachedResponse:
+        pool = self.pool
+        # Workers being started are waited for like busy ones
+        if self.busy + self.waiting >= pool.max_concurrent + pool.max_queue:
+            pool.refused += 1
+            return _json_response(
+                503, {"message": "Too many queued requests, try again later."}, [(b"retry-after", b"1")]
+            )
+        deadline = None if pool.timeout is None else self.loop.time() + pool.timeout
+        self.waiting += 1
+        try:
+            worker = await asyncio.wait_for(self.idle.get(), pool.timeout)
+        except asyncio.TimeoutError:
+            pool.timed_out += 1
+            return _json_response(504, {"message": "Timed out waiting to run the query."})
+        finally:
+            self.waiting -= 1
+        remaining = None if deadline is None else max(deadline - self.loop.time(), 0.0)
+        request = {k: scope[k] for k in _SCOPE_KEYS if k in scope}
+        self.busy += 1
+        try:
+            response = await self.loop.run_in_executor(
+                pool._executor, self._answer, worker, request, body, remaining
+            )
+        finally:
+            self.busy -= 1
+            self._retire()
+        if response is None:
+            pool.timed_out += 1
+            L.warning("Query timed out after %s seconds", pool.timeout)
+            response = _json_response(504, {"message": f"Query timed out after {pool.timeout} seconds."})
+        return response
+
+    def close(self):
+        """Stop the worker processes once the requests waiting for them are answered."""
+        self.closed = True
+        self._retire()
+
+    def _retire(self):
+        if not self.closed or self.waiting > 0:
+            return
+        while not self.idle.empty():
+            self.idle.get_nowait().stop()
+        if self.busy == 0 and self.starting == 0 and self.temporary and os.path.exists(self.snapshot):
+            os.remove(self.snapshot)
+
+
+class QueryPool:
+    """Worker processes answering SPARQL queries for an ASGI server.
+
+    Queries are evaluated by max_concurrent worker processes, each
+    holding the store loaded from a snapshot, so the event loop of the
+    server keeps accepting requests while queries run. Up to max_queue
+    further queries wait for a free worker, others are refused with 503
+    and a Retry-After header. A query not answered within timeout seconds
+    of arriving gets a 504 response, and a worker still evaluating it is
+    killed and replaced.
+
+    The workers are started on the first query. When a query is asked of
+    another store, or after the store has changed, a snapshot of it is
+    written and new workers are started, and the old workers stop once
+    their queries are answered. snapshot may name a current snapshot of
+    the first store, which is then used instead of writing one.
+    """
+
+    def __init__(
+        self,
+        max_concurrent: int = 1,
+        max_queue: int = 32,
+        timeout: typing.Optional[float] = 30.0,
+        snapshot: typing.Optional[str] = None,
+    ):
+        self.max_concurrent = max(max_concurrent, 1)
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.snapshot = snapshot
+        self.refused = 0
+        self.timed_out = 0
+        self._context = multiprocessing.get_context("spawn")
+        # Threads waiting on the workers, or starting them
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=2 * self.max_concurrent, thread_name_prefix="sparqlr-query"
+        )
+        self._workers: typing.Optional[_WorkerSet] = None
+        self._key = None
+        self._lock = None
+
+    async def answer(self, store: vocab_tools.VocabularyStore, scope: dict, body: bytes) -> CachedResponse:
+        """Return the response of the SPARQL endpoint of store to a request."""
+        return await (await self._workers_for(store)).answer(scope, body)
+
+    async def _workers_for(self, store: vocab_tools.VocabularyStore) -> _WorkerSet:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            key = (id(store), store.generation)
+            if self._workers is not None and self._key == key:
+                return self._workers
+            snapshot, temporary = self.snapshot, False
+            if snapshot is None or store.snapshot != snapshot or self._workers is not None:
+                fd, snapshot = tempfile.mkstemp(suffix=".snapshot")
+                os.close(fd)
+                temporary = True
+                await asyncio.get_running_loop().run_in_executor(None, store.save_snapshot, snapshot)
+            self.close()
+            self._workers = _WorkerSet(self, snapshot, temporary)
+            self._key = key
+            return self._workers
+
+    def close(self):
+        """Stop the workers once the requests waiting for them are answered."""
+        if self._workers is not None:
+            self._workers.close()
+            self._workers = None
+            self._key = None
+
+
+class QueryPoolMiddleware:
+    """ASGI middleware answering SPARQL queries sent to path with a QueryPool.
+
+    Other requests, e.g. for the query form, updates and the lookup API,
+    are passed to app. The pool is closed when the server shuts down.
+    """
+
+    def __init__(self, app, store: vocab_tools.VocabularyStore, pool: QueryPool, path: str = "/"):
+        self.app = app
+        self.store = store
+        self.pool = pool
+        self.paths = {path, path.rstrip("/") or "/"}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self.app(scope, self._on_shutdown(receive), send)
+            return
+        if scope["type"] != "http" or scope["path"] not in self.paths or scope["method"] not in ("GET", "POST"):
+            await self.app(scope, receive, send)
+            return
+        body = b""
+        if scope["method"] == "POST":
+            body = await _read_body(receive)
+        if _request_query(scope, body) is None:
+            await self.app(scope, _replay(body, receive), send)
+            return
+        await _send_response(send, await self.pool.answer(self.store, scope, body))
+
+    def _on_shutdown(self, receive):
+        async def _receive():
+            message = await receive()
+            if message["type"] == "lifespan.shutdown":
+                self.pool.close()
+            return message
+
+        return _receive
+
+
+@dataclasses.dataclass
+class ServiceConfig:
+    """Settings of the SPARQL service, passed to each worker process.
+
+    snapshot is the path of the snapshot each worker loads the store from.
+    max_concurrent, max_queue and timeout configure the QueryPool of each
+    worker.
+    If watch_interval is set, the store is reloaded when any of sources
+    changes, as checked every watch_interval seconds.
+    """
+    snapshot: typing.Optional[str] = None
+    cache_size: int = RESULT_CACHE_SIZE
+    max_concurrent: int = 1
+    max_queue: int = 32
+    timeout: typing.Optional[float] = 30.0
+    sources: typing.List[str] = dataclasses.field(default_factory=list)
+    watch_interval: typing.Optional[float] = None
+
+
+def create_app(
+    store: vocab_tools.VocabularyStore,
+    cache: typing.Optional[ResultCache] = None,
+    config: typing.Optional[ServiceConfig] = None,
+    pool: typing.Optional[QueryPool] = None,
+) -> fastapi.FastAPI:
+    """Return the SPARQL endpoint application for store.
+
+    The cache is placed inside the CORS handling of the endpoint, so
+    cached responses get the same CORS headers as any other. Queries not
+    answered from the cache are evaluated by pool, or by a QueryPool
+    configured by config. The JSON lookup endpoints of
+    vocab_tools.restapi are served alongside.
+    """
+    if config is None:
+        config = ServiceConfig()
+    if cache is None:
+        cache = ResultCache(max_entries=config.cache_size)
+    if pool is None:
+        pool = QueryPool(
+            max_concurrent=config.max_concurrent,
+            max_queue=config.max_queue,
+            timeout=config.timeout,
+            snapshot=config.snapshot,
+        )
+    app = _endpoint(store)
+    app.include_router(vocab_tools.restapi.create_router(store))
+    # Middleware added last runs first. Queries go to the pool only once
+    # they are not answered from the cache, and CORS headers are added to all
+    app.add_middleware(QueryPoolMiddleware, store=store, pool=pool, path="/")
+    app.add_middleware(
+        QueryCacheMiddleware,
+        store=store,
+        cache=cache,
+        path="/",
+        warm_queries=[q["query"] for q in example_queries.values()],
+    )
+    app.add_middleware(
+        fastapi.middleware.cors.CORSMiddleware,
+        allow_origins=["*"],
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+    return app
+
+
+class ReloadingApp:
+    """ASGI application serving a store that is replaced when its sources change.
+
+    A background thread checks the modification time and size of each
+    local source every interval seconds. When the content of any has
+    changed, a copy of the store with the changed sources parsed again is
+    built by VocabularyStore.reloaded, and an application for it replaces
+    the current one. Each request is answered by the application current
+    when it arrived, so requests in flight finish against the old store.
+    All applications share one QueryPool, which starts workers for the
+    new store on its first query.
+    """
+
+    def __init__(
+        self,
+        store: vocab_tools.VocabularyStore,
+        sources: typing.Iterable[str],
+        config: typing.Optional[ServiceConfig] = None,
+        interval: float = WATCH_INTERVAL,
+    ):
+        self.config = ServiceConfig() if config is None else config
+        self.sources = [s for s in sources if os.path.exists(s)]
+        self.interval = interval
+        self.store = store
+        self.pool = QueryPool(
+            max_concurrent=self.config.max_concurrent,
+            max_queue=self.config.max_queue,
+            timeout=self.config.timeout,
+            snapshot=self.config.snapshot,
+        )
+        self.app = create_app(store, config=self.config, pool=self.pool)
+        self.reloads = 0
+        # Source -> (modification time, size) when last checked, empty so
+        # the first check compares content hashes, e.g. of a stale snapshot
+        self._stats: typing.Dict[str, typing.Optional[typing.Tuple[int, int]]] = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    async def __call__(self, scope, receive, send):
+        app = self.app
+        if scope["type"] == "lifespan":
+            receive = self._lifespan(receive)
+        await app(scope, receive, send)
+
+    def _lifespan(self, receive):
+        async def _receive():
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                self.start()
+            elif message["type"] == "lifespan.shutdown":
+                self.stop()
+            return message
+
+        return _receive
+
+    def start(self):
+        """Start checking the sources in a background thread."""
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._watch, name="sparqlr-watch", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread = None
+
+    def _watch(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.check()
+            except Exception:
+                L.exception("Reloading sources failed")
+
+    def _stat(self) -> typing.Dict[str, typing.Optional[typing.Tuple[int, int]]]:
+        stats = {}
+        for source in self.sources:
+            try:
+                st = os.stat(source)
+                stats[source] = (st.st_mtime_ns, st.st_size)
+            except OSError:
+                stats[source] = None
+        return stats
+
+    def check(self) -> bool:
+        """Reload the store if the content of any source has changed.
+
+        Returns True if the store was replaced.
+        """
+        stats = self._stat()
+        if stats == self._stats:
+            return False
+        changed = self.store.changed_sources(s for s in self.sources if stats[s] is not None)
+        if len(changed) == 0:
+            self._stats = stats
+            return False
+        L.info("Reloading %s", ", ".join(changed))
+        store = self.store.reloaded(self.sources)
+        # Build the tables used by the lookup API before the store is used
+        store.concept_index()
+        store.hierarchy()
+        self.swap(store)
+        # Only recorded once reloaded, so a failed reload is tried again
+        self._stats = stats
+        return True
+
+    def swap(self, store: vocab_tools.VocabularyStore):
+        """Answer requests arriving from now on from store."""
+        app = create_app(store, config=self.config, pool=self.pool)
+        self.store = store
+        self.app = app
+        self.reloads += 1
+        L.info("Now serving %s triples", len(store))
+
+
+def app_from_environment():
+    """Return the application for a worker process, configured from CONFIG_ENV."""
+    config = ServiceConfig(**json.loads(os.environ[CONFIG_ENV]))
+    store = vocab_tools.VocabularyStore.from_snapshot(config.snapshot)
+    L.info("Worker %s loaded %s triples from %s", os.getpid(), len(store), config.snapshot)
+    if config.watch_interval is not None:
+        return ReloadingApp(store, config.sources, config=config, interval=config.watch_interval)
+    return create_app(store, config=config)
+
+
+def run_service(
+    store: vocab_tools.VocabularyStore,
+    port: int = 9000,
+    host: str = "localhost",
+    cache_size: int = RESULT_CACHE_SIZE,
+    workers: int = 1,
+    max_concurrent: int = 1,
+    max_queue: int = 32,
+    timeout: typing.Optional[float] = 30.0,
+    snapshot: typing.Optional[str] = None,
+    sources: typing.Iterable[str] = (),
+    watch_interval: typing.Optional[float] = None,
+) -> None:
+    """Serve store until interrupted.
+
+    With more than one worker, each worker process loads the store from
+    snapshot, which must be current for the store. If snapshot is None, a
+    temporary snapshot of store is written and removed on exit.
+
+    If watch_interval is set, each worker reloads changed sources as
+    described for ReloadingApp.
+    """
+    config = ServiceConfig(
+        snapshot=snapshot,
+        cache_size=cache_size,
+        max_concurrent=max_concurrent,
+        max_queue=max_queue,
+        timeout=timeout,
+        sources=list(sources),
+        watch_interval=watch_interval,
+    )
+    if workers <= 1:
+        if watch_interval is not None:
+            app = ReloadingApp(store, config.sources, config=config, interval=watch_interval)
+        else:
+            app = create_app(store, config=config)
+        uvicorn.run(app, host=host, port=port)
+        return
+    temporary = None
+    if config.snapshot is None:
+        fd, temporary = tempfile.mkstemp(suffix=".snapshot")
+        os.close(fd)
+        store.save_snapshot(temporary)
+        config.snapshot = temporary
+    os.environ[CONFIG_ENV] = json.dumps(dataclasses.asdict(config))
+    try:
+        uvicorn.run(
+            "vocab_tools.sparqlr:app_from_environment",
+            factory=True,
+            host=host,
+            port=port,
+            workers=workers,
+        )
+    finally:
+        if temporary is not None:
+            os.remove(temporary)
@@ -1,29 +1,53 @@
 """
 Generate markdown representation of a vocabulary.
 """
+import concurrent.futures
 import datetime
+import hashlib
+import json
 import logging
+import os
+import re
+import tempfile
 import typing
 
 import rich.tree
 
 import vocab_tools
+import vocab_tools.profiling
 
 L = logging.getLogger("tomarkdown")
 
+# Approximate number of characters written at a time by write_vocabulary
+DEFAULT_BUFFER_SIZE = 65536
+
+# Change when the rendered markdown changes, to invalidate cached documents
+RENDER_VERSION = "1"
+
+# The generated date in the frontmatter of a document
+_FRONTMATTER_DATE = re.compile(r'^date: ".*"$', re.MULTILINE)
+
+
+def _date_line() -> str:
+    return f'date: "{datetime.datetime.now().replace(tzinfo=datetime.timezone.utc).isoformat()}"'
+
 def concept_tree(
     top_concept_uri: str,
-    concepts: typing.List[vocab_tools.VocabularyConcept],
+    concepts: typing.Union[
+        typing.List[vocab_tools.VocabularyConcept], vocab_tools.ConceptIndex
+    ],
     level: int = 0,
 ):
+    concepts = vocab_tools.ConceptIndex.wrap(concepts)
+
     def _narrower(concept: vocab_tools.VocabularyConcept, llevel=0):
         for narrower_uri in concept.narrower:
-            c = vocab_tools.find_concept_in_concept_list(narrower_uri, concepts)
+            c = concepts.get(narrower_uri)
             if c is not None:
                 yield c, llevel + 1
-            yield from _narrower(c, llevel=llevel + 1)
+                yield from _narrower(c, llevel=llevel + 1)
 
-    top_concept = vocab_tools.find_concept_in_concept_list(top_concept_uri, concepts)
+    top_concept = concepts.get(top_concept_uri)
     yield top_concept, level
     yield from _narrower(top_concept, llevel=level)
 
@@ -33,10 +57,43 @@ def describe_concept(
     concept: vocab_tools.VocabularyConcept,
     level: int = 0,
     is_top_concept: bool = False,
-    concept_list: typing.Optional[typing.List[vocab_tools.VocabularyConcept]] = None,
+    concept_list: typing.Union[
+        typing.List[vocab_tools.VocabularyConcept], vocab_tools.ConceptIndex, None
+    ] = None,
+    part_of: typing.Optional[str] = None,
 ) -> typing.List[str]:
-    if concept_list is None:
-        concept_list = []
+    """Return lines of markdown describing concept.
+
+    part_of is the vocabulary of the document when each vocabulary has its
+    own file. Links to concepts of other vocabularies then point to the
+    vocabulary_filename() of their vocabulary.
+    """
+    with vocab_tools.profiling.phase(store.profiler, "markdown.concept"):
+        return _describe_concept(store, concept, level, is_top_concept, concept_list, part_of)
+
+
+def _part_link(
+    store: vocab_tools.VocabularyStore,
+    concept_list: vocab_tools.ConceptIndex,
+    uri: str,
+    part_of: str,
+) -> typing.Optional[str]:
+    document = ""
+    vocabulary = concept_list.vocabulary(uri)
+    if vocabulary is not None and vocabulary != str(part_of):
+        document = vocabulary_filename(store, vocabulary)
+    return concept_list.md_link(uri, fixed_width=True, document=document)
+
+
+def _describe_concept(
+    store: vocab_tools.VocabularyStore,
+    concept: vocab_tools.VocabularyConcept,
+    level: int,
+    is_top_concept: bool,
+    concept_list,
+    part_of: typing.Optional[str],
+) -> typing.List[str]:
+    concept_list = vocab_tools.ConceptIndex.wrap(concept_list)
     res = [
         f"{'#' * level} {concept.get_label()}",
         "[]{#" + concept.md_link_label() + "}",
@@ -57,19 +114,25 @@ def describe_concept(
         labels = []
         for uri in path:
             #c = store.concept(uri)
-            c = vocab_tools.find_concept_in_concept_list(uri, concept_list)
-            if not c is None:
-                labels.append(c.md_link(fixed_width=True))
+            if part_of is None:
+                link = concept_list.md_link(uri, fixed_width=True)
+            else:
+                link = _part_link(store, concept_list, uri, part_of)
+            if link is not None:
+                labels.append(link)
         res.append(f"{'` -> `'.join(labels)}")
     res += ("", "")
     if len(concept.narrower) > 0:
         res.append("Immediately narrower concepts: ")
         narrowers = []
         for c in concept.narrower:
-            n = vocab_tools.find_concept_in_concept_list(c, concept_list)
-            if n is not None:
-                narrowers.append(n)
-        res.append(", ".join([n.md_link(fixed_width=True) for n in narrowers]))
+            if part_of is None:
+                link = concept_list.md_link(c, fixed_width=True)
+            else:
+                link = _part_link(store, concept_list, c, part_of)
+            if link is not None:
+                narrowers.append(link)
+        res.append(", ".join(narrowers))
     res += (
         "",
         "**Definition: **",
@@ -109,12 +172,17 @@ def describe_concept(
     return res
 
 
-def describe_vocabulary(
-    store: vocab_tools.VocabularyStore, vocab_uri: str
-) -> list[str]:
-    V: vocab_tools.Vocabulary = store.vocabulary(vocab_uri)
-    # res will be a list of strings for each line in the vocabulary
-    #  description, returned as output from this function.
+def overview_section(
+    store: vocab_tools.VocabularyStore, V: vocab_tools.Vocabulary
+) -> typing.List[str]:
+    """Return the frontmatter and overview lines for vocabulary V."""
+    with vocab_tools.profiling.phase(store.profiler, "markdown.overview"):
+        return _overview_section(store, V)
+
+
+def _overview_section(
+    store: vocab_tools.VocabularyStore, V: vocab_tools.Vocabulary
+) -> typing.List[str]:
     res = []
     title = V.label
     # Markdown frontmatter
@@ -123,7 +191,7 @@ def describe_vocabulary(
         "---",
         "comment: | \n  WARNING: This file is generated. Any edits will be lost!",
         f'title: "{title.strip()}"',
-        f'date: "{datetime.datetime.now().replace(tzinfo=datetime.timezone.utc).isoformat()}"',
+        _date_line(),
         "subtitle: |",
     )
     for row in description:
@@ -136,7 +204,7 @@ def describe_vocabulary(
     )
     # Document content
     res += ("Vocabularies and extensions: ", "")
-    for uri, depth in store.walk_vocab_tree(vocab_uri):
+    for uri, depth in store.walk_vocab_tree(V.uri):
         voc = store.vocabulary(uri)
         res.append(f"{'  '*depth}- `{voc.label}` [`{voc.uri}`]({voc.uri})")
 
@@ -155,53 +223,344 @@ def describe_vocabulary(
         res.append(f"**Source Repository:** {V.sourceRepository}<br />")
 
 
-    # display the hierarchy of concepts in this vocabulary
-    res += (
-        "",
-        "**Concept Hierarchy:**",
-        "",
-    )
-    depth = 1
-    base_vocabulary = store.base_vocabulary()
-    concept_uris = store.concepts()
-    all_concepts = [store.concept(uri) for uri in concept_uris]
-    top_concepts = []
-    try:
-        #top_concepts = [store.top_concept(), ]
-        top_concepts = store.top_concept()
-
-        L.debug(f"count Top concepts: {len(top_concepts)}")
-    except ValueError as e:
-        L.warning("No top level concept found.")
-        # Since there's no top concept available, find the concepts
-        # where the parent lineage is shortest and use those as starting
-        # points to traverse the vocabulary
-        res += (
-            "> **Note**",
-            "> No top level concept is available in the loaded vocabularies. ",
-            "> Hierarchy is generated from the broadest concepts available.",
+    return res
+
+
+def iter_vocabulary(
+    store: vocab_tools.VocabularyStore,
+    vocab_uri: str,
+) -> typing.Iterator[typing.List[str]]:
+    """Yield the markdown description of a vocabulary section by section.
+
+    Each section is a list of lines. The frontmatter and overview come
+    first, then the concept hierarchy, then one section per concept.
+    """
+    V: vocab_tools.Vocabulary = store.vocabulary(vocab_uri)
+    yield overview_section(store, V)
+    with vocab_tools.profiling.phase(store.profiler, "markdown.hierarchy"):
+        # display the hierarchy of concepts in this vocabulary
+        res = [
             "",
-        )
-        for concept in all_concepts:
-            broaders = [c for c in store.walk_broader(concept.uri)]
-            if len(broaders) < 3:
-                top_concepts.append(concept)
-    for top_concept in top_concepts:
+            "**Concept Hierarchy:**",
+            "",
+        ]
+        depth = 1
+        base_vocabulary = store.base_vocabulary()
+        all_concepts = store.concept_index()
+        top_concepts = []
+        try:
+            #top_concepts = [store.top_concept(), ]
+            top_concepts = store.top_concept()
+
+            L.debug(f"count Top concepts: {len(top_concepts)}")
+        except ValueError as e:
+            L.warning("No top level concept found.")
+            # Since there's no top concept available, find the concepts
+            # where the parent lineage is shortest and use those as starting
+            # points to traverse the vocabulary
+            res += (
+                "> **Note**",
+                "> No top level concept is available in the loaded vocabularies. ",
+                "> Hierarchy is generated from the broadest concepts available.",
+                "",
+            )
+            for concept in all_concepts:
+                broaders = [c for c in store.walk_broader(concept.uri)]
+                if len(broaders) < 3:
+                    top_concepts.append(concept)
+        for top_concept in top_concepts:
 
-        L.debug(f"Top concept.uri: {top_concept.uri}")
-        for concept, level in concept_tree(top_concept.uri, all_concepts, level=depth):
-            label = f"{'  '*level}- [{concept.get_label()}](#{concept.md_link_label()})"
-            res.append(label)
-        res += ("", "")
+            L.debug(f"Top concept.uri: {top_concept.uri}")
+            for concept, level in concept_tree(top_concept.uri, all_concepts, level=depth):
+                label = f"{'  '*level}- [{concept.get_label()}](#{concept.md_link_label()})"
+                res.append(label)
+            res += ("", "")
+    yield res
     for top_concept in top_concepts:
-        res += describe_concept(store, top_concept, level=2, is_top_concept=True, concept_list=all_concepts)
+        res = describe_concept(store, top_concept, level=2, is_top_concept=True, concept_list=all_concepts)
     #res += top_concept.markdown(level=2, concept_list=all_concepts)
         res.append("")
+        yield res
     #for top_concept in top_concepts:
         for uri, level in store.walk_narrower(top_concept.uri, level=3):
             L.debug(f"walk narrower, uri: {uri}, level: {level}")
-            concept = vocab_tools.find_concept_in_concept_list(uri, all_concepts)
+            concept = all_concepts.get(uri)
             #res += concept.markdown(level=level, concept_list=all_concepts)
-            res += describe_concept(store, concept, level=level, concept_list=all_concepts)
+            res = describe_concept(store, concept, level=level, concept_list=all_concepts)
             res.append("")
+            yield res
+
+
+def describe_vocabulary(
+    store: vocab_tools.VocabularyStore,
+    vocab_uri: str,
+) -> list[str]:
+    """Return the lines of the markdown description of a vocabulary."""
+    res = []
+    for section in iter_vocabulary(store, vocab_uri):
+        res += section
     return res
+
+
+def iter_vocabulary_part(
+    store: vocab_tools.VocabularyStore,
+    vocab_uri: str,
+) -> typing.Iterator[typing.List[str]]:
+    """Yield the markdown description of only the concepts defined in a vocabulary.
+
+    Sections are as for iter_vocabulary. For an extension, the concepts of
+    other vocabularies that it extends are listed, and the hierarchy starts
+    from the extension concepts directly beneath them. Links to concepts of
+    other vocabularies point to the vocabulary_filename() of their vocabulary.
+    """
+    V: vocab_tools.Vocabulary = store.vocabulary(vocab_uri)
+    yield overview_section(store, V)
+    with vocab_tools.profiling.phase(store.profiler, "markdown.hierarchy"):
+        all_concepts = store.concept_index()
+        members = store.concept_index(vocab_uri)
+        # Concepts of the vocabulary with no broader concept in the vocabulary
+        roots = []
+        extended = []
+        for concept in members:
+            outside = [uri for uri in concept.broader if uri not in members]
+            if len(outside) < len(concept.broader):
+                continue
+            roots.append(concept)
+            for uri in outside:
+                if uri not in extended:
+                    extended.append(uri)
+        res = []
+        if len(extended) > 0:
+            res += (
+                "",
+                "**Extended concepts:**",
+                "",
+            )
+            for uri in extended:
+                c = all_concepts.get(uri)
+                if c is None:
+                    res.append(f"- [`{uri}`]({uri})")
+                else:
+                    document = ""
+                    if c.vocabulary is not None:
+                        document = vocabulary_filename(store, c.vocabulary)
+                    link = all_concepts.md_link(uri, fixed_width=True, document=document)
+                    res.append(f"- {link} [`{uri}`]({uri}) in vocabulary `{c.vocabulary}`")
+        res += (
+            "",
+            "**Concept Hierarchy:**",
+            "",
+        )
+        for root in roots:
+            for concept, level in concept_tree(root.uri, members, level=1):
+                res.append(f"{'  '*level}- [{concept.get_label()}](#{concept.md_link_label()})")
+            res += ("", "")
+    yield res
+    for root in roots:
+        res = describe_concept(
+            store, root, level=2, is_top_concept=len(root.broader) == 0,
+            concept_list=all_concepts, part_of=vocab_uri,
+        )
+        res.append("")
+        yield res
+        for uri, level in store.walk_narrower(root.uri, level=3):
+            concept = members.get(uri)
+            if concept is None:
+                continue
+            res = describe_concept(
+                store, concept, level=level, concept_list=all_concepts, part_of=vocab_uri
+            )
+            res.append("")
+            yield res
+
+
+def write_sections(
+    sections: typing.Iterable[typing.List[str]],
+    dest: typing.TextIO,
+    buffer_size: int = DEFAULT_BUFFER_SIZE,
+) -> int:
+    """Write sections of lines to dest as they are produced.
+
+    Sections are gathered into chunks of about buffer_size characters, and
+    each chunk is written and flushed as soon as it is full.
+
+    Returns the number of lines written.
+    """
+    chunk = []
+    size = 0
+    n_lines = 0
+    for section in sections:
+        for line in section:
+            chunk.append(line)
+            chunk.append("\n")
+            size += len(line) + 1
+        n_lines += len(section)
+        if size >= buffer_size:
+            dest.write("".join(chunk))
+            dest.flush()
+            chunk = []
+            size = 0
+    if len(chunk) > 0:
+        dest.write("".join(chunk))
+        dest.flush()
+    return n_lines
+
+
+def write_vocabulary(
+    store: vocab_tools.VocabularyStore,
+    vocab_uri: str,
+    dest: typing.TextIO,
+    buffer_size: int = DEFAULT_BUFFER_SIZE,
+    part: bool = False,
+) -> int:
+    """Write the markdown description of a vocabulary to dest as it is rendered.
+
+    If part is True, only the concepts defined in the vocabulary are
+    described (see iter_vocabulary_part).
+
+    Returns the number of lines written.
+    """
+    if part:
+        sections = iter_vocabulary_part(store, vocab_uri)
+    else:
+        sections = iter_vocabulary(store, vocab_uri)
+    return write_sections(sections, dest, buffer_size=buffer_size)
+
+
+def vocabulary_filename(store: vocab_tools.VocabularyStore, vocab_uri: str) -> str:
+    """Return a markdown file name for the vocabulary, based on its compact name."""
+    name = store.compact_name(vocab_uri)
+    if name.startswith("<"):
+        name = "_".join(str(vocab_uri).rstrip("/#").split("/")[-2:])
+    return re.sub(r"[^A-Za-z0-9_.-]+", "_", name).strip("_") + ".md"
+
+
+# Store used by the worker processes of write_vocabulary_parts
+_worker_store: typing.Optional[vocab_tools.VocabularyStore] = None
+
+
+def _init_part_worker(snapshot: str):
+    global _worker_store
+    _worker_store = vocab_tools.VocabularyStore.from_snapshot(snapshot)
+
+
+def _write_part(job: typing.Tuple[str, str]) -> str:
+    vocab_uri, path = job
+    with open(path, "w", encoding="utf-8") as dest:
+        write_vocabulary(_worker_store, vocab_uri, dest, part=True)
+    return path
+
+
+def write_vocabulary_parts(
+    store: vocab_tools.VocabularyStore,
+    dest_folder: str,
+    vocab_uris: typing.Optional[typing.List[str]] = None,
+    max_workers: typing.Optional[int] = None,
+) -> typing.List[str]:
+    """Write one markdown file per vocabulary to dest_folder.
+
+    vocab_uris defaults to every vocabulary in the store, base vocabulary
+    first. Links to concepts of other vocabularies point to their files.
+    Files are rendered in max_workers worker processes, by default the
+    number of CPUs, and never more than the number of files. Each worker
+    loads a snapshot of the store written to a temporary file.
+
+    Returns the paths of the files written.
+    """
+    if vocab_uris is None:
+        base = store.base_vocabulary()
+        vocab_uris = [str(uri) for uri, _ in store.walk_vocab_tree(base.uri)]
+        for uri in store.vocabularies():
+            if str(uri) not in vocab_uris:
+                vocab_uris.append(str(uri))
+    os.makedirs(dest_folder, exist_ok=True)
+    jobs = [
+        (uri, os.path.join(dest_folder, vocabulary_filename(store, uri)))
+        for uri in vocab_uris
+    ]
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    max_workers = max(1, min(max_workers, len(jobs)))
+    with tempfile.TemporaryDirectory() as tmp:
+        snapshot = os.path.join(tmp, "vocabularies.snapshot")
+        store.save_snapshot(snapshot)
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=max_workers,
+            initializer=_init_part_worker,
+            initargs=(snapshot,),
+        ) as pool:
+            return list(pool.map(_write_part, jobs))
+
+
+def render_key(sources: typing.Iterable[str], split: bool = False) -> typing.Optional[str]:
+    """Return the RenderCache key for the markdown of sources.
+
+    Hashes the identifier and content of each source, so any change to a
+    source renders every document again. Returns None if a source is not
+    a local file, as its content is unknown until it is loaded.
+    """
+    h = hashlib.sha256()
+
+    def _add(*parts):
+        for part in parts:
+            h.update(str(part).encode("utf-8"))
+            h.update(b"\0")
+
+    _add(RENDER_VERSION, split)
+    n = 0
+    for source in sources:
+        digest = vocab_tools.source_hash(source)
+        if digest is None:
+            return None
+        _add(vocab_tools.source_identifier(source), digest)
+        n += 1
+    if n == 0:
+        return None
+    return h.hexdigest()
+
+
+class RenderCache:
+    """Markdown documents rendered from a set of sources, kept in one JSON file.
+
+    Entries are the documents of a run, keyed by render_key and named by
+    file name, or "-" for the document written to stdout. Documents read
+    back get the current date in their frontmatter. save() only keeps the
+    entries used since the cache was opened.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._entries: typing.Dict[str, typing.Dict[str, str]] = {}
+        self._used: typing.Dict[str, typing.Dict[str, str]] = {}
+        try:
+            with open(path, "r", encoding="utf-8") as src:
+                content = json.load(src)
+            if content.get("version") == RENDER_VERSION:
+                self._entries = content["entries"]
+        except (OSError, ValueError, KeyError, AttributeError) as e:
+            L.debug("Render cache %s not used: %s", path, e)
+
+    def get(self, key: str) -> typing.Optional[typing.Dict[str, str]]:
+        documents = self._entries.get(key)
+        if documents is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._used[key] = documents
+        date = _date_line()
+        return {
+            name: _FRONTMATTER_DATE.sub(lambda _: date, text, count=1)
+            for name, text in documents.items()
+        }
+
+    def put(self, key: str, documents: typing.Dict[str, str]):
+        self._entries[key] = documents
+        self._used[key] = documents
+
+    def save(self):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as dest:
+            json.dump({"version": RENDER_VERSION, "entries": self._used}, dest)
+        os.replace(tmp, self.path)
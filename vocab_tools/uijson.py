@@ -0,0 +1,138 @@
+"""
+Generate the JSON concept tree used by the iSamples WebUI.
+
+The tree is a mapping of concept URI to {"label": {lang: label}, "children": [...]}
+where each child is again a mapping of one concept URI. It is built from
+the concept table and hierarchy of the store, so each concept is visited
+once, and written as it is produced.
+"""
+import json
+import logging
+import typing
+
+import vocab_tools
+import vocab_tools.profiling
+
+L = logging.getLogger("uijson")
+
+# Approximate number of characters written at a time by write_uijson
+DEFAULT_BUFFER_SIZE = 65536
+
+
+# Languages of the labels written by default
+DEFAULT_LANGUAGES = ("en",)
+
+
+def concept_label(
+    store: vocab_tools.VocabularyStore, uri: str, lang: typing.Optional[str] = None
+) -> str:
+    """Return the preferred label of uri in lang, or its compact name if it has none.
+
+    If there is no label in lang, or an untagged label, the first label in
+    any language is used.
+    """
+    label = None
+    if lang is not None:
+        label = store.label_table().label(uri, lang)
+    if label is None:
+        c = store.concept_index().get(uri)
+        if c is not None and len(c.label) > 0:
+            label = c.label[0]
+    if label is None:
+        label = str(store.compact_name(uri))
+    return label
+
+
+def root_concepts(store: vocab_tools.VocabularyStore) -> typing.List[str]:
+    """Return the URIs of the top concepts, in the order found."""
+    return list(dict.fromkeys(str(c.uri) for c in store.top_concept()))
+
+
+def iter_uijson(
+    store: vocab_tools.VocabularyStore,
+    extensions: bool = False,
+    indent: typing.Optional[int] = 2,
+    languages: typing.Sequence[str] = DEFAULT_LANGUAGES,
+) -> typing.Iterator[str]:
+    """Yield the JSON text of the concept tree below the top concepts.
+
+    Without extensions, only concepts of the base vocabulary are included.
+    The label of each concept is given for each of languages. indent is as for json.dumps, with None giving the most compact output.
+    A concept that is its own ancestor is listed but not expanded again.
+    """
+    hierarchy = store.hierarchy()
+    members = None
+    if not extensions:
+        members = store.concept_index(store.base_vocabulary().uri)
+    sep = ":" if indent is None else ": "
+
+    def _pad(level: int) -> str:
+        if indent is None:
+            return ""
+        return "\n" + " " * (indent * level)
+
+    def _entry(uri: str, level: int, path: typing.Set[str]):
+        # "uri": {"label": {lang: label, ...}, "children": [...]} at nesting level
+        labels = ",".join(
+            f"{_pad(level + 2)}{json.dumps(lang)}{sep}{json.dumps(concept_label(store, uri, lang))}"
+            for lang in languages
+        )
+        yield (
+            f"{json.dumps(uri)}{sep}{{{_pad(level + 1)}\"label\"{sep}{{"
+            f"{labels}{_pad(level + 1) if len(languages) > 0 else ''}}},"
+            f"{_pad(level + 1)}\"children\"{sep}["
+        )
+        children = []
+        if uri not in path:
+            children = [
+                str(c) for c in hierarchy.narrower(uri)
+                if members is None or str(c) in members
+            ]
+        path.add(uri)
+        for i, child in enumerate(children):
+            yield f"{',' if i > 0 else ''}{_pad(level + 2)}{{{_pad(level + 3)}"
+            yield from _entry(child, level + 3, path)
+            yield f"{_pad(level + 2)}}}"
+        path.discard(uri)
+        yield f"{_pad(level + 1) if len(children) > 0 else ''}]{_pad(level)}}}"
+
+    roots = [r for r in root_concepts(store) if members is None or r in members]
+    yield "{"
+    for i, root in enumerate(roots):
+        yield f"{',' if i > 0 else ''}{_pad(1)}"
+        yield from _entry(root, 1, set())
+    yield f"{_pad(0)}}}"
+
+
+def write_uijson(
+    store: vocab_tools.VocabularyStore,
+    dest: typing.TextIO,
+    extensions: bool = False,
+    compact: bool = False,
+    buffer_size: int = DEFAULT_BUFFER_SIZE,
+    languages: typing.Sequence[str] = DEFAULT_LANGUAGES,
+) -> int:
+    """Write the concept tree as JSON to dest as it is produced.
+
+    Returns the number of characters written.
+    """
+    chunk = []
+    size = 0
+    total = 0
+    with vocab_tools.profiling.phase(store.profiler, "uijson.write"):
+        parts = iter_uijson(
+            store, extensions=extensions, indent=None if compact else 2, languages=languages
+        )
+        for part in parts:
+            chunk.append(part)
+            size += len(part)
+            if size >= buffer_size:
+                dest.write("".join(chunk))
+                dest.flush()
+                total += size
+                chunk = []
+                size = 0
+        chunk.append("\n")
+        dest.write("".join(chunk))
+        dest.flush()
+    return total + size + 1
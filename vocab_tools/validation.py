@@ -0,0 +1,637 @@
+"""
+SHACL validation of vocabularies.
+
+Shape graphs are parsed once per process, RDFS inference is only run when
+the data has statements that it could act on, and results can be kept in
+a ValidationCache keyed by the content of the sources and shapes.
+"""
+import concurrent.futures
+import dataclasses
+import functools
+import hashlib
+import importlib.resources
+import json
+import logging
+import os
+import time
+import typing
+
+import pyshacl
+import rdflib
+
+import vocab_tools
+import vocab_tools.profiling
+
+DEFAULT_SHAPE = "data/vocabulary_shape.ttl"
+
+# Change when the validation options or result format change, to invalidate cached results
+VALIDATION_VERSION = "1"
+
+# Predicates of statements that RDFS entailment derives new triples from
+RDFS_SCHEMA_PREDICATES = (
+    rdflib.RDFS.subClassOf,
+    rdflib.RDFS.domain,
+    rdflib.RDFS.range,
+)
+
+L = logging.getLogger("validation")
+
+
+@dataclasses.dataclass
+class ValidationResult:
+    """Outcome of validating a graph, as returned by pyshacl.validate.
+
+    inference is the inference mode used, and cached is True if the result
+    was read from a ValidationCache.
+    """
+    conforms: bool
+    graph: rdflib.Graph
+    text: str
+    inference: typing.Optional[str] = None
+    cached: bool = False
+
+    def __iter__(self):
+        # Unpacks as the (conforms, results_graph, results_text) of pyshacl.validate
+        return iter((self.conforms, self.graph, self.text))
+
+
+def shape_path(path: typing.Optional[str] = None) -> str:
+    """Return the path of the SHACL shape file, the packaged shape if path is None."""
+    if path is None:
+        return str(importlib.resources.files(vocab_tools).joinpath(DEFAULT_SHAPE))
+    return path
+
+
+@functools.lru_cache(maxsize=8)
+def _parse_shape(path: str, mtime: float) -> rdflib.Graph:
+    L.debug("Parsing shape %s", path)
+    g = rdflib.ConjunctiveGraph()
+    return g.parse(path)
+
+
+def get_shape(path: typing.Optional[str] = None) -> rdflib.Graph:
+    """Return the SHACL shape as rdflib graph.
+
+    The graph is parsed once and reused until the file is modified. The
+    returned graph is shared and must not be changed.
+    """
+    path = shape_path(path)
+    return _parse_shape(path, os.path.getmtime(path))
+
+
+def needs_rdfs_inference(g: rdflib.Graph) -> bool:
+    """Return True if RDFS inference could add triples relevant to validation of g.
+
+    Class and property targets only gain members through rdfs:subClassOf,
+    rdfs:domain and rdfs:range statements, or through rdfs:subPropertyOf
+    statements about a property used in g. The rdfs:subPropertyOf relations
+    that VocabularyStore records between vocabularies are not used as
+    predicates, so do not require inference.
+    """
+    for p in RDFS_SCHEMA_PREDICATES:
+        for _ in g.triples((None, p, None)):
+            return True
+    for prop in set(g.subjects(rdflib.RDFS.subPropertyOf, None)):
+        for _ in g.triples((None, prop, None)):
+            return True
+    return False
+
+
+def validation_key(
+    sources: typing.Dict[str, str], shape: str, inference: str
+) -> typing.Optional[str]:
+    """Return the cache key for validating sources against the shape file.
+
+    sources is the content hash of each source keyed by identifier, as from
+    VocabularyStore.sources(). Returns None, so the result is not cached,
+    if there are no sources or a source has no content hash, such as a
+    remote URL whose content may change without notice.
+    """
+    if len(sources) == 0 or any(v is None for v in sources.values()):
+        return None
+    h = hashlib.sha256()
+
+    def _add(*parts):
+        for part in parts:
+            h.update(str(part).encode("utf-8"))
+            h.update(b"\0")
+
+    _add(VALIDATION_VERSION, pyshacl.__version__, inference)
+    _add(vocab_tools.source_hash(shape))
+    for source_id in sorted(sources):
+        _add(source_id, sources[source_id])
+    return h.hexdigest()
+
+
+class ValidationCache:
+    """A directory of validation results keyed by validation_key."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(path, exist_ok=True)
+
+    def _entry(self, key: str) -> str:
+        return os.path.join(self.path, f"{key}.json")
+
+    def get(self, key: str) -> typing.Optional[ValidationResult]:
+        try:
+            with open(self._entry(key), "r", encoding="utf-8") as src:
+                entry = json.load(src)
+            g = rdflib.Graph().parse(data=entry["graph"], format="turtle")
+        except (OSError, ValueError, KeyError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return ValidationResult(
+            conforms=entry["conforms"],
+            graph=g,
+            text=entry["text"],
+            inference=entry.get("inference"),
+            cached=True,
+        )
+
+    def put(self, key: str, result: ValidationResult):
+        entry = {
+            "conforms": result.conforms,
+            "text": result.text,
+            "inference": result.inference,
+            "graph": result.graph.serialize(format="turtle"),
+        }
+        tmp = self._entry(key) + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as dest:
+            json.dump(entry, dest)
+        os.replace(tmp, self._entry(key))
+
+
+def validate_graph(
+    g: rdflib.Graph,
+    shape: typing.Optional[str] = None,
+    inference: typing.Optional[str] = "auto",
+) -> ValidationResult:
+    """Validate g against the SHACL shape file.
+
+    inference is passed to pyshacl, except "auto" which is "rdfs" only if
+    needs_rdfs_inference(g), otherwise None.
+    """
+    if inference == "auto":
+        inference = "rdfs" if needs_rdfs_inference(g) else None
+    conforms, results_graph, results = pyshacl.validate(
+        g,
+        shacl_graph=get_shape(shape),
+        inference=inference,
+        abort_on_first=False,
+        allow_warnings=True,
+        meta_shacl=False,
+        advanced=True,
+        js=False,
+        debug=False,
+    )
+    return ValidationResult(
+        conforms=conforms, graph=results_graph, text=results, inference=inference
+    )
+
+
+def validate_store(
+    store: vocab_tools.VocabularyStore,
+    shape: typing.Optional[str] = None,
+    inference: typing.Optional[str] = "auto",
+    cache: typing.Optional[ValidationCache] = None,
+) -> ValidationResult:
+    """Validate the content of store against the SHACL shape file.
+
+    If cache is provided, the result for the same sources, shape and
+    inference mode is reused instead of validating again.
+    """
+    key = None
+    if cache is not None:
+        key = validation_key(store.sources(), shape_path(shape), str(inference))
+        if key is not None:
+            result = cache.get(key)
+            if result is not None:
+                return result
+    with vocab_tools.profiling.phase(store.profiler, "validate.shacl"):
+        result = validate_graph(store.graph, shape=shape, inference=inference)
+    if key is not None:
+        cache.put(key, result)
+    return result
+
+
+SH = rdflib.namespace.SH
+SKOS = rdflib.namespace.SKOS
+# Severity given to concept definitions in the packaged shape file. It is not
+# sh:Warning, so pySHACL counts a missing definition against conformance.
+SHAPE_DEFINITION_SEVERITY = rdflib.URIRef(str(SH) + "warning")
+# The shapes of the packaged vocabulary shape file are named in the skos namespace
+SHAPE = rdflib.Namespace(str(SKOS))
+# Namespace of the checks made by check_structure that have no equivalent shape
+VT = rdflib.Namespace("urn:vocab_tools:")
+
+
+class _Report:
+    """Collects results in the structure of a pySHACL validation report."""
+
+    def __init__(self, namespace_manager: rdflib.namespace.NamespaceManager):
+        self.graph = rdflib.Graph(namespace_manager=namespace_manager)
+        self.report = rdflib.BNode()
+        self.graph.add((self.report, rdflib.RDF.type, SH.ValidationReport))
+        self.text = []
+        self.violations = 0
+
+    def _n3(self, term) -> str:
+        if isinstance(term, rdflib.BNode):
+            return str(term)
+        return term.n3(self.graph.namespace_manager)
+
+    def add(
+        self,
+        focus,
+        shape,
+        component,
+        message: str,
+        path=None,
+        value=None,
+        severity=SH.Violation,
+    ):
+        r = rdflib.BNode()
+        g = self.graph
+        g.add((self.report, SH.result, r))
+        g.add((r, rdflib.RDF.type, SH.ValidationResult))
+        g.add((r, SH.focusNode, focus))
+        g.add((r, SH.resultSeverity, severity))
+        g.add((r, SH.sourceShape, shape))
+        g.add((r, SH.sourceConstraintComponent, component))
+        g.add((r, SH.resultMessage, rdflib.Literal(message)))
+        desc = "Constraint Violation" if severity == SH.Violation else "Validation Result"
+        name = str(component).split("#")[-1].rsplit(":", 1)[-1]
+        text = (
+            f"{desc} in {name} ({component}):\n"
+            f"\tSeverity: {self._n3(severity)}\n"
+            f"\tSource Shape: {self._n3(shape)}\n"
+            f"\tFocus Node: {self._n3(focus)}\n"
+        )
+        if value is not None:
+            g.add((r, SH.value, value))
+            text += f"\tValue Node: {self._n3(value)}\n"
+        if path is not None:
+            g.add((r, SH.resultPath, path))
+            text += f"\tResult Path: {self._n3(path)}\n"
+        text += f"\tMessage: {message}\n"
+        self.text.append(text)
+        # As pySHACL with allow_warnings, only warnings and infos are allowed
+        if severity not in (SH.Warning, SH.Info):
+            self.violations += 1
+
+    def result(self) -> ValidationResult:
+        conforms = self.violations == 0
+        self.graph.add((self.report, SH.conforms, rdflib.Literal(conforms)))
+        text = f"Validation Report\nConforms: {conforms}\n"
+        if len(self.text) > 0:
+            text += f"Results ({len(self.text)}):\n"
+        text += "".join(sorted(self.text))
+        return ValidationResult(conforms=conforms, graph=self.graph, text=text)
+
+
+def _is_lang_string(term) -> bool:
+    return isinstance(term, rdflib.Literal) and term.language is not None
+
+
+# Predicates read by check_structure
+_STRUCTURE_PREDICATES = (
+    SKOS.prefLabel,
+    SKOS.definition,
+    SKOS.inScheme,
+    SKOS.broader,
+    SKOS.narrower,
+    SKOS.related,
+    SKOS.topConceptOf,
+    SKOS.hasTopConcept,
+)
+
+
+# Classes whose instances are listed by check_structure
+_STRUCTURE_TYPES = (SKOS.ConceptScheme, SKOS.Concept)
+
+
+class _Values:
+    """Objects of the structure predicates by subject, and instances of the
+    structure types in the order found, read in a single pass over g."""
+
+    def __init__(self, g: rdflib.Graph):
+        self._values = {p: {} for p in _STRUCTURE_PREDICATES}
+        self._instances = {t: {} for t in _STRUCTURE_TYPES}
+        values = self._values.get
+        instances = self._instances.get
+        rdf_type = {rdflib.RDF.type}
+        for s, p, o in g.triples((None, None, None)):
+            table = values(p)
+            if table is not None:
+                table.setdefault(s, []).append(o)
+            elif p in rdf_type:
+                subjects = instances(o)
+                if subjects is not None:
+                    subjects[s] = None
+
+    def get(self, s, p) -> list:
+        return self._values[p].get(s, [])
+
+    def subjects(self, p) -> typing.Iterable:
+        return self._values[p].keys()
+
+    def objects(self, p) -> typing.Set:
+        return {o for values in self._values[p].values() for o in values}
+
+    def instances(self, t) -> typing.List:
+        return list(self._instances[t])
+
+
+def _check_label(report, values, focus, shape, path, severity):
+    """minCount 1 and datatype rdf:langString on focus path."""
+    values = values.get(focus, path)
+    if len(values) == 0:
+        report.add(
+            focus, shape, SH.MinCountConstraintComponent,
+            f"Less than 1 values on {report._n3(focus)}->{report._n3(path)}",
+            path=path, severity=severity,
+        )
+    for v in values:
+        if not _is_lang_string(v):
+            report.add(
+                focus, shape, SH.DatatypeConstraintComponent,
+                f"Value is not Literal with datatype rdf:langString",
+                path=path, value=v, severity=severity,
+            )
+
+
+def check_structure(
+    store: vocab_tools.VocabularyStore, focus: typing.Optional[rdflib.Graph] = None
+) -> ValidationResult:
+    """Check the structure of the vocabularies in store without SHACL.
+
+    Applies the rules of the packaged vocabulary shape, and also reports
+    terms referenced by concepts that are not defined, skos:broader cycles,
+    and concepts not connected to a top concept. Only the schemes and
+    concepts in focus are checked, by default everything in store. Terms
+    are resolved against the whole store.
+
+    The result has the same structure as from validate_graph.
+    """
+    g = store.graph
+    if focus is None:
+        focus = g
+    report = _Report(g.namespace_manager)
+    values = _Values(g)
+    focus_schemes = values.instances(SKOS.ConceptScheme)
+    focus_concepts = values.instances(SKOS.Concept)
+    schemes = set(focus_schemes)
+    concepts = set(focus_concepts)
+    if focus is not g:
+        focus_schemes = list(dict.fromkeys(focus.subjects(rdflib.RDF.type, SKOS.ConceptScheme)))
+        focus_concepts = list(dict.fromkeys(focus.subjects(rdflib.RDF.type, SKOS.Concept)))
+    has_members = values.objects(SKOS.inScheme)
+    has_top_concept = values.objects(SKOS.topConceptOf)
+
+    n = len(focus_schemes)
+    if n != 1:
+        report.add(
+            SKOS.ConceptScheme, SHAPE.VocabularyConceptSchemeShape,
+            SH.MinCountConstraintComponent if n < 1 else SH.MaxCountConstraintComponent,
+            f"{'Less' if n < 1 else 'More'} than 1 values on skos:ConceptScheme->^rdf:type",
+        )
+
+    def _scheme_results(scheme, into):
+        _check_label(into, values, scheme, SHAPE.VocabularyShape, SKOS.prefLabel, SH.Warning)
+        _check_label(into, values, scheme, SHAPE.VocabularyShape, SKOS.definition, SH.Warning)
+        in_scheme = values.get(scheme, SKOS.inScheme)
+        is_extension = (
+            len(in_scheme) == 1
+            and isinstance(in_scheme[0], rdflib.URIRef)
+            and scheme in has_members
+        )
+        is_base = len(in_scheme) == 0 and scheme in has_top_concept
+        if not (is_extension or is_base):
+            into.add(
+                scheme, SHAPE.VocabularyShape, SH.OrConstraintComponent,
+                f"Node {into._n3(scheme)} must conform to one or more shapes in "
+                "skos:ExtensionVocabularyShape , skos:BaseVocabularyShape",
+                value=scheme,
+            )
+        for v in in_scheme:
+            if v not in schemes:
+                into.add(
+                    scheme, VT.ResolvableShape, VT.ResolvableConstraintComponent,
+                    f"Unresolved term {into._n3(v)} on {into._n3(scheme)}->skos:inScheme",
+                    path=SKOS.inScheme, value=v,
+                )
+
+    conforming_schemes = {}
+
+    def _scheme_conforms(scheme) -> bool:
+        # The sh:node constraint of TopConceptShape, without reporting
+        if scheme not in conforming_schemes:
+            r = _Report(g.namespace_manager)
+            _scheme_results(scheme, r)
+            conforming_schemes[scheme] = len(r.text) == 0
+        return conforming_schemes[scheme]
+
+    for scheme in focus_schemes:
+        _scheme_results(scheme, report)
+
+    references = (
+        (SKOS.broader, concepts),
+        (SKOS.narrower, concepts),
+        (SKOS.related, concepts),
+        (SKOS.inScheme, schemes),
+        (SKOS.topConceptOf, schemes),
+    )
+    # Namespace attributes are looked up once, not for each concept
+    concept_shape = SHAPE.VocabularyConceptShape
+    pref_label, definition = SKOS.prefLabel, SKOS.definition
+    in_scheme_p, broader_p, top_of_p = SKOS.inScheme, SKOS.broader, SKOS.topConceptOf
+    violation = SH.Violation
+    for concept in focus_concepts:
+        _check_label(report, values, concept, concept_shape, pref_label, violation)
+        _check_label(report, values, concept, concept_shape, definition, SHAPE_DEFINITION_SEVERITY)
+        in_scheme = values.get(concept, in_scheme_p)
+        broader = values.get(concept, broader_p)
+        top_of = values.get(concept, top_of_p)
+        is_narrower = len(in_scheme) > 0 and len(broader) > 0
+        is_top = (
+            len(top_of) == 1
+            and len(broader) == 0
+            and len(in_scheme) == 0
+            and _scheme_conforms(top_of[0])
+        )
+        if not (is_narrower or is_top):
+            report.add(
+                concept, SHAPE.VocabularyConceptShape, SH.OrConstraintComponent,
+                f"Node {report._n3(concept)} must conform to one or more shapes in "
+                "skos:NarrowerConceptShape , skos:TopConceptShape",
+                value=concept,
+            )
+        for path, defined in references:
+            for v in values.get(concept, path):
+                if v not in defined:
+                    report.add(
+                        concept, VT.ResolvableShape, VT.ResolvableConstraintComponent,
+                        f"Unresolved term {report._n3(v)} on {report._n3(concept)}->{report._n3(path)}",
+                        path=path, value=v,
+                    )
+
+    hierarchy = store.hierarchy()
+    focus_set = set(focus_concepts)
+    for cycle in hierarchy.cycles():
+        members = [c for c in cycle if c in focus_set]
+        if len(members) == 0:
+            continue
+        labels = " -> ".join(report._n3(c) for c in cycle + cycle[:1])
+        report.add(
+            members[0], VT.AcyclicShape, VT.AcyclicConstraintComponent,
+            f"Cycle of skos:broader: {labels}",
+            path=SKOS.broader,
+        )
+
+    # Concepts below an undefined broader term are reported as unresolved,
+    # not as disconnected.
+    starts = set(values.subjects(SKOS.topConceptOf))
+    starts.update(values.objects(SKOS.hasTopConcept))
+    starts.update(c for c in values.objects(SKOS.broader) if c not in concepts)
+    connected = set(starts)
+    for start in starts:
+        connected.update(hierarchy.descendants(start))
+    for concept in focus_concepts:
+        if concept not in connected:
+            report.add(
+                concept, VT.ConnectedShape, VT.ConnectedConstraintComponent,
+                f"Concept {report._n3(concept)} is not connected to a top concept",
+                path=SKOS.broader,
+            )
+    return report.result()
+
+
+@dataclasses.dataclass
+class SourceReport:
+    """Result of validating one source in validate_sources.
+
+    bases are the sources loaded to resolve its terms, stage is "shacl" or
+    "structure" for the check that decided the result, and error is set if
+    the source could not be validated.
+    """
+    source: str
+    conforms: bool
+    text: str
+    seconds: float
+    bases: typing.List[str] = dataclasses.field(default_factory=list)
+    stage: typing.Optional[str] = None
+    cached: bool = False
+    error: typing.Optional[str] = None
+
+
+def _declared_schemes(source: str) -> typing.Tuple[typing.List[str], typing.List[str]]:
+    """Return the concept schemes of source and the schemes they are skos:inScheme.
+
+    Runs in a worker process for validate_sources.
+    """
+    g = rdflib.Graph(bind_namespaces="none")
+    g.parse(source, format=vocab_tools.VocabularyStore.DEFAULT_FORMAT)
+    schemes = [str(v) for v in g.subjects(rdflib.RDF.type, SKOS.ConceptScheme)]
+    extended = [str(v) for scheme in schemes for v in g.objects(rdflib.URIRef(scheme), SKOS.inScheme)]
+    return schemes, extended
+
+
+def declared_bases(
+    declarations: typing.Dict[str, typing.Tuple[typing.List[str], typing.List[str]]]
+) -> typing.Dict[str, typing.List[str]]:
+    """Return the sources each source builds on, base vocabulary first.
+
+    declarations is (schemes, extended schemes) keyed by source, as from
+    _declared_schemes. Extended schemes not defined by any of the sources
+    are ignored.
+    """
+    defined_by = {}
+    for source, (schemes, _) in declarations.items():
+        for scheme in schemes:
+            defined_by.setdefault(scheme, source)
+    res = {}
+    for source in declarations:
+        bases = []
+        pending = [source]
+        while pending:
+            for scheme in declarations[pending.pop()][1]:
+                base = defined_by.get(scheme)
+                if base is None:
+                    L.warning("%s extends %s which is not in the batch", source, scheme)
+                elif base != source and base not in bases:
+                    bases.append(base)
+                    pending.append(base)
+        bases.reverse()
+        res[source] = bases
+    return res
+
+
+def _validate_source(job: tuple) -> SourceReport:
+    """Validate one source of validate_sources, in a worker process."""
+    source, bases, shape, inference, fast, cache_dir = job
+    t0 = time.perf_counter()
+    report = SourceReport(source=source, conforms=False, text="", seconds=0.0, bases=bases)
+    try:
+        store = vocab_tools.VocabularyStore()
+        store.load(source)
+        if not fast:
+            cache = None if cache_dir is None else ValidationCache(cache_dir)
+            result = validate_store(store, shape=shape, inference=inference, cache=cache)
+            report.stage = "shacl"
+            report.cached = result.cached
+        if fast or result.conforms:
+            store.load_many(bases)
+            result = check_structure(store, focus=store.source_graph(source))
+            report.stage = "structure"
+        report.conforms = result.conforms
+        report.text = result.text
+    except Exception as e:
+        L.exception("Validation of %s failed", source)
+        report.error = f"{type(e).__name__}: {e}"
+    report.seconds = time.perf_counter() - t0
+    return report
+
+
+def validate_sources(
+    sources: typing.Iterable[str],
+    shape: typing.Optional[str] = None,
+    inference: typing.Optional[str] = "auto",
+    fast: bool = False,
+    cache_dir: typing.Optional[str] = None,
+    max_workers: typing.Optional[int] = None,
+    fail_fast: bool = False,
+) -> typing.List[SourceReport]:
+    """Validate each of sources in worker processes.
+
+    Each source is validated as by the validate command, with the sources
+    defining the vocabularies it extends loaded to resolve its terms. With
+    fail_fast, sources not yet started are skipped once one does not conform.
+
+    Returns the reports in the order of sources, without skipped sources.
+    """
+    sources = list(dict.fromkeys(sources))
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as pool:
+        declarations = dict(zip(sources, pool.map(_declared_schemes, sources)))
+        bases = declared_bases(declarations)
+        futures = {
+            pool.submit(
+                _validate_source,
+                (source, bases[source], shape, inference, fast, cache_dir),
+            ): source
+            for source in sources
+        }
+        reports = {}
+        for future in concurrent.futures.as_completed(futures):
+            if future.cancelled():
+                continue
+            report = future.result()
+            reports[report.source] = report
+            if fail_fast and not report.conforms:
+                for f in futures:
+                    f.cancel()
+                break
+    return [reports[source] for source in sources if source in reports]